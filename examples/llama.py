@@ -335,6 +335,7 @@ if __name__ == "__main__":
   parser.add_argument("--count", type=int, default=1000, help="Max number of tokens to generate")
   parser.add_argument("--personality", type=str, default="Stacy", help="Personality, can be Stacy, George, Gary, or Lexie")
   parser.add_argument("--temperature", type=float, default=0.7, help="Temperature in the softmax")
+  parser.add_argument("--prefill_chunk", type=int, default=0, help="JIT the prompt in chunks of this many tokens, 0 runs it in one step")
   parser.add_argument("--timing", action="store_true", help="Print timing per token")
   parser.add_argument("--profile", action="store_true", help="Output profile data to out.prof")
   parser.add_argument("--gen", default="1", help=f"""Generation of the model to use {list(MODEL_PARAMS.keys())}""")
@@ -472,6 +473,8 @@ After you are done speaking, output [EOS]. You are not Chad.
 
       if args.timing or args.profile: print("")
       st = GlobalCounters.time_sum_s
+      if args.prefill_chunk > 1 and len(toks)-start_pos > 1:
+        start_pos, tok_tensor = llama.model.prefill(Tensor([toks[start_pos:-1]], device=device), start_pos, args.prefill_chunk), None
       next_tok = Tensor([toks[start_pos:]], device=device) if tok_tensor is None or (len(toks)-start_pos) > 1 else tok_tensor.reshape(1, 1)
       with Profiling(enabled=args.profile):
         with Timing("total ", enabled=args.timing, on_exit=lambda x: f", {1e9/x:.2f} tok/s, {GlobalCounters.global_mem/x:.2f} GB/s, param {param_bytes/x:.2f} GB/s"):
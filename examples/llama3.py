@@ -4,7 +4,7 @@ import json, argparse, random, time
 import tiktoken
 from tiktoken.load import load_tiktoken_bpe
 from extra.models.llama import Transformer, convert_from_huggingface, fix_bf16
-from tinygrad.nn.state import safe_load, torch_load, load_state_dict, get_parameters
+from tinygrad.nn.state import safe_load, safe_load_bulk, torch_load, load_state_dict, get_parameters
 from tinygrad import Tensor, dtypes, nn, Context, Device, GlobalCounters
 from tinygrad.helpers import Profiling, Timing, DEBUG, colored, fetch, tqdm
 
@@ -146,7 +146,11 @@ def build_transformer(model_path: Path, model_size="8B", quantize=None, device=N
 
   # load weights
   if model_path.is_dir():
-    if (model_path / "model.safetensors.index.json").exists(): weights = load(str(model_path / "model.safetensors.index.json"))
+    if (model_path / "model.safetensors.index.json").exists():
+      # on one device, read all the shards at once straight into device buffers
+      # quantized loads stay lazy, so the full bf16 checkpoint is never on the device next to the quantized weights
+      index = str(model_path / "model.safetensors.index.json")
+      weights = safe_load_bulk(index, device) if quantize is None and not isinstance(device, tuple) else load(index)
     elif (model_path / "model.safetensors").exists(): weights = load(str(model_path / "model.safetensors"))
     else: weights = concat_weights([load(str(model_path / f"consolidated.{i:02d}.pth")) for i in range(MODEL_PARAMS[model_size]["files"])], device[0] if isinstance(device, tuple) else device)
   else:
@@ -183,6 +187,7 @@ TOP_K = 0
 TOP_P = 0.0
 ALPHA_F = 0.0
 ALPHA_P = 0.0
+PREFILL_CHUNK = 128
 
 last_seen_toks = []
 def prefill(model, toks, start_pos=0):
@@ -197,7 +202,10 @@ def prefill(model, toks, start_pos=0):
     last_seen_toks = toks
     toks = toks[i:]
 
-  # prefill the model
+  # prefill the model, a chunk of prompt tokens per JIT launch
+  if PREFILL_CHUNK > 1:
+    GlobalCounters.reset()
+    return model.prefill(Tensor([toks], device=device), start_pos, PREFILL_CHUNK) if toks else start_pos
   for tok in tqdm(toks):
     GlobalCounters.reset()
     model(Tensor([[tok]], device=device), start_pos, TEMPERATURE, TOP_K, TOP_P, ALPHA_F, ALPHA_P).realize()
@@ -219,6 +227,7 @@ if __name__ == "__main__":
   parser.add_argument("--debug", action="store_true", help="Enable debug mode")
   parser.add_argument("--seed", type=int, help="Random seed")
   parser.add_argument("--temperature", type=int, default=0.85, help="Temperature")
+  parser.add_argument("--prefill_chunk", type=int, default=PREFILL_CHUNK, help="Prompt tokens per prefill step, 1 runs them one by one")
   parser.add_argument("--benchmark", action="store_true", help="Run a benchmark")
   parser.add_argument("--timing", action="store_true", help="Print timing per token")
   parser.add_argument("--profile", action="store_true", help="Output profile data")
@@ -239,6 +248,7 @@ if __name__ == "__main__":
   if args.benchmark: Tensor.manual_seed(42)
   print(f"seed = {Tensor._seed}")
   TEMPERATURE = args.temperature
+  PREFILL_CHUNK = args.prefill_chunk
 
   tokenizer = Tokenizer(str((args.model if args.model.is_dir() else args.model.parent) / "tokenizer.model"))
   def encode_role(role: str):
@@ -0,0 +1,213 @@
+# continuous batching server for extra/models/llama.py
+# every step runs one token of each running sequence in a single JIT'd decode, sequences join and leave between steps
+# the kv cache is a pool of fixed size blocks, a sequence only holds the blocks for the positions it has reached
+# prompts go through the decode one token per step too, Transformer.prefill writes the contiguous kv cache and not the block pool
+from __future__ import annotations
+from pathlib import Path
+from typing import List, Deque, Dict, Any
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse, json, threading, time, statistics, urllib.request
+from tinygrad import Tensor, dtypes
+from tinygrad.helpers import colored
+from extra.models.llama import Transformer, precompute_freqs_cis
+
+class Sequence:
+  def __init__(self, prompt:List[int], max_tokens:int):
+    self.prompt, self.max_tokens = prompt, max_tokens
+    self.out: List[int] = []
+    self.blocks: List[int] = []
+    self.pos = 0  # number of tokens in the kv cache
+    self.arrival, self.first_token_time, self.finish_time = time.perf_counter(), 0.0, 0.0
+    self.done = threading.Event()
+
+  # after an eviction the generated tokens are replayed like the prompt
+  @property
+  def tokens(self) -> List[int]: return self.prompt + self.out
+  @property
+  def ttft(self) -> float: return self.first_token_time - self.arrival
+
+class Engine:
+  def __init__(self, model:Transformer, max_batch:int, num_blocks:int, block_size:int, stop_tokens=(), temperature=0.0):
+    assert model.max_context % block_size == 0, f"{block_size=} must divide {model.max_context=}"
+    self.model, self.max_batch, self.block_size, self.stop_tokens, self.temperature = model, max_batch, block_size, set(stop_tokens), temperature
+    self.max_blocks = model.max_context // block_size
+    # a sequence that can't get all its blocks would evict itself forever
+    assert num_blocks-1 >= self.max_blocks, f"{num_blocks=} must hold {self.max_blocks} blocks of a full context plus the scratch block"
+    model.alloc_kv_pool(num_blocks, block_size)
+    # block 0 is scratch space for the rows that pad the batch
+    self.free_blocks = list(range(num_blocks-1, 0, -1))
+    self.waiting: Deque[Sequence] = deque()
+    self.running: List[Sequence] = []
+    self.cond = threading.Condition()
+    self.steps, self.generated, self.evictions, self.start = 0, 0, 0, time.perf_counter()
+    self.finished: Deque[Sequence] = deque(maxlen=1000)
+
+  def submit(self, prompt:List[int], max_tokens:int) -> Sequence:
+    assert 0 < len(prompt) < self.model.max_context, f"prompt of {len(prompt)} tokens doesn't fit in {self.model.max_context=}"
+    seq = Sequence(prompt, min(max_tokens, self.model.max_context - len(prompt)))
+    with self.cond:
+      self.waiting.append(seq)
+      self.cond.notify()
+    return seq
+
+  def _evict(self, seq:Sequence):
+    # free the blocks and requeue it first, it recomputes its kv when it's admitted again
+    self.free_blocks.extend(seq.blocks)
+    seq.blocks, seq.pos = [], 0
+    self.running.remove(seq)
+    self.waiting.appendleft(seq)
+    self.evictions += 1
+
+  def _finish(self, seq:Sequence):
+    self.free_blocks.extend(seq.blocks)
+    seq.blocks, seq.finish_time = [], time.perf_counter()
+    self.running.remove(seq)
+    self.finished.append(seq)
+    seq.done.set()
+
+  def step(self) -> bool:
+    with self.cond:
+      while self.waiting and len(self.running) < self.max_batch and self.free_blocks: self.running.append(self.waiting.popleft())
+    if not self.running: return False
+
+    # every sequence needs a block for its next position, the oldest ones get them first
+    for seq in list(self.running):
+      if seq not in self.running: continue
+      if len(seq.blocks) <= seq.pos // self.block_size:
+        while not self.free_blocks and seq in self.running: self._evict(self.running[-1])
+        if seq in self.running: seq.blocks.append(self.free_blocks.pop())
+
+    pad = self.max_batch - len(self.running)
+    toks = [s.tokens[s.pos] for s in self.running] + [0]*pad
+    positions = [s.pos for s in self.running] + [0]*pad
+    table = [s.blocks + [0]*(self.max_blocks-len(s.blocks)) for s in self.running] + [[0]*self.max_blocks]*pad
+    out = self.model.decode_paged(toks, positions, table, self.temperature)
+    self.steps += 1
+
+    now = time.perf_counter()
+    for seq,tok in zip(list(self.running), out):
+      seq.pos += 1
+      # outputs while replaying known tokens are already in seq.out
+      if seq.pos < len(seq.tokens): continue
+      if not seq.out: seq.first_token_time = now
+      seq.out.append(tok)
+      self.generated += 1
+      if tok in self.stop_tokens or len(seq.out) >= seq.max_tokens: self._finish(seq)
+    return True
+
+  # tinygrad isn't thread safe, this has to run on the thread that made the model
+  def run(self, stop:threading.Event):
+    while not stop.is_set():
+      if not self.step():
+        with self.cond: self.cond.wait_for(lambda: len(self.waiting) > 0, timeout=0.1)
+
+  def stats(self) -> Dict[str, Any]:
+    ttfts = [s.ttft for s in self.finished]
+    return {"steps": self.steps, "generated_tokens": self.generated, "evictions": self.evictions, "running": len(self.running),
+            "waiting": len(self.waiting), "free_blocks": len(self.free_blocks), "tokens_per_second": self.generated/(time.perf_counter()-self.start),
+            "mean_ttft": statistics.mean(ttfts) if ttfts else None}
+
+def serve(engine:Engine, encode, decode, host:str, port:int) -> ThreadingHTTPServer:
+  class Handler(BaseHTTPRequestHandler):
+    def _reply(self, ret):
+      body = json.dumps(ret).encode()
+      self.send_response(200)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+    def do_GET(self):
+      if self.path == "/stats": self._reply(engine.stats())
+      else: self.send_error(404)
+    def do_POST(self):
+      if self.path != "/v1/completions": return self.send_error(404)
+      rjson = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+      seq = engine.submit(encode(rjson.get("prompt", "")), rjson.get("max_tokens", 64))
+      seq.done.wait()
+      self._reply({"choices": [{"text": decode(seq.out)}], "usage": {"prompt_tokens": len(seq.prompt), "completion_tokens": len(seq.out)},
+                   "ttft": seq.ttft, "latency": seq.finish_time - seq.arrival})
+    def log_message(self, *args): pass
+
+  server = ThreadingHTTPServer((host, port), Handler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server
+
+# *** benchmark client ***
+
+def bench(url:str, clients:int, requests:int, prompt_len:int, max_tokens:int):
+  def work(i):
+    for j in range(requests):
+      req = {"prompt": " ".join(f"w{(i*31+j*7+k)%97}" for k in range(prompt_len)), "max_tokens": max_tokens}
+      st = time.perf_counter()
+      with urllib.request.urlopen(urllib.request.Request(f"{url}/v1/completions", json.dumps(req).encode())) as r: ret = json.loads(r.read())
+      results.append((ret["ttft"], time.perf_counter()-st, ret["usage"]["completion_tokens"]))
+  results: List[Any] = []
+  st = time.perf_counter()
+  threads = [threading.Thread(target=work, args=(i,)) for i in range(clients)]
+  for t in threads: t.start()
+  for t in threads: t.join()
+  et = time.perf_counter() - st
+  ttfts, lats, toks = sorted(r[0] for r in results), sorted(r[1] for r in results), sum(r[2] for r in results)
+  print(f"{len(results)} requests from {clients} clients in {et:.2f} s, {colored(f'{toks/et:.2f} tok/s', 'green')}")
+  print(f"ttft   mean {statistics.mean(ttfts)*1e3:8.2f} ms  p50 {ttfts[len(ttfts)//2]*1e3:8.2f} ms  p90 {ttfts[int(len(ttfts)*0.9)]*1e3:8.2f} ms")
+  print(f"total  mean {statistics.mean(lats)*1e3:8.2f} ms  p50 {lats[len(lats)//2]*1e3:8.2f} ms  p90 {lats[int(len(lats)*0.9)]*1e3:8.2f} ms")
+  with urllib.request.urlopen(f"{url}/stats") as r: print("server", json.loads(r.read()))
+
+def tiny_model(max_context:int) -> Transformer:
+  # random weights, byte level "tokenizer". enough to measure the engine without downloading a model
+  model = Transformer(dim=256, hidden_dim=512, n_heads=8, n_kv_heads=4, n_layers=4, norm_eps=1e-5, vocab_size=256, max_context=max_context)
+  model.freqs_cis = precompute_freqs_cis(256 // 8, max_context * 2, dtype=dtypes.float32).contiguous()
+  return model
+
+if __name__ == "__main__":
+  Tensor.no_grad = True
+  parser = argparse.ArgumentParser(description="continuous batching llama server with a paged kv cache",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--model", type=Path, help="llama3 model path, a tiny random model is used if not given")
+  parser.add_argument("--size", choices=["8B", "70B"], default="8B", help="Model size")
+  parser.add_argument("--quantize", choices=["int8", "nf4"], help="Quantization method")
+  parser.add_argument("--max_context", type=int, default=1024, help="Max tokens in a sequence for the tiny model")
+  parser.add_argument("--max_batch", type=int, default=8, help="Sequences decoded in one step")
+  parser.add_argument("--blocks", type=int, help="Blocks in the kv cache pool, block 0 is reserved, defaults to two full contexts")
+  parser.add_argument("--block_size", type=int, default=16, help="Positions in a kv cache block")
+  parser.add_argument("--temperature", type=float, default=0.0, help="Temperature")
+  parser.add_argument("--host", type=str, default="0.0.0.0", help="Web server bind address")
+  parser.add_argument("--port", type=int, default=7777, help="Web server port")
+  parser.add_argument("--bench", action="store_true", help="Serve and run the benchmark client against it in this process")
+  parser.add_argument("--client", type=str, help="Only run the benchmark client against the server at this url")
+  parser.add_argument("--clients", type=int, default=8, help="Concurrent benchmark clients")
+  parser.add_argument("--requests", type=int, default=4, help="Requests per benchmark client")
+  parser.add_argument("--prompt_len", type=int, default=32, help="Words in a benchmark prompt")
+  parser.add_argument("--max_tokens", type=int, default=32, help="Tokens generated per benchmark request")
+  args = parser.parse_args()
+
+  if args.client:
+    bench(args.client, args.clients, args.requests, args.prompt_len, args.max_tokens)
+    exit(0)
+
+  if args.model is not None:
+    from examples.llama3 import Tokenizer, build_transformer
+    tokenizer = Tokenizer(str((args.model if args.model.is_dir() else args.model.parent) / "tokenizer.model"))
+    model = build_transformer(args.model, model_size=args.size, quantize=args.quantize)
+    def encode(s:str) -> List[int]: return [tokenizer.bos_id] + tokenizer.encode(s)
+    decode, stop_tokens = tokenizer.decode, tokenizer.stop_tokens
+  else:
+    model = tiny_model(args.max_context)
+    def encode(s:str) -> List[int]: return list(s.encode()[:args.max_context//2]) or [0]
+    def decode(toks:List[int]) -> str: return bytes(toks).decode(errors="replace")
+    stop_tokens = set()
+
+  if args.blocks is None: args.blocks = 2 * model.max_context // args.block_size + 1
+  engine = Engine(model, args.max_batch, args.blocks, args.block_size, stop_tokens, args.temperature)
+  serve(engine, encode, decode, args.host, args.port)
+  print(f"serving on http://{args.host}:{args.port} with {args.max_batch=} {args.blocks=} {args.block_size=}")
+  stop = threading.Event()
+  if args.bench:
+    def run_bench():
+      # the first request captures the JIT, don't count it
+      bench(f"http://127.0.0.1:{args.port}", 1, 1, 4, 4)
+      bench(f"http://127.0.0.1:{args.port}", args.clients, args.requests, args.prompt_len, args.max_tokens)
+      stop.set()
+    threading.Thread(target=run_bench, daemon=True).start()
+  engine.run(stop)
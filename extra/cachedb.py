@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# inspect, prune, export and import the tinygrad cache database (CACHEDB)
+import argparse, os, sqlite3
+from tinygrad.helpers import CACHEDB, VERSION, db_connection, diskcache_flush, diskcache_prune
+
+def tables(conn, prefix=""):
+  return [name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall() if name.startswith(prefix)]
+
+def stats(args):
+  conn = db_connection()
+  print(f"{CACHEDB}: {os.path.getsize(CACHEDB)/1e6:.2f} MB on disk, VERSION {VERSION}")
+  total = 0
+  for name in sorted(tables(conn, args.table)):
+    cnt, sz = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(LENGTH(val)), 0) FROM '{name}'").fetchone()
+    print(f"{name:50s} {cnt:8d} entries {sz/1e6:10.2f} MB" + ("" if name.endswith(f"_{VERSION}") else "  (other VERSION)"))
+    total += sz
+  print(f"{'total':50s} {'':16s} {total/1e6:10.2f} MB")
+
+def prune(args):
+  print(f"freed {diskcache_prune(int(args.max_mb*1e6))/1e6:.2f} MB")
+  if args.vacuum: db_connection().execute("VACUUM")
+
+def clear(args):
+  conn = db_connection()
+  for name in tables(conn, args.table): conn.execute(f"DROP TABLE '{name}'")
+  conn.commit()
+
+def export(args):
+  conn = db_connection()
+  if os.path.exists(args.fn): os.remove(args.fn)
+  with sqlite3.connect(args.fn) as out: conn.backup(out)
+  with sqlite3.connect(args.fn) as out:
+    for name in tables(out):
+      if not name.startswith(args.table) or not name.endswith(f"_{VERSION}"): out.execute(f"DROP TABLE '{name}'")
+  with sqlite3.connect(args.fn) as out: out.execute("VACUUM")
+  print(f"exported {len(tables(sqlite3.connect(args.fn)))} tables to {args.fn}")
+
+def import_(args):
+  conn = db_connection()
+  conn.execute("ATTACH DATABASE ? AS src", (args.fn,))
+  for name, sql in conn.execute("SELECT name, sql FROM src.sqlite_master WHERE type = 'table'").fetchall():
+    if name not in tables(conn): conn.execute(sql)
+    # entries already in this cache are kept, they were used on this machine
+    cnt = conn.execute(f"INSERT OR IGNORE INTO main.'{name}' SELECT * FROM src.'{name}'").rowcount
+    print(f"{name:50s} {cnt:8d} new entries")
+  conn.commit()
+  conn.execute("DETACH DATABASE src")
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=f"manage the tinygrad cache at {CACHEDB}")
+  sub = parser.add_subparsers(required=True)
+  p = sub.add_parser("stats", help="show entries and size per table")
+  p.add_argument("--table", default="", help="only tables starting with this")
+  p.set_defaults(fxn=stats)
+  p = sub.add_parser("prune", help="delete the least recently used entries of this VERSION down to a size")
+  p.add_argument("max_mb", type=float)
+  p.add_argument("--vacuum", action="store_true", help="also shrink the file on disk")
+  p.set_defaults(fxn=prune)
+  p = sub.add_parser("clear", help="drop tables")
+  p.add_argument("--table", default="", help="only tables starting with this")
+  p.set_defaults(fxn=clear)
+  p = sub.add_parser("export", help="copy the current VERSION tables to a file")
+  p.add_argument("fn")
+  p.add_argument("--table", default="", help="only tables starting with this")
+  p.set_defaults(fxn=export)
+  p = sub.add_parser("import", help="add the entries of an exported file")
+  p.add_argument("fn")
+  p.set_defaults(fxn=import_)
+  args = parser.parse_args()
+  diskcache_flush()
+  args.fxn(args)
@@ -1,4 +1,4 @@
-from typing import Tuple, Union, Optional, Dict, Any
+from typing import Tuple, Union, Optional, Dict, Any, List
 from tinygrad import Tensor, Variable, TinyJit, dtypes, nn, Device
 from tinygrad.helpers import getenv
 
@@ -80,6 +80,29 @@ class Attention:
     attn = attn.reshape(bsz, seqlen, -1)
     return self.wo(attn)
 
+  def paged(self, x:Tensor, kv_pool:Tensor, slots:Tuple[Variable, ...], block_table:Tensor, positions:Tensor, freqs_cis:Tensor) -> Tensor:
+    # one token for each of bsz sequences, whose kv live in fixed size blocks of kv_pool listed by block_table
+    bsz = block_table.shape[0]
+    xq = self.wq(x).reshape(bsz, 1, self.n_heads, self.head_dim)
+    xk = self.wk(x).reshape(bsz, 1, self.n_kv_heads, self.head_dim)
+    xv = self.wv(x).reshape(bsz, 1, self.n_kv_heads, self.head_dim)
+    xq, xk = apply_rotary_emb(xq, xk, freqs_cis)
+
+    # write each sequence's new kv to its slot in the pool, all in one realize
+    assert xk.dtype == xv.dtype == kv_pool.dtype, f"{xk.dtype=}, {xv.dtype=}, {kv_pool.dtype=}"
+    slot_kv = kv_pool.reshape(2, -1, self.n_kv_heads, self.head_dim)
+    Tensor.realize(*[slot_kv.shrink((None, (slot, slot+1), None, None)).assign(Tensor.stack(xk[i], xv[i])) for i,slot in enumerate(slots)])
+
+    # gather the blocks of every sequence, one load per element, and mask out the positions it hasn't reached yet
+    idx = block_table.reshape(1, -1, 1, 1, 1).expand(2, block_table.numel(), *kv_pool.shape[2:])
+    kv = kv_pool.gather(1, idx).reshape(2, bsz, -1, self.n_kv_heads, self.head_dim)
+    keys, values = kv[0], kv[1]
+    mask = (Tensor.arange(keys.shape[1]).reshape(1, 1, 1, -1) > positions.reshape(bsz, 1, 1, 1)).where(float("-inf"), 0).cast(x.dtype)
+
+    keys, values = repeat_kv(keys, self.n_rep), repeat_kv(values, self.n_rep)
+    attn = xq.transpose(1, 2).scaled_dot_product_attention(keys.transpose(1, 2), values.transpose(1, 2), mask).transpose(1, 2)
+    return self.wo(attn.reshape(bsz, 1, -1))
+
 class FeedForward:
   def __init__(self, dim:int, hidden_dim:int, linear=nn.Linear):
     self.w1 = linear(dim, hidden_dim, bias=False)
@@ -100,6 +123,10 @@ class TransformerBlock:
     h = x + self.attention(self.attention_norm(x), start_pos, freqs_cis, mask)
     return (h + self.feed_forward(self.ffn_norm(h))).contiguous()
 
+  def paged(self, x:Tensor, kv_pool:Tensor, slots:Tuple[Variable, ...], block_table:Tensor, positions:Tensor, freqs_cis:Tensor):
+    h = x + self.attention.paged(self.attention_norm(x), kv_pool, slots, block_table, positions, freqs_cis)
+    return (h + self.feed_forward(self.ffn_norm(h))).contiguous()
+
 # standard openai sampling
 def sample(logits: Tensor, temp: float, k: int, p: float, af: float, ap: float):
   assert logits.ndim == 1, "only works on 1d tensors"
@@ -123,19 +150,13 @@ def sample(logits: Tensor, temp: float, k: int, p: float, af: float, ap: float):
   # softmax
   t = (logits / temp).softmax()
 
-  counter, counter2 = Tensor.arange(t.numel(), device=logits.device).contiguous(), Tensor.arange(t.numel() - 1, -1, -1, device=logits.device).contiguous()
   # top k
   if k:
-    output, output_indices = Tensor.zeros(k, device=logits.device).contiguous(), Tensor.zeros(k, device=logits.device, dtype=dtypes.int32).contiguous()
-    for i in range(k):
-      t_argmax = (t.numel() - ((t == (t_max := t.max())) * counter2).max() - 1).cast(dtypes.default_int)
-      output = output + t_max.unsqueeze(0).pad(((i, k - i - 1),))
-      output_indices = output_indices + t_argmax.unsqueeze(0).pad(((i, k - i - 1),))
-      t = (counter == t_argmax).where(0, t)
+    output, output_indices = t.topk(k)
 
     # approximate top p
     # because we are already limited to top k elements we can do top p "without sorting"
-    output_cumsum = output[::-1]._cumsum()[::-1] + t.sum()
+    output_cumsum = output[::-1]._cumsum()[::-1] + (t.sum() - output.sum())
     output = (output_cumsum >= (1 - p)) * output
     output_indices = (output_cumsum >= (1 - p)) * output_indices
 
@@ -147,6 +168,7 @@ def sample(logits: Tensor, temp: float, k: int, p: float, af: float, ap: float):
 
   # increase alpha counter
   if af or ap:
+    counter = Tensor.arange(t.numel(), device=logits.device).contiguous()
     sample.alpha_counter = (counter == output_token).where(sample.alpha_counter + 1, sample.alpha_counter)
 
   return output_token
@@ -160,13 +182,18 @@ class Transformer:
     self.max_context = max_context
     self.freqs_cis = precompute_freqs_cis(dim // n_heads, self.max_context * 2, rope_theta).contiguous()
     self.forward_jit = TinyJit(self.forward) if jit else None
+    self.forward_paged_jit = TinyJit(self.forward_paged) if jit else None
+    self.prefill_jits: Dict[int, TinyJit] = {}
+    self.kv_pool: List[Tensor] = []
 
   def forward(self, tokens:Tensor, start_pos:Union[Variable,int], temperature:float, top_k:int, top_p:float, alpha_f:float, alpha_p:float):
     _bsz, seqlen = tokens.shape
     freqs_cis = self.freqs_cis.shrink((None, (start_pos, start_pos+seqlen),None,None,None))
 
     h = self.tok_embeddings(tokens)
-    mask = Tensor.full((1, 1, seqlen, start_pos+seqlen), float("-inf"), dtype=h.dtype, device=h.device).triu(start_pos+1).realize() if seqlen > 1 else None
+    # causal within the new tokens, padded to attend to all start_pos cached ones. start_pos is symbolic in chunked prefill
+    mask = Tensor.full((1, 1, seqlen, seqlen), float("-inf"), dtype=h.dtype, device=h.device).triu(1) \
+      .pad((None, None, None, (start_pos, 0))).realize() if seqlen > 1 else None
     for layer in self.layers: h = layer(h, start_pos, freqs_cis, mask)
     logits = self.output(self.norm(h)).float()[:, -1, :]
 
@@ -178,6 +205,55 @@ class Transformer:
       return self.forward_jit(tokens, Variable("start_pos", 0, self.max_context).bind(start_pos), temperature, top_k, top_p, alpha_f, alpha_p)
     return self.forward(tokens, start_pos, temperature, top_k, top_p, alpha_f, alpha_p)
 
+  def prefill(self, tokens:Tensor, start_pos:int, chunk:int) -> int:
+    """
+    Fills the kv cache with `tokens` from `start_pos` in chunks of `chunk` tokens and returns the position after them. Nothing is sampled.
+    Every chunk size is JIT'd once with a symbolic offset, the last chunk is padded to `chunk` if it fits in `max_context`.
+    The padding writes the cache past the prompt, those positions are overwritten before they are attended to.
+    """
+    assert tokens.shape[0] == 1 and 1 < chunk < self.max_context, f"can't prefill {tokens.shape=} in chunks of {chunk}"
+    for i in range(0, tokens.shape[1], chunk):
+      toks = tokens[:, i:i+chunk]
+      if toks.shape[1] < chunk and start_pos + chunk <= self.max_context: toks = toks.pad((None, (0, chunk - toks.shape[1])))
+      if toks.shape[1] == chunk and self.forward_jit is not None:
+        if chunk not in self.prefill_jits: self.prefill_jits[chunk] = TinyJit(self.forward)
+        self.prefill_jits[chunk](toks.contiguous(), Variable("start_pos", 0, self.max_context - chunk).bind(start_pos), 0.0, 0, 0.0, 0.0, 0.0)
+      else:
+        self.forward(toks, start_pos, 0.0, 0, 0.0, 0.0, 0.0)
+      start_pos += min(chunk, tokens.shape[1] - i)
+    return start_pos
+
+  # *** paged kv cache, used for continuous batching in examples/llama3_serve.py ***
+
+  def alloc_kv_pool(self, num_blocks:int, block_size:int):
+    # one pool of num_blocks blocks of block_size positions per layer, shared by all sequences
+    attn, dtype = self.layers[0].attention, self.tok_embeddings.weight.dtype
+    self.kv_pool = [Tensor.zeros(2, num_blocks, block_size, attn.n_kv_heads, attn.head_dim, dtype=dtype).contiguous().realize() for _ in self.layers]
+    if self.forward_paged_jit is not None: self.forward_paged_jit.reset()
+
+  def forward_paged(self, tokens:Tensor, positions:Tensor, block_table:Tensor, temperature:float, *slots:Variable) -> Tensor:
+    freqs_cis = self.freqs_cis[0][positions].reshape(tokens.shape[0], 1, 1, -1, 2)
+    h = self.tok_embeddings(tokens)
+    for layer,kv_pool in zip(self.layers, self.kv_pool): h = layer.paged(h, kv_pool, slots, block_table, positions, freqs_cis)
+    logits = self.output(self.norm(h)).float()[:, -1, :]
+    if temperature < 1e-6: return logits.argmax(-1).realize()
+    return (logits / temperature).softmax().multinomial().flatten().realize()
+
+  def decode_paged(self, tokens:List[int], positions:List[int], block_table:List[List[int]], temperature:float=0.0) -> List[int]:
+    """
+    Runs one token of each sequence, the kv of position p of sequence i is kept in block `block_table[i][p // block_size]` of `kv_pool`.
+    All calls with the same number of sequences and `block_table` width share one JIT.
+    """
+    assert len(self.kv_pool), "call alloc_kv_pool first"
+    block_size = self.kv_pool[0].shape[2]
+    num_slots = self.kv_pool[0].shape[1] * block_size
+    slots = [Variable(f"slot{i}", 0, num_slots-1).bind(bt[p//block_size]*block_size + p%block_size)
+             for i,(bt,p) in enumerate(zip(block_table, positions))]
+    args = (Tensor([[t] for t in tokens], dtype=dtypes.int32), Tensor(positions, dtype=dtypes.int32), Tensor(block_table, dtype=dtypes.int32),
+            temperature)
+    ret = self.forward_paged_jit(*args, *slots) if self.forward_paged_jit is not None else self.forward_paged(*args, *slots)
+    return ret.tolist()
+
 # *** helpers ***
 
 def convert_from_huggingface(weights:Dict[str, Tensor], model: Transformer, n_heads: int, n_kv_heads: int):
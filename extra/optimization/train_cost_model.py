@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# train the BEAM cost model from the cost_samples diskcache table
+# collect samples with CACHELEVEL=2 BEAM_COST_SAMPLES=1 BEAM=<n>, then use the model with BEAM_COST_MODEL=<out>
+import json, math, pickle, random
+import numpy as np
+from tinygrad.helpers import db_connection, getenv, VERSION
+
+DEVICE = getenv("DEVICE", "")
+OUT = getenv("OUT", "/tmp/cost_model.json")
+
+def load_samples():
+  conn = db_connection()
+  query = f"SELECT ast, val FROM 'cost_samples_{VERSION}'" + (" WHERE device = ?" if DEVICE else "")
+  rows = conn.execute(query, (DEVICE,) if DEVICE else ()).fetchall()
+  return [(ast, feats, min(tms)) for ast,(feats,tms) in ((ast, pickle.loads(val)) for ast,val in rows) if min(tms) not in {0, math.inf}]
+
+def ranking_accuracy(samples, pred):
+  # fraction of pairs within the same kernel that the model orders the same way as the measured times
+  by_ast = {}
+  for (ast,_,tm),p in zip(samples, pred): by_ast.setdefault(ast, []).append((tm, p))
+  good = total = 0
+  for v in by_ast.values():
+    for i in range(len(v)):
+      for j in range(i+1, len(v)):
+        if v[i][0] == v[j][0]: continue
+        good, total = good + ((v[i][0] < v[j][0]) == (v[i][1] < v[j][1])), total + 1
+  return good / max(total, 1)
+
+if __name__ == "__main__":
+  samples = load_samples()
+  print(f"got {len(samples)} samples")
+  # split by kernel so the test set has kernels the model hasn't seen
+  asts = sorted(set(x[0] for x in samples))
+  random.seed(1337)
+  test_asts = set(random.sample(asts, len(asts)//10))
+  train, test = [x for x in samples if x[0] not in test_asts], [x for x in samples if x[0] in test_asts]
+
+  X, Y = np.array([x[1] for x in train]), np.log(np.array([x[2] for x in train]))
+  mean, std = X.mean(0), X.std(0) + 1e-6
+  Xn = np.concatenate([(X-mean)/std, np.ones((len(X), 1))], axis=1)
+  # ridge regression on log runtime
+  w = np.linalg.solve(Xn.T @ Xn + getenv("L2", 1.0) * np.eye(Xn.shape[1]), Xn.T @ Y)
+
+  def predict(x): return float(w[-1] + ((np.array(x)-mean)/std) @ w[:-1])
+  print(f"train ranking accuracy {ranking_accuracy(train, [predict(x[1]) for x in train])*100:.2f}%")
+  if test: print(f"test ranking accuracy {ranking_accuracy(test, [predict(x[1]) for x in test])*100:.2f}%")
+
+  with open(OUT, "w") as f: json.dump({"weights": w[:-1].tolist(), "bias": float(w[-1]), "mean": mean.tolist(), "std": std.tolist()}, f)
+  print(f"saved to {OUT}")
@@ -0,0 +1,24 @@
+import time
+from tinygrad import Tensor, Device, GlobalCounters
+from tinygrad.helpers import getenv, colored, Context
+from tinygrad.engine.realize import run_schedule
+
+# causal self attention vs sequence length, with and without the blocked online softmax in scaled_dot_product_attention
+# the biggest buffer is the (bs, heads, seq, seq) score matrix without it, and (bs, heads, seq, FLASH_ATTENTION) with it
+if __name__ == "__main__":
+  bs, heads, hd = getenv("BS", 1), getenv("HEADS", 8), getenv("HEAD_DIM", 64)
+  for seq in [int(x) for x in getenv("SEQS", "256,512,1024,2048").split(",")]:
+    q, k, v = [Tensor.randn(bs, heads, seq, hd).realize() for _ in range(3)]
+    for name, block in [("plain", 0), ("flash", getenv("FLASH_ATTENTION", 128))]:
+      tms = []
+      with Context(FLASH_ATTENTION=block):
+        for _ in range(getenv("CNT", 3)):
+          sched = q.scaled_dot_product_attention(k, v, is_causal=True).schedule()
+          kernels, biggest = len(sched), max(b.nbytes for si in sched for b in si.bufs)
+          GlobalCounters.reset()
+          st = time.perf_counter()
+          run_schedule(sched)
+          Device[Device.DEFAULT].synchronize()
+          tms.append((time.perf_counter()-st)*1000)
+      print(f"seq {seq:5d} {name:5s}: {colored(f'{min(tms):9.2f} ms', 'green')}, {kernels:3d} kernels, "
+            f"{GlobalCounters.global_mem/1e6:9.2f} MB moved, biggest buffer {biggest/1e6:8.2f} MB")
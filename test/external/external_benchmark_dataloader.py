@@ -0,0 +1,45 @@
+import time, os
+import numpy as np
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv, colored
+from tinygrad.nn.datasets import DataLoader
+
+# images/s out of DataLoader on a synthetic dataset of uint8 HWC images, decoding is simulated with a fixed cost per sample
+# "single process" is the loop every example used to write, np.stack a batch and make a Tensor of it
+class SyntheticImages:
+  def __init__(self, n, size, cost):
+    self.n, self.size, self.cost = n, size, cost
+  def __len__(self): return self.n
+  def __getitem__(self, i):
+    if self.cost: time.sleep(self.cost)
+    return np.random.default_rng(i).integers(0, 255, (self.size+32, self.size+32, 3), dtype=np.uint8), i % 1000
+
+def random_crop_flip(x):
+  img, label = x
+  dy, dx = np.random.randint(0, 33, 2)
+  img = img[dy:dy+img.shape[0]-32, dx:dx+img.shape[1]-32]
+  return (img[:, ::-1] if np.random.rand() < 0.5 else img), label
+
+def bench(name, batches, cnt):
+  st, n = time.perf_counter(), 0
+  for i,(x,y) in enumerate(batches):
+    x.to(Device.DEFAULT).realize()
+    n += x.shape[0]
+    if i == 0: st, n = time.perf_counter(), 0   # the first batch pays for starting the workers
+    if i == cnt: break
+  print(f"{name:24s}: {colored(f'{n/(time.perf_counter()-st):9.1f} images/s', 'green')}")
+
+if __name__ == "__main__":
+  bs, cnt = getenv("BS", 64), getenv("CNT", 20)
+  ds = SyntheticImages(bs*(cnt+1), getenv("SIZE", 224), getenv("COST_US", 500)/1e6)
+  print(f"device {Device.DEFAULT}, {bs}x{ds.size}x{ds.size}x3 batches, {ds.cost*1e6:.0f} us per sample")
+
+  def single_process():
+    for i in range(0, len(ds), bs):
+      x, y = zip(*[random_crop_flip(ds[j]) for j in range(i, i+bs)])
+      yield Tensor(np.stack(x)), Tensor(np.array(y))
+  bench("single process", single_process(), cnt)
+  for nw in sorted({0, 1, 2, 4, 8, os.cpu_count() or 1}):
+    dl = DataLoader(ds, bs, num_workers=nw, shuffle=True, seed=0, transform=random_crop_flip)
+    bench(f"DataLoader {nw} workers", dl, cnt)
+    dl.close()
@@ -0,0 +1,21 @@
+import time
+from tinygrad import Tensor, TinyJit, GlobalCounters, nn
+from tinygrad.helpers import getenv, colored, Context
+
+# nn.Embedding lookup of a decode step, the time should not depend on the vocab size once the arange folds into a load
+# FUSE_ARANGE=0 runs the one hot reduce over the whole vocab for comparison
+if __name__ == "__main__":
+  dim, toks = getenv("DIM", 4096), getenv("TOKENS", 1)
+  for vocab in [int(x) for x in getenv("VOCABS", "1024,32000,128256").split(",")]:
+    emb = nn.Embedding(vocab, dim)
+    emb.weight.realize()
+    jit = TinyJit(lambda x: emb(x).realize())
+    tms = []
+    with Context(FUSE_ARANGE=getenv("FUSE_ARANGE", 1)):
+      for i in range(getenv("CNT", 10)):
+        idx = Tensor.randint(1, toks, high=vocab).realize()
+        GlobalCounters.reset()
+        st = time.perf_counter()
+        jit(idx).numpy()
+        tms.append((time.perf_counter()-st)*1000)
+    print(f"vocab {vocab:7d} dim {dim}: {colored(f'{min(tms[2:]):8.3f} ms', 'green')}, {len(jit.jit_cache)} kernels, {GlobalCounters.global_ops} ops")
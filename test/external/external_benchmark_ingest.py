@@ -0,0 +1,23 @@
+import time
+import numpy as np
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv, colored
+
+# time to turn a host batch into a realized tensor, Tensor.from_numpy uses arrays in place on CLANG/LLVM
+# "npy" is the copy from the NPY device every array used to go through
+def bench(name, fxn, cnt=getenv("CNT", 5)):
+  tms = []
+  for _ in range(cnt):
+    st = time.perf_counter()
+    fxn().realize()
+    tms.append((time.perf_counter()-st)*1000)
+  print(f"{name:24s}: {colored(f'{min(tms):9.3f} ms', 'green')}")
+
+if __name__ == "__main__":
+  print(f"device {Device.DEFAULT}")
+  x = np.random.rand(getenv("MB", 128)*(1<<20)//4).astype(np.float32)
+  bench(f"{x.nbytes>>20} MB numpy npy", lambda: Tensor(x, device="NPY").to(Device.DEFAULT))
+  bench(f"{x.nbytes>>20} MB numpy", lambda: Tensor(x))
+  bench(f"{x.nbytes>>20} MB from_numpy", lambda: Tensor.from_numpy(x))
+  lst = x[:getenv("LIST", 1<<22)].reshape(-1, 1024).tolist()
+  bench(f"{len(lst)*1024} element list", lambda: Tensor(lst), cnt=2)
@@ -0,0 +1,40 @@
+import time
+from typing import List
+from extra.models.resnet import ResNet50
+from tinygrad import Tensor
+from tinygrad.helpers import Timing, getenv, colored
+from tinygrad.ops import UOps
+from tinygrad.codegen.kernel import Kernel
+from tinygrad.codegen.lowerer import ast_to_uop
+from tinygrad.codegen.uopgraph import linearize_uop, full_graph_rewrite
+
+# time linearize_uop on the ResNet50 kernels from external_benchmark_schedule.py
+# ASSERT_MS=<ms> fails if the best of CNT runs is slower, use it to guard against regressions in the linearizer
+if __name__ == "__main__":
+  mdl = ResNet50()
+  img = Tensor.empty(getenv("BS", 64), 3, 224, 224)
+  sched = mdl(img).schedule()
+  asts = list({x.ast.key:x.ast for x in sched if x.ast.op is UOps.SINK}.values())
+  kernels: List[Kernel] = []
+  with Timing(f"***** model opts({len(asts):2d}) in  "):
+    for ast in asts:
+      k = Kernel(ast)
+      if getenv("UPCAST", 1): k.hand_coded_optimizations()
+      kernels.append(k)
+  with Timing("***** model rewrite in   "): sinks = [full_graph_rewrite(ast_to_uop(k.get_optimized_ast(), k.opts), k.opts) for k in kernels]
+
+  tms = []
+  for _ in range(getenv("CNT", 3)):
+    st = time.perf_counter()
+    uops = [linearize_uop(s, skip_check=True) for s in sinks]
+    tms.append((time.perf_counter()-st)*1000)
+  print(f"***** model linearize in {min(tms):7.2f} ms, {sum(len(u) for u in uops)} uops in {len(uops)} kernels")
+
+  if getenv("VERBOSE"):
+    for k,s in sorted(zip(kernels, sinks), key=lambda x: -len(linearize_uop(x[1], skip_check=True)))[:10]:
+      st = time.perf_counter()
+      u = linearize_uop(s, skip_check=True)
+      print(f"{len(u):6d} uops {(time.perf_counter()-st)*1000:7.2f} ms  {k.name}")
+
+  if (assert_ms:=getenv("ASSERT_MS", 0.0)):
+    assert min(tms) <= assert_ms, colored(f"linearize took {min(tms):.2f} ms, more than {assert_ms:.2f} ms", "red")
@@ -0,0 +1,23 @@
+import time
+import numpy as np
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv, colored
+
+# latency of reading a large output back with .numpy(), against the copy to CLANG and memcpy readout it used to do
+# a realized output is copied once, the transposed one is realized into a new buffer that is returned without a copy
+def read_copy(t:Tensor) -> np.ndarray:
+  buf = t.contiguous().to("CLANG").realize().lazydata.base.realized
+  return np.frombuffer(buf.as_buffer(), dtype=np.float32).reshape(t.shape)
+
+if __name__ == "__main__":
+  print(f"device {Device.DEFAULT}")
+  for mb in [int(x) for x in getenv("MBS", "1,16,256").split(",")]:
+    t = Tensor.rand(mb*(1<<20)//4096, 1024).realize()
+    for out,x in [("realized", lambda: t), ("transposed", lambda: t.T)]:
+      for name,fxn in [("copy", read_copy), ("numpy", Tensor.numpy)]:
+        tms = []
+        for _ in range(getenv("CNT", 5)):
+          st = time.perf_counter()
+          fxn(x())
+          tms.append((time.perf_counter()-st)*1000)
+        print(f"{mb:4d} MB {out:10s} {name:5s}: {colored(f'{min(tms):9.3f} ms', 'green')}")
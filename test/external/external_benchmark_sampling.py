@@ -0,0 +1,33 @@
+import time
+from tinygrad import Tensor, TinyJit, dtypes
+from tinygrad.helpers import getenv, colored
+from extra.models.llama import sample
+
+# the top k loop sample() used before Tensor.topk, one full vocab max/compare/where per k
+def sample_loop(logits:Tensor, temp:float, k:int, p:float):
+  t = (logits / temp).softmax()
+  counter, counter2 = Tensor.arange(t.numel()).contiguous(), Tensor.arange(t.numel() - 1, -1, -1).contiguous()
+  output, output_indices = Tensor.zeros(k).contiguous(), Tensor.zeros(k, dtype=dtypes.int32).contiguous()
+  for i in range(k):
+    t_argmax = (t.numel() - ((t == (t_max := t.max())) * counter2).max() - 1).cast(dtypes.default_int)
+    output = output + t_max.unsqueeze(0).pad(((i, k - i - 1),))
+    output_indices = output_indices + t_argmax.unsqueeze(0).pad(((i, k - i - 1),))
+    t = (counter == t_argmax).where(0, t)
+  output_cumsum = output[::-1]._cumsum()[::-1] + t.sum()
+  output = (output_cumsum >= (1 - p)) * output
+  output_indices = (output_cumsum >= (1 - p)) * output_indices
+  return output_indices[output.multinomial()]
+
+# per token latency of top k/top p sampling over a llama3 sized vocab, both JIT'd like in Transformer.forward
+if __name__ == "__main__":
+  vocab, k, p = getenv("VOCAB", 128256), getenv("K", 50), 0.8
+  fxns = {"topk": lambda x: sample(x, 0.85, k, p, 0.0, 0.0).realize(), "loop": lambda x: sample_loop(x, 0.85, k, p).realize()}
+  for name in getenv("RUN", "topk,loop").split(","):
+    jit = TinyJit(fxns[name])
+    tms = []
+    for _ in range(getenv("CNT", 10)):
+      logits = Tensor.randn(vocab).realize()
+      st = time.perf_counter()
+      jit(logits).item()
+      tms.append((time.perf_counter()-st)*1000)
+    print(f"{name:5s} vocab {vocab} k {k}: {colored(f'{min(tms[2:]):8.2f} ms', 'green')} per token, {len(jit.jit_cache)} kernels")
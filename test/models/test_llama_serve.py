@@ -0,0 +1,87 @@
+import unittest
+from tinygrad import Tensor, dtypes
+from tinygrad.nn.state import get_state_dict, load_state_dict
+from extra.models.llama import Transformer, precompute_freqs_cis
+from examples.llama3_serve import Engine
+
+def tiny_llama(jit=True, max_context=64):
+  Tensor.manual_seed(0)
+  model = Transformer(dim=32, hidden_dim=64, n_heads=4, n_kv_heads=2, n_layers=2, norm_eps=1e-5, vocab_size=50, max_context=max_context, jit=jit)
+  model.freqs_cis = precompute_freqs_cis(8, 128, dtype=dtypes.float32).contiguous()
+  return model
+
+def greedy(model, prompt, n):
+  for layer in model.layers: layer.attention.__dict__.pop("cache_kv", None)
+  toks = list(prompt)
+  for i in range(len(prompt)+n-1):
+    tok = model(Tensor([[toks[i]]]), i).item()
+    if i >= len(prompt)-1: toks.append(tok)
+  return toks[len(prompt):]
+
+class TestLlamaPrefill(unittest.TestCase):
+  def test_chunked_prefill_matches_token_by_token(self):
+    ref, model = tiny_llama(), tiny_llama()
+    prompt = list(range(1, 24))
+    expected = greedy(ref, prompt, 4)
+    toks = list(prompt)
+    # 22 tokens in chunks of 8, the last one padded
+    start_pos = model.prefill(Tensor([toks[:-1]]), 0, 8)
+    self.assertEqual(start_pos, 22)
+    for _ in range(4):
+      toks.append(model(Tensor([[toks[-1]]]), start_pos).item())
+      start_pos += 1
+    self.assertEqual(toks[len(prompt):], expected)
+    self.assertEqual(list(model.prefill_jits), [8])
+    self.assertEqual(model.prefill_jits[8].cnt, 3)
+
+  def test_chunked_prefill_tail(self):
+    # the last chunk doesn't fit in max_context padded, it runs unpadded
+    ref, model = tiny_llama(), tiny_llama()
+    prompt = [i%50 for i in range(60)]
+    expected = greedy(ref, prompt, 3)
+    start_pos = model.prefill(Tensor([prompt[:-1]]), 0, 24)
+    self.assertEqual((start_pos, model.prefill_jits[24].cnt), (59, 2))
+    toks = list(prompt)
+    for _ in range(3):
+      toks.append(model(Tensor([[toks[-1]]]), start_pos).item())
+      start_pos += 1
+    self.assertEqual(toks[len(prompt):], expected)
+
+class TestLlamaServe(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.dense = tiny_llama(jit=False)
+    cls.prompts = [[1, 2, 3], [4, 5, 6, 7, 8, 9], [10]]
+    cls.expected = [greedy(cls.dense, p, 6) for p in cls.prompts]
+
+  def _engine(self, num_blocks):
+    # 5 blocks of 4 positions hold a full context
+    model = tiny_llama(max_context=20)
+    load_state_dict(model, get_state_dict(self.dense), verbose=False)
+    return Engine(model, max_batch=4, num_blocks=num_blocks, block_size=4)
+
+  def test_batched_matches_dense(self):
+    engine = self._engine(16)
+    seqs = [engine.submit(p, 6) for p in self.prompts]
+    while engine.step(): pass
+    self.assertEqual([s.out for s in seqs], self.expected)
+    self.assertEqual(engine.evictions, 0)
+    self.assertEqual(len(engine.free_blocks), 15)
+    self.assertGreater(len(engine.model.forward_paged_jit.jit_cache), 0)
+
+  def test_evict_and_join(self):
+    # 5 usable blocks of 4 positions can't hold all three sequences at once
+    engine = self._engine(6)
+    seqs = [engine.submit(p, 6) for p in self.prompts[:2]]
+    for _ in range(3): engine.step()
+    seqs.append(engine.submit(self.prompts[2], 6))
+    while engine.step(): pass
+    self.assertEqual([s.out for s in seqs], self.expected)
+    self.assertGreater(engine.evictions, 0)
+    self.assertEqual(len(engine.free_blocks), 5)
+
+  def test_pool_smaller_than_context(self):
+    with self.assertRaises(AssertionError): self._engine(5)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -62,14 +62,15 @@ class TestArange(unittest.TestCase):
   def test_all_opts_w_upcast(self): return self.test_all_opts([Opt(OptOps.UPCAST, 0, 4)])
   def test_all_opts_w_unroll(self): return self.test_all_opts([Opt(OptOps.UNROLL, 0, 4)], [Opt(op=OptOps.GROUP, axis=0, amt=0)])
   def test_all_opts_w_upcast_and_unroll(self):
-    return self.test_all_opts([Opt(OptOps.UPCAST, 0, 4), Opt(OptOps.UNROLL, 0, 4)], [Opt(op=OptOps.GROUP, axis=0, amt=0)])
+    return self.test_all_opts([Opt(OptOps.UPCAST, 0, 4), Opt(OptOps.UNROLL, 0, 4)], [Opt(op=OptOps.GROUP, axis=0, amt=0),
+                                                                                   Opt(op=OptOps.THREAD, axis=0, amt=64)])
 
 class TestIndexing(unittest.TestCase):
   def test_arange_2_reduce(self):
     needle = Tensor.zeros(16384, dtype=dtypes.int).contiguous()
     needle[1337] = 1
     needle.realize()
-    with Context(NOOPT=1, FUSE_ARANGE=1):
+    with Context(NOOPT=1, FUSE_ARANGE=2):
       GlobalCounters.reset()
       # TODO: it should work without these reshapes
       out = ((Tensor.arange(1,16385).reshape(16384,1)-1)*needle.reshape(16384,1)).sum()
@@ -175,5 +176,46 @@ class TestIndexing(unittest.TestCase):
   # at least the arange is being fused
   def test_llama_embedding_opt(self): self.test_llama_embedding(0, 1_736_704_000 if CI else 5_898_240_000)
 
+  def test_embedding_vocab_independent(self):
+    x = Tensor([[1, 999]]).realize()
+    ops = []
+    for vocab_size in [1000, 32000]:
+      emb = nn.Embedding(vocab_size, 256)
+      emb.weight.realize()
+      GlobalCounters.reset()
+      z = emb(x).realize()
+      self.assertEqual(GlobalCounters.kernel_count, 1)
+      ops.append(GlobalCounters.global_ops)
+      np.testing.assert_equal(z.numpy(), emb.weight.numpy()[x.numpy()])
+    self.assertEqual(ops[0], ops[1])
+    self.assertLessEqual(ops[0], 4*2*256)
+
+  def test_embedding_backward(self):
+    emb = nn.Embedding(50, 8)
+    emb.weight.requires_grad = True
+    idx = Tensor([[1, 2, 3], [1, 49, 0]])
+    (emb(idx) * Tensor.arange(8).float()).sum().backward()
+    grad = np.zeros((50, 8), np.float32)
+    np.add.at(grad, idx.numpy().flatten(), np.arange(8))
+    np.testing.assert_equal(emb.weight.grad.numpy(), grad)
+
+  def test_gather_fused(self):
+    X = Tensor.rand(64, 512).realize()
+    idxs = Tensor.randint(64, 16, high=512).realize()
+    GlobalCounters.reset()
+    z = X.gather(1, idxs).realize()
+    self.assertEqual(GlobalCounters.kernel_count, 1)
+    self.assertLessEqual(GlobalCounters.global_ops, 4*64*16)
+    np.testing.assert_equal(z.numpy(), np.take_along_axis(X.numpy(), idxs.numpy(), 1))
+
+  def test_gather_reduce_not_split(self):
+    # grouping or unrolling the axes of a gather or its arange would stop them from folding into one load
+    X, idxs = Tensor.empty(64, 512), Tensor.empty(64, 16, dtype=dtypes.int)
+    k = Kernel(X.gather(1, idxs).schedule()[-1].ast)
+    self.assertEqual(sorted(k.gather_axes), [k.first_reduce, k.first_reduce+1])
+    for axis in range(2):
+      for opt in [Opt(OptOps.GROUPTOP, axis, 16), Opt(OptOps.GROUP, axis, 16), Opt(OptOps.UNROLL, axis, 4)]:
+        with self.assertRaises(KernelOptError): k.copy().apply_opt(opt)
+
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,153 @@
+import unittest, unittest.mock, threading, itertools, random, multiprocessing
+import numpy as np
+from tinygrad import Tensor, Device, TinyJit
+from tinygrad.nn.datasets import prefetch, DataLoader
+
+def _batches(n, sz=64):
+  for i in range(n):
+    yield np.full((sz,), i, dtype=np.float32)
+
+class TestPrefetch(unittest.TestCase):
+  def test_order(self):
+    for i,x in enumerate(prefetch(_batches(6))):
+      self.assertIsInstance(x, Tensor)
+      self.assertEqual(x.device, Device.DEFAULT)
+      self.assertTrue(x.lazydata.base.is_realized())
+      np.testing.assert_equal(x.numpy(), i)
+    self.assertEqual(i, 5)
+
+  def test_tuples(self):
+    batches = ((np.arange(4, dtype=np.int32)+i, (Tensor([i]), np.array([i], dtype=np.int32))) for i in range(3))
+    for i,(x,(y,z)) in enumerate(prefetch(batches, depth=1)):
+      np.testing.assert_equal(x.numpy(), np.arange(4)+i)
+      np.testing.assert_equal(y.numpy(), [i])
+      np.testing.assert_equal(z.numpy(), [i])
+
+  def test_jit_step(self):
+    @TinyJit
+    def step(x:Tensor) -> Tensor: return (x*2).sum().realize()
+    self.assertEqual([step(x).item() for x in prefetch(_batches(5))], [i*2*64 for i in range(5)])
+
+  def test_error(self):
+    def bad():
+      yield np.zeros(4, dtype=np.float32)
+      raise ValueError("bad batch")
+    with self.assertRaises(ValueError): list(prefetch(bad()))
+
+  def test_close_stops_thread(self):
+    cnt = threading.active_count()
+    for x in prefetch(np.full((4,), i, dtype=np.float32) for i in itertools.count()):
+      if x.numpy()[0] == 3: break
+    self.assertEqual(threading.active_count(), cnt)
+
+  def test_overlap(self):
+    # the next batch is loaded while the step on this one runs
+    loaded = [threading.Event() for _ in range(6)]
+    def batches():
+      for i,x in enumerate(_batches(6)):
+        loaded[i].set()
+        yield x
+    for i,x in enumerate(prefetch(batches(), depth=1)):
+      x.realize()
+      if i+1 < len(loaded): self.assertTrue(loaded[i+1].wait(timeout=10), f"batch {i+1} wasn't loaded during step {i}")
+
+class _Dataset:
+  def __init__(self, n): self.n = n
+  def __len__(self): return self.n
+  def __getitem__(self, i):
+    if i < 0 or i >= self.n: raise IndexError(i)
+    return np.full((2, 3), i, dtype=np.float32), i
+
+def _noise(x): return x[0] + np.random.rand(*x[0].shape).astype(np.float32) + random.random(), x[1]
+def _label(x): return x[1] * 2
+def _fail(x):
+  if x[1] == 5: raise ValueError("bad sample")
+  return x
+
+class TestDataLoader(unittest.TestCase):
+  def _epoch(self, dl): return [(x.numpy(), y.numpy()) for x,y in dl]
+
+  def test_order(self):
+    dl = DataLoader(_Dataset(10), 4, num_workers=2)
+    self.assertEqual(len(dl), 3)
+    out = self._epoch(dl)
+    self.assertEqual([y.tolist() for _,y in out], [[0,1,2,3], [4,5,6,7], [8,9]])
+    for x,y in out: np.testing.assert_equal(x, np.broadcast_to(y[:, None, None], (len(y), 2, 3)))
+    dl.close()
+
+  def test_drop_last(self):
+    dl = DataLoader(_Dataset(10), 4, num_workers=0, drop_last=True)
+    self.assertEqual(len(dl), 2)
+    self.assertEqual([y.tolist() for _,y in self._epoch(dl)], [[0,1,2,3], [4,5,6,7]])
+    dl.close()
+
+  def test_shuffle_seed(self):
+    dls = [DataLoader(_Dataset(50), 8, num_workers=nw, shuffle=True, seed=3) for nw in [0, 3]]
+    for _ in range(2):
+      (a0,a1) = [[y.tolist() for _,y in self._epoch(dl)] for dl in dls]
+      self.assertEqual(a0, a1)
+      self.assertEqual(sorted(sum(a0, [])), list(range(50)))
+    self.assertNotEqual(a0, [y.tolist() for _,y in self._epoch(DataLoader(_Dataset(50), 8, num_workers=0, shuffle=True, seed=4))])
+    self.assertEqual(dls[0].epoch, 2)
+    for dl in dls: dl.close()
+
+  def test_transform_seed(self):
+    # random transforms get the same numbers no matter which worker loads the sample
+    outs = [self._epoch(DataLoader(_Dataset(12), 4, num_workers=nw, seed=0, transform=_noise)) for nw in [0, 1, 3]]
+    for out in outs[1:]:
+      for (x0,_),(x1,_) in zip(outs[0], out): np.testing.assert_equal(x0, x1)
+
+  def test_single_field(self):
+    dl = DataLoader(_Dataset(6), 3, num_workers=1, transform=_label)
+    out = [x.numpy().tolist() for x in dl]
+    self.assertEqual(out, [[0,2,4], [6,8,10]])
+    dl.close()
+
+  def test_ring_reuse(self):
+    # a copy of each batch is realized before the next one, so a ring of two batches is enough
+    dl = DataLoader(_Dataset(64), 4, num_workers=2, depth=2)
+    self.assertEqual([x.to(Device.DEFAULT).sum().item() for x,_ in dl], [sum(range(i, i+4))*6 for i in range(0, 64, 4)])
+    # batches that are held keep their slots
+    with self.assertRaises(RuntimeError): list(dl)
+    self.assertEqual(len(self._epoch(dl)), 16)
+    dl.close()
+
+  def test_prefetch(self):
+    dl = DataLoader(_Dataset(40), 8, num_workers=2, shuffle=True, seed=1)
+    self.assertEqual(sorted(sum([y.tolist() for _,y in prefetch(dl)], [])), list(range(40)))
+    dl.close()
+
+  def test_prefetch_tensors_on_caller_thread(self):
+    # tinygrad isn't thread safe, the thread only waits on the workers
+    dl, threads, init = DataLoader(_Dataset(40), 8, num_workers=2), set(), Tensor.__init__
+    def record(*args, **kwargs):
+      threads.add(threading.current_thread())
+      init(*args, **kwargs)
+    with unittest.mock.patch.object(Tensor, "__init__", record): self.assertEqual(len(list(prefetch(dl))), 5)
+    self.assertEqual(threads, {threading.current_thread()})
+    dl.close()
+
+  def test_prefetch_break_frees_slots(self):
+    # batches the thread loaded ahead but never yielded give their slots back
+    dl = DataLoader(_Dataset(64), 4, num_workers=2, depth=4)
+    for i,_ in enumerate(prefetch(dl)):
+      if i == 1: break
+    del _
+    self.assertEqual(len(self._epoch(dl)), 16)
+    dl.close()
+
+  def test_error(self):
+    for nw in [0, 2]:
+      with self.assertRaises(ValueError): list(DataLoader(_Dataset(10), 4, num_workers=nw, transform=_fail))
+
+  def test_break_stops_workers(self):
+    dl = DataLoader(_Dataset(1000), 4, num_workers=3)
+    for i,(x,_) in enumerate(dl):
+      if i == 2: break
+    del x
+    self.assertEqual(multiprocessing.active_children(), [])
+    self.assertEqual(len(self._epoch(dl)), 250)
+    dl.close()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,10 +1,12 @@
 import unittest, ctypes, struct
-from tinygrad import Device, Tensor, dtypes
+import numpy as np
+from tinygrad import Device, Tensor, TinyJit, dtypes
 from tinygrad.helpers import CI, getenv
 from tinygrad.device import Buffer, BufferOptions, HCQCompiled
 from tinygrad.engine.schedule import create_schedule
 from tinygrad.engine.realize import get_runner, CompiledRunner
 from tinygrad.codegen.kernel import Kernel, Opt, OptOps
+from tinygrad.nn.datasets import prefetch
 
 MOCKGPU = getenv("MOCKGPU")
 
@@ -470,5 +472,12 @@ class TestHCQ(unittest.TestCase):
 
       assert buf2.as_buffer()[0] == i
 
+  def test_prefetch_jit_step(self):
+    # batches over the 2MB staging buffer size, each copy is queued on the timeline behind the step before it
+    @TinyJit
+    def step(x:Tensor) -> Tensor: return (x+1).sum(dtype=dtypes.int).realize()
+    batches = (np.full(((3 << 20) // 4,), i, dtype=np.int32) for i in range(6))
+    self.assertEqual([step(x).item() for x in prefetch(batches)], [(i+1)*((3 << 20) // 4) for i in range(6)])
+
 if __name__ == "__main__":
   unittest.main()
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-import unittest, functools
+import unittest, functools, os
 import numpy as np
 
 from hypothesis import given, settings, strategies as strat
@@ -7,7 +7,7 @@ from test.helpers import assert_jit_cache_len
 from tinygrad.tensor import Tensor
 from tinygrad.engine.jit import TinyJit
 from tinygrad.device import Device
-from tinygrad.helpers import CI, Context
+from tinygrad.helpers import CI, Context, temp
 from tinygrad.dtype import dtypes
 from extra.models.unet import ResBlock
 
@@ -55,6 +55,18 @@ class TestJit(unittest.TestCase):
     def add(a, b): return [a+b]
     _simple_test(add, extract=lambda x: x[0])
 
+  @unittest.skipUnless(Device.DEFAULT == "CLANG", "ClangGraph")
+  def test_jit_threaded_graph(self):
+    # threaded kernels run on the CPU thread pool from inside the graph, the kernels between them are batched
+    @TinyJit
+    def f(a, b): return ((a+1).sum(1).contiguous() + (b*2).sum(1)).realize()
+    with Context(CPU_THREADS=4):
+      for _ in range(5):
+        a, b = Tensor.rand(256, 256).realize(), Tensor.rand(256, 4).realize()
+        np.testing.assert_allclose(f(a, b).numpy(), (a.numpy()+1).sum(1) + (b.numpy()*2).sum(1), atol=1e-4, rtol=1e-5)
+    assert_jit_cache_len(f, 2)
+    self.assertEqual([isinstance(s, list) for s in f.jit_cache[0].prg.steps], [True, False])
+
   def test_simple_jit_norealize_dict(self):
     @TinyJit
     def add(a, b): return {"billy": a+b}
@@ -412,6 +424,29 @@ class TestJit(unittest.TestCase):
       xc = jf(a)
       np.testing.assert_allclose((a.numpy().sum(axis=(1,)) + 5).view(np.int32), xc.numpy(), atol=1e-4, rtol=1e-5)
 
+class TestJitSaveLoad(unittest.TestCase):
+  def test_save_load(self):
+    w = Tensor.randn(256, 256).realize()
+    @TinyJit
+    def f(x:Tensor) -> Tensor: return ((x @ w).relu() + 1).sum(1)
+    for _ in range(3): f(Tensor.randn(4, 256))
+    f.save(fn:=temp("test_jit_save_load"))
+    # the weights live in the safetensors file, not in the pickle
+    self.assertLess(os.path.getsize(fn), w.nbytes())
+    self.assertGreaterEqual(os.path.getsize(f"{fn}.safetensors"), w.nbytes())
+    f2 = TinyJit.load(fn)
+    for _ in range(2):
+      x = Tensor.randn(4, 256).realize()
+      np.testing.assert_allclose(f2(x).numpy(), ((x.numpy() @ w.numpy()).clip(0, None) + 1).sum(1), atol=1e-4, rtol=1e-5)
+    self.assertEqual(len(f2.jit_cache), len(f.jit_cache))
+
+  def test_load_wrong_device(self):
+    @TinyJit
+    def f(x:Tensor) -> Tensor: return (x+1).contiguous()
+    for _ in range(3): f(Tensor.randn(4))
+    f.save(fn:=temp("test_jit_save_load_dev"))
+    with self.assertRaises(RuntimeError): TinyJit.load(fn, "DISK")
+
 @unittest.skip("Pending multioutput implementation #3607")
 class TestMultioutputJit(unittest.TestCase):
   def _test(self, f):
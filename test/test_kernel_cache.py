@@ -1,7 +1,10 @@
 #!/usr/bin/env python
-import unittest
+import unittest, os
+from unittest.mock import patch
 from tinygrad.tensor import Tensor
 from tinygrad import Device
+from tinygrad.helpers import Context, CACHELEVEL
+from tinygrad.engine.realize import method_cache
 
 class TestKernelCache(unittest.TestCase):
   def test_kernel_cache_in_action(self):
@@ -23,5 +26,33 @@ class TestKernelCache(unittest.TestCase):
 
     Device['CLANG'].compiler = orig_compile_func
 
+  @unittest.skipIf(CACHELEVEL == 0, "runner cache is in the diskcache")
+  def test_runner_cache(self):
+    with Context(RUNNER_CACHE=1):
+      a = Tensor.rand(3,5).realize()
+      out = (a * 3 + 1.5).sum(1)
+      out.realize()
+      method_cache.clear()
+      # a warm start doesn't touch the kernel optimizer or the compiler
+      with patch("tinygrad.engine.realize.get_kernel", side_effect=AssertionError("should be cached")):
+        out2 = (a * 3 + 1.5).sum(1)
+        out2.realize()
+    self.assertListEqual(out.tolist(), out2.tolist())
+
+  @unittest.skipIf(CACHELEVEL == 0, "runner cache is in the diskcache")
+  def test_runner_cache_lowering_vars(self):
+    # a program lowered with other tensor core or transcendental settings isn't reused
+    with Context(RUNNER_CACHE=1):
+      a = Tensor.rand(3,5).realize()
+      (a * 3 + 1.5).sum(1).realize()
+      for ctx in [{"TC": 0}, {"TC_OPT": 1}, {"TRANSCENDENTAL": 2}, {"AMX": 1}]:
+        method_cache.clear()
+        with Context(**ctx), patch("tinygrad.engine.realize.get_kernel", side_effect=RuntimeError("not cached")):
+          with self.assertRaises(RuntimeError): (a * 3 + 1.5).sum(1).realize()
+      # so is one lowered with another environment
+      method_cache.clear()
+      with patch.dict(os.environ, {"BEAM_UOPS_MAX": "10"}), patch("tinygrad.engine.realize.get_kernel", side_effect=RuntimeError("not cached")):
+        with self.assertRaises(RuntimeError): (a * 3 + 1.5).sum(1).realize()
+
 if __name__ == "__main__":
   unittest.main()
@@ -1757,6 +1757,16 @@ class TestHandCodedOpts(unittest.TestCase):
     assert k.local_dims == 1
     assert k.upcasted == 1
 
+  @unittest.skipUnless(Device[Device.DEFAULT].renderer.has_local, "test requires locals")
+  def test_matvec_sibling_reduce(self):
+    # a matvec that shares its kernel with another reduce over the same axis can't be grouped
+    a, b = Tensor.rand(64, 256).realize(), Tensor.rand(256).realize()
+    sched = [si for si in create_schedule([(a*b).sum(1).lazydata, a.sum(1).lazydata]) if si.ast.op is UOps.SINK]
+    assert len(sched) == 1
+    k = Kernel(sched[0].ast)
+    k.hand_coded_optimizations()
+    assert k.group_for_reduces == 0
+
 def helper_linearizer_ast(ast:UOp, inputs:List[Tensor], *args, **kwargs):
   assert isinstance(ast, UOp), "ast must be UOp"
   inbufs = [x.lazydata.base.buffer for x in inputs]
@@ -2144,6 +2154,41 @@ class TestKernelOpts(unittest.TestCase):
       [Opt(OptOps.PADTO, 0, 32), Opt(OptOps.UPCAST, 0, 8), Opt(OptOps.GROUP, 0, 4)]
     ])
 
+  @unittest.skipUnless(Device[Device.DEFAULT].renderer.has_threads, "test requires threads")
+  def test_threads(self):
+    N = 64
+    Tensor.manual_seed(1552)
+    a = Tensor.rand(N, N)
+    b = Tensor.rand(N, N)
+    r = a@b
+    with Context(CPU_THREADS=4):
+      helper_linearizer_opt(r, [
+        [Opt(OptOps.THREAD, 0, 4)],
+        [Opt(OptOps.THREAD, 1, 8)],
+        [Opt(OptOps.THREAD, 0, 0)], # more threads than cores
+        [Opt(OptOps.THREAD, 0, 4), Opt(OptOps.UPCAST, 0, 4)], # full upcast of the threaded dim
+        [Opt(OptOps.THREAD, 0, 2), Opt(OptOps.UPCAST, 1, 4), Opt(OptOps.UNROLL, 0, 4)],
+      ], color_sizes=[[("blue",4),("blue",16),("blue",64),("red",64)]])
+
+  @unittest.skipUnless(Device[Device.DEFAULT].renderer.has_threads, "test requires threads")
+  def test_threads_hand_coded(self):
+    with Context(CPU_THREADS=4):
+      k = Kernel(create_schedule([(Tensor.rand(256, 256)+1).sum(1).lazydata])[-1].ast).hand_coded_optimizations()
+    self.assertIn(Opt(OptOps.THREAD, 0, 4), k.applied_opts)
+    self.assertEqual(k.to_program().global_size, [4, 1, 1])
+    with Context(CPU_THREADS=1):
+      k = Kernel(create_schedule([(Tensor.rand(256, 256)+1).sum(1).lazydata])[-1].ast).hand_coded_optimizations()
+    self.assertFalse(any(o.op is OptOps.THREAD for o in k.applied_opts))
+
+  def test_threads_invalid(self):
+    k = Kernel(create_schedule([(Tensor.rand(16, 16)+1).sum(1).lazydata])[-1].ast)
+    if not k.opts.has_threads:
+      with self.assertRaises(KernelOptError): k.apply_opt(Opt(OptOps.THREAD, 0, 4))
+      return
+    with self.assertRaises(KernelOptError): k.apply_opt(Opt(OptOps.THREAD, 1, 4)) # reduce axis
+    k.apply_opt(Opt(OptOps.THREAD, 0, 4))
+    with self.assertRaises(KernelOptError): k.apply_opt(Opt(OptOps.THREAD, 0, 2)) # already threaded
+
   @unittest.skipUnless(Device[Device.DEFAULT].renderer.has_local, "test requires locals")
   @unittest.skipUnless(Device[Device.DEFAULT].renderer.has_shared, "test requires shared")
   def test_color_shapes_with_local(self):
@@ -0,0 +1,67 @@
+import unittest
+from tinygrad import Device, dtypes
+from tinygrad.device import Buffer, LRUAllocator
+from tinygrad.helpers import Context, temp
+from tinygrad.engine.realize import _internal_memory_planner, _arena_offsets
+
+def _bufs(*sizes): return [Buffer(Device.DEFAULT, sz, dtypes.float32) for sz in sizes]
+
+class TestArenaOffsets(unittest.TestCase):
+  def test_disjoint_lifetimes_share(self):
+    a, b = _bufs(256, 256)
+    offsets, size = _arena_offsets([(0, 1, a), (2, 3, b)], 1)
+    self.assertEqual(offsets[a], offsets[b])
+    self.assertEqual(size, 1024)
+
+  def test_overlapping_lifetimes_dont(self):
+    a, b, c = _bufs(256, 128, 64)
+    offsets, size = _arena_offsets([(0, 2, a), (1, 3, b), (3, 4, c)], 1)
+    self.assertEqual(offsets[a], 0)
+    self.assertEqual(offsets[b], 1024)
+    # c is only live with b, so it fits where a was
+    self.assertEqual(offsets[c], 0)
+    self.assertEqual(size, 1024+512)
+
+  def test_align(self):
+    a, b = _bufs(3, 3)
+    offsets, _ = _arena_offsets([(0, 1, a), (0, 1, b)], 512)
+    self.assertEqual(sorted(offsets.values()), [0, 512])
+
+@unittest.skipUnless(hasattr(Device[Device.DEFAULT].allocator, "offset"), "arena needs offset")
+class TestArenaPlanner(unittest.TestCase):
+  def test_one_arena(self):
+    a, b, c, d = _bufs(256, 256, 256, 256)
+    # a -> b -> c -> d, only two are live at a time
+    assigned = _internal_memory_planner([[b, a], [c, b], [d, c]])
+    self.assertEqual(len(set(assigned[x].base for x in [a, b, c, d])), 1)
+    self.assertTrue(2*1024 <= assigned[a].base.nbytes <= 2*1024*1.25)
+    for x,y in [(a, b), (b, c), (c, d)]: self.assertNotEqual(assigned[x].offset, assigned[y].offset)
+
+  @unittest.skipUnless(isinstance(Device[Device.DEFAULT].allocator, LRUAllocator), "size classes are for the LRU cache")
+  def test_arena_size_class(self):
+    # arenas of schedules that need about the same memory have the same size, so the LRU cache reuses them
+    a, b = _bufs(4096, 4096)
+    c, d = _bufs(4096, 4224)
+    self.assertEqual(_internal_memory_planner([[b, a]])[a].base.nbytes, _internal_memory_planner([[d, c]])[c].base.nbytes)
+
+  def test_views_follow_base(self):
+    a, b = _bufs(256, 256)
+    v = Buffer(Device.DEFAULT, 64, dtypes.float32, base=b, offset=256)
+    assigned = _internal_memory_planner([[a], [b, a], [v]])
+    self.assertIs(assigned[v].base, assigned[b].base)
+    self.assertEqual(assigned[v].offset, assigned[b].offset + 256)
+
+  def test_disabled(self):
+    a, b = _bufs(256, 256)
+    with Context(ARENA_PLANNER=0): assigned = _internal_memory_planner([[a], [b]])
+    self.assertIs(assigned[a], assigned[b])
+
+class TestArenaDevices(unittest.TestCase):
+  def test_disk_not_packed(self):
+    # DISK can offset too, but only compute devices get an arena
+    a, b = [Buffer(f"disk:{temp('test_arena_disk')}", 256, dtypes.float32) for _ in range(2)]
+    assigned = _internal_memory_planner([[a], [b]])
+    self.assertTrue(all(x.base.dtype == dtypes.float32 for x in assigned.values()))
+
+if __name__ == '__main__':
+  unittest.main()
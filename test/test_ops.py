@@ -709,6 +709,23 @@ class TestOps(unittest.TestCase):
     helper_test_op([(10,20)], lambda x: x.argmin(1, False).type(torch.int32), lambda x: x.argmin(1, False), forward_only=True)
     helper_test_op([(10,20)], lambda x: x.argmin(1, True).type(torch.int32), lambda x: x.argmin(1, True), forward_only=True)
 
+  def test_sort(self):
+    # stable, equal values keep their order
+    np.testing.assert_equal(Tensor([2,1,2,1]).sort()[1].numpy(), [1,3,0,2])
+    np.testing.assert_equal(Tensor([2,1,2,1]).sort(descending=True)[1].numpy(), [0,2,1,3])
+    for shape,dim in [((45,),0), ((10,20),1), ((10,20),0), ((3,4,33),-1)]:
+      for desc in [False, True]:
+        helper_test_op([shape], lambda x: x.sort(dim, desc)[0], lambda x: x.sort(dim, desc)[0], forward_only=True)
+        helper_test_op([shape], lambda x: x.sort(dim, desc)[1].type(torch.int32), lambda x: x.sort(dim, desc)[1], forward_only=True)
+    helper_test_op([(10,20)], lambda x: x.argsort(1).type(torch.int32), lambda x: x.argsort(1), forward_only=True)
+
+  def test_topk(self):
+    np.testing.assert_equal(Tensor([2,1,2,1]).topk(3)[1].numpy(), [0,2,1])
+    for shape,k,dim in [((45,),5,0), ((10,20),3,1), ((10,20),10,0), ((3,1000),50,1), ((2,300),300,1)]:
+      for largest in [True, False]:
+        helper_test_op([shape], lambda x: x.topk(k, dim, largest)[0], lambda x: x.topk(k, dim, largest)[0], forward_only=True)
+        helper_test_op([shape], lambda x: x.topk(k, dim, largest)[1].type(torch.int32), lambda x: x.topk(k, dim, largest)[1], forward_only=True)
+
   def test_einsum(self):
     # matrix transpose
     helper_test_op([(150,150)], lambda a: torch.einsum('ij->ji', a), lambda a: Tensor.einsum('ij->ji', a))
@@ -2087,6 +2104,16 @@ class TestOps(unittest.TestCase):
                    lambda x,y,z: torch.nn.functional.scaled_dot_product_attention(x,y,z,is_causal=True),
                    lambda x,y,z: Tensor.scaled_dot_product_attention(x,y,z,is_causal=True))
 
+  def test_scaled_product_attention_flash(self):
+    with Context(FLASH_ATTENTION=4):
+      helper_test_op([(4,2,10,16), (4,2,18,16), (4,2,18,16)], torch.nn.functional.scaled_dot_product_attention, Tensor.scaled_dot_product_attention)
+      helper_test_op([(4,2,18,16), (4,2,18,16), (4,2,18,16), (4,1,18,18)],
+                     lambda x,y,z,m: torch.nn.functional.scaled_dot_product_attention(x,y,z,attn_mask=m),
+                     lambda x,y,z,m: Tensor.scaled_dot_product_attention(x,y,z,attn_mask=m))
+      helper_test_op([(4,2,18,16), (4,2,18,16), (4,2,18,16)],
+                     lambda x,y,z: torch.nn.functional.scaled_dot_product_attention(x,y,z,is_causal=True),
+                     lambda x,y,z: Tensor.scaled_dot_product_attention(x,y,z,is_causal=True))
+
   def test_binary_crossentropy(self):
     helper_test_op([(32,10), (32,10)], lambda x,y: torch.nn.functional.binary_cross_entropy(x.sigmoid(),torch.clip(y,0,1)),
                                        lambda x,y: x.sigmoid().binary_crossentropy(y.clip(0,1)))
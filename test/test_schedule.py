@@ -16,15 +16,17 @@ from tinygrad.shape.view import View
 from tinygrad.tensor import Tensor
 from tinygrad.ops import BinaryOps, MetaOps, UOp, UnaryOps, UOps
 from tinygrad.ops import graph_rewrite
-from tinygrad.helpers import AST_REWRITE, CI, DEBUG, FUSE_ARANGE, flatten, getenv, SPLIT_REDUCEOP, unwrap, prod
+from tinygrad.helpers import AST_REWRITE, CI, DEBUG, FUSE_ARANGE, GlobalCounters, flatten, getenv, SPLIT_REDUCEOP, unwrap, prod
 from tinygrad.codegen.kernel import Kernel, verify_ast
-from tinygrad.engine.schedule import create_schedule, reduceop_fusor, st_fixup
+from tinygrad.engine.schedule import create_schedule, create_schedule_with_vars, reduceop_fusor, st_fixup, schedule_cache
 from tinygrad.engine.realize import CompiledRunner, run_schedule
 from test.helpers import ast_const, is_dtype_supported, Context, timeit
 from tinygrad.lazy import LazyBuffer, view_supported_devices
 from extra.models.llama import precompute_freqs_cis
 
 class KernelCountException(Exception): pass
+# sibling reduces that hand_coded_optimizations would GROUP stay in separate kernels on these renderers
+GROUP_REDUCES = Device[Device.DEFAULT].renderer.has_local and Device[Device.DEFAULT].renderer.has_shared
 def check_schedule(t:Union[Tensor, List[Tensor], LazyBuffer], allowed:int, to_prerealize:Optional[List[Tensor]]=None, filter_sink=True):
   if isinstance(t, Tensor): outs = t.lazydata.lbs
   elif isinstance(t, List): outs = flatten([r.lazydata.lbs for r in t])
@@ -259,7 +261,7 @@ class TestSchedule(unittest.TestCase):
 
   def test_fold_conv_batchnorm_optim(self):
     # this is too high
-    for optim, cnt in [(nn.optim.Adam, 17), (nn.optim.SGD, 15)]:
+    for optim, cnt in [(nn.optim.Adam, 14), (nn.optim.SGD, 12)]:
       with self.subTest(optim=optim.__name__):
         with Tensor.train():
           img = Tensor.ones(1,3,4,4)
@@ -281,7 +283,7 @@ class TestSchedule(unittest.TestCase):
         fw = bn(x).contiguous_backward().relu().contiguous()
         fw.sum().backward()
         # TODO: this is too many
-        check_schedule([x.grad, bn.weight.grad, bn.bias.grad, fw], 10)
+        check_schedule([x.grad, bn.weight.grad, bn.bias.grad, fw], 10 if GROUP_REDUCES else 7)
 
   def test_fold_conv_relu(self):
     c1 = nn.Conv2d(3,16,3)
@@ -489,7 +491,7 @@ class TestSchedule(unittest.TestCase):
     check_schedule(c, 2)
 
   def test_double_from(self):
-    x = Tensor([1,2,3,4])
+    x = Tensor(np.array([1,2,3,4]), device="NPY").to(Device.DEFAULT)
     out = x.to('npy')
     check_schedule(out, 0, filter_sink=False)
 
@@ -762,6 +764,16 @@ class TestSchedule(unittest.TestCase):
     out = Tensor.scaled_dot_product_attention(q,k,v)
     check_schedule(out, 5) # correctness checked in test_ops
 
+  def test_scaled_dot_product_attention_flash_default(self):
+    # the blocked softmax is on by default only on the cpu backends
+    def sdpa_kernels(device, **ctx):
+      q, k, v = [Tensor.empty(1,2,4,8, device=device), Tensor.empty(1,2,520,8, device=device), Tensor.empty(1,2,520,8, device=device)]
+      with Context(**ctx): return len(create_schedule([q.scaled_dot_product_attention(k, v).lazydata]))
+    for device in ["CLANG", Device.DEFAULT]:
+      plain, flash = sdpa_kernels(device, FLASH_ATTENTION=0), sdpa_kernels(device, FLASH_ATTENTION=512)
+      self.assertEqual(sdpa_kernels(device), flash if device in {"CLANG", "LLVM"} else plain)
+      self.assertNotEqual(plain, flash)
+
   # multireduce spec
   def test_ugly_reduceop_pairing(self):
     Tensor.manual_seed(0)
@@ -770,7 +782,7 @@ class TestSchedule(unittest.TestCase):
     c = Tensor.randn(4, 32).realize()
     out = (c * a.sum(-1, keepdim=True)).sum(-1) + (b * a.sum(-1, keepdim=True)).sum(-1) # a.sum has >1 children but should still fuse
     # run_schedule(check_schedule(out, 1))
-    run_schedule(check_schedule(out, 3))
+    run_schedule(check_schedule(out, 3 if GROUP_REDUCES else 2))
     np.testing.assert_allclose(out.numpy(), \
       (c.numpy()*a.numpy().sum(axis=-1,keepdims=True)).sum(-1) + (b.numpy()*a.numpy().sum(axis=-1,keepdims=True)).sum(-1), atol=1e-4, rtol=1e-4)
 
@@ -872,7 +884,7 @@ class TestSchedule(unittest.TestCase):
     np_mu = (x.numpy() - x.numpy().max(axis=-1, keepdims=True)).mean(axis=-1, keepdims=True) + \
       (y.numpy() - y.numpy().max(axis=-1, keepdims=True)).mean(axis=-1, keepdims=True)
     # run_schedule(check_schedule(out, 1))
-    run_schedule(check_schedule(out, 6))
+    run_schedule(check_schedule(out, 6 if GROUP_REDUCES else 5))
     np.testing.assert_allclose(out[0].numpy(), np.sqrt(np.square(x.numpy() - np_mu).sum(-1)/x.shape[-1]), atol=1e-4, rtol=1e-4)
     np.testing.assert_allclose(out[1].numpy(), np.sqrt(np.square(y.numpy() - np_mu).sum(-1)/y.shape[-1]), atol=1e-4, rtol=1e-4)
 
@@ -886,6 +898,48 @@ class TestSchedule(unittest.TestCase):
     run_schedule(check_schedule(out, 2))
     np.testing.assert_allclose(out.numpy(), a.numpy()@b.numpy() + c.numpy()@d.numpy(), atol=1e-4, rtol=1e-4)
 
+  def test_multireduce_siblings_fusion(self):
+    Tensor.manual_seed(0)
+    x = Tensor.randn(4, 8).realize()
+    out = [x.sum(-1), x.max(-1), x.square().sum(-1)]
+    run_schedule(check_schedule(out, 1))
+    np.testing.assert_allclose(out[0].numpy(), x.numpy().sum(-1), atol=1e-4, rtol=1e-4)
+    np.testing.assert_allclose(out[1].numpy(), x.numpy().max(-1))
+    np.testing.assert_allclose(out[2].numpy(), np.square(x.numpy()).sum(-1), atol=1e-4, rtol=1e-4)
+
+  def test_multireduce_siblings_group(self):
+    x = Tensor.empty(4, 256)
+    check_schedule([x.sum(-1), x.max(-1)], 2 if GROUP_REDUCES else 1)
+
+  def test_multireduce_siblings_no_multioutput(self):
+    x = Tensor.empty(4, 32)
+    with Context(MULTIOUTPUT=0): check_schedule([x.sum(-1), x.max(-1)], 2)
+
+  def test_multireduce_siblings_different_axis(self):
+    x = Tensor.empty(4, 32)
+    check_schedule([x.sum(0), x.sum(1)], 2)
+
+  @unittest.skipIf(GROUP_REDUCES, "the stats reduces are grouped")
+  def test_batchnorm_stats_one_pass(self):
+    Tensor.manual_seed(0)
+    x = Tensor.randn(16, 8, 12, 12).realize()
+    with Tensor.train(), Context(ONEPASS_VAR=1): mean, var = nn.BatchNorm2d(8).calc_stats(x)
+    GlobalCounters.reset()
+    run_schedule(check_schedule([mean, var], 1))
+    # x is read once
+    self.assertEqual(GlobalCounters.global_mem, x.nbytes()+mean.nbytes()+var.nbytes())
+    np.testing.assert_allclose(mean.numpy(), x.numpy().mean((0,2,3)), atol=1e-5, rtol=1e-5)
+    np.testing.assert_allclose(var.numpy(), x.numpy().var((0,2,3)), atol=1e-4, rtol=1e-4)
+
+  def test_var_first_element_far_from_mean(self):
+    # the one pass var cancels here, so it stays behind ONEPASS_VAR
+    a = np.random.default_rng(0).standard_normal((4, 4096), dtype=np.float32)
+    a[:, 0] = 1e4
+    x = Tensor(a).realize()
+    out = x.var(-1)
+    run_schedule(check_schedule(out, 2))
+    np.testing.assert_allclose(out.numpy(), x.numpy().var(-1, ddof=1), rtol=1e-5)
+
   def test_softmax_fusion(self):
     Tensor.manual_seed(0)
     x = Tensor.randn(4, 12, 64, 64).realize()
@@ -903,7 +957,6 @@ class TestSchedule(unittest.TestCase):
     layer.bias = Tensor.randn(10,10).realize()
     x = Tensor.randn(20, 5, 10, 10).realize()
     out = layer(x)
-    # run_schedule(check_schedule(out, 2))
     run_schedule(check_schedule(out, 3))
     y = (x.numpy() - x.numpy().mean(layer.axis, keepdims=True))
     expected = y / np.sqrt((y*y).mean(layer.axis, keepdims=True) + layer.eps)
@@ -1125,8 +1178,7 @@ class TestSchedule(unittest.TestCase):
     Tensor.manual_seed(0)
     a = Tensor.randn(16, 16).realize()
     b = (a.sum(0)+a.max(0) + a.max(1)+a.sum(1)) + 2
-    # schedule = check_schedule(b, 2)
-    schedule = check_schedule(b, 4)
+    schedule = check_schedule(b, 4 if GROUP_REDUCES else 2)
     self.assertIs(schedule[0].ast.src[0].src[2].op, UOps.REDUCE_AXIS)
     run_schedule(schedule)
     np.testing.assert_allclose(b.numpy(), a.numpy().sum(0)+a.numpy().max(0) + a.numpy().max(1)+a.numpy().sum(1)+2, atol=1e-4, rtol=1e-4)
@@ -1334,7 +1386,7 @@ class TestSchedule(unittest.TestCase):
 
 class TestIndexing(unittest.TestCase):
   def check_schedule(self, xt:Union[Tensor,List[Tensor]], cnt:int):
-    with Context(FUSE_ARANGE=getenv("FUSE_ARANGE", 1)):
+    with Context(FUSE_ARANGE=getenv("FUSE_ARANGE", 2)):
       lst = [xt] if isinstance(xt, Tensor) else xt
       s = Tensor.schedule(*lst)
       kernels = [si for si in s if si.ast.op is UOps.SINK]
@@ -1568,7 +1620,7 @@ class TestIndexing(unittest.TestCase):
   @unittest.expectedFailure
   def test_multiview_arange_children(self):
     X = Tensor.randn(2,3,4,4).numpy()
-    with Context(FUSE_ARANGE=1):
+    with Context(FUSE_ARANGE=2):
       compare = Tensor(X).interpolate(size=(2, 2), mode="linear").numpy()
     with Context(FUSE_ARANGE=0, GRAPH=0, SAVE_SCHEDULE=1):
       ref = Tensor(X).interpolate(size=(2, 2), mode="linear").numpy()
@@ -1742,5 +1794,64 @@ class TestScheduleRewrite(unittest.TestCase):
     self.assertGreater(prod(new_load_st.shape), prod(ld_st.shape))
     self.assertEqual(new_load_st.views[0].strides, (0, 9, 3, 0, 1, 0, 27))
 
+class TestScheduleCache(unittest.TestCase):
+  def test_hit_rebinds_buffers(self):
+    schedule_cache.clear()
+    for i in range(3):
+      a, b = (Tensor([1.,2.,3.,4.])+i).realize(), Tensor([4.,3.,2.,1.]).realize()
+      out, cached = ((a+b)*2).sum(), len(schedule_cache)
+      sched = create_schedule([out.lazydata])
+      self.assertEqual(len(schedule_cache), cached+(i == 0))
+      self.assertIs(sched[-1].outputs[0], out.lazydata.base.buffer)
+      self.assertEqual(set(sched[0].inputs), {a.lazydata.base.buffer, b.lazydata.base.buffer})
+      run_schedule(sched)
+      self.assertEqual(out.item(), (20+4*i)*2)
+
+  def test_structure_changes_key(self):
+    a, b = Tensor.empty(4).realize(), Tensor.empty(4).realize()
+    schedule_cache.clear()
+    create_schedule([(a+b).lazydata])
+    # same ops but one realized input used twice
+    sched = create_schedule([(a+a).lazydata])
+    self.assertEqual(len(schedule_cache), 2)
+    self.assertEqual(sched[0].inputs, (a.lazydata.base.buffer,))
+    create_schedule([(a*b).lazydata])
+    create_schedule([(a+b.reshape(2, 2).T.reshape(4)).lazydata])
+    self.assertEqual(len(schedule_cache), 4)
+
+  def test_symbolic_hit(self):
+    from tinygrad.shape.symbolic import Variable
+    a = Tensor.empty(10).realize()
+    schedule_cache.clear()
+    for i in range(1, 4):
+      vi = Variable("i", 1, 10).bind(i)
+      sched, var_vals = create_schedule_with_vars([(a.shrink(((0, vi),))+1).lazydata])
+      self.assertEqual(len(sched), 1)
+      self.assertEqual(list(var_vals.values()), [i])
+    self.assertEqual(len(schedule_cache), 1)
+
+  def test_symbolic_assign_hit(self):
+    from tinygrad.shape.symbolic import Variable
+    a = Tensor.zeros(10).contiguous().realize()
+    vals = {i:Tensor.full((1,), float(i)).contiguous().realize() for i in [2, 5]}
+    schedule_cache.clear()
+    for i in [2, 5, 2]:
+      vi = Variable("i", 0, 9).bind(i)
+      sched, var_vals = create_schedule_with_vars([a.shrink(((vi, vi+1),)).assign(vals[i]).lazydata])
+      self.assertEqual(list(var_vals.values()), [i])
+      run_schedule(sched, var_vals)
+    self.assertEqual(len(schedule_cache), 1)
+    self.assertEqual(a.tolist(), [0, 0, 2, 0, 0, 5, 0, 0, 0, 0])
+
+  def test_size_limit(self):
+    a = Tensor.empty(4).realize()
+    schedule_cache.clear()
+    with Context(SCHEDULE_CACHE=0): create_schedule([(a+1).lazydata])
+    self.assertEqual(len(schedule_cache), 0)
+    with Context(SCHEDULE_CACHE=1):
+      create_schedule([(a+1).lazydata])
+      create_schedule([(a*a).lazydata])
+    self.assertEqual(len(schedule_cache), 1)
+
 if __name__ == '__main__':
   unittest.main(verbosity=2)
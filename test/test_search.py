@@ -1,15 +1,17 @@
-import unittest
+import unittest, os, json, threading, time
+from unittest.mock import patch
 
 from test.helpers import ast_const
 from tinygrad.codegen.kernel import Opt, OptOps
 from tinygrad.codegen.kernel import Kernel
 from tinygrad.ops import UOp, UOps, BinaryOps
 from tinygrad.engine.schedule import create_schedule
-from tinygrad.engine.search import time_linearizer, bufs_from_lin, actions, beam_search
+from tinygrad.engine.search import time_linearizer, bufs_from_lin, actions, beam_search, get_kernel_actions, _dedup_lins, _rank_lins
+from tinygrad.engine.search import cost_features, load_cost_model, _compile_pipelined
 from tinygrad.device import Device, Buffer
 from tinygrad.tensor import Tensor
 from tinygrad.dtype import dtypes, PtrDType
-from tinygrad.helpers import Context, GlobalCounters
+from tinygrad.helpers import Context, GlobalCounters, getenv, temp, prod, diskcache_get
 from tinygrad.engine.realize import capturing
 from tinygrad.shape.shapetracker import ShapeTracker
 from tinygrad.shape.view import View
@@ -154,5 +156,66 @@ class TestBEAM(unittest.TestCase):
     beam_search(lin, bufs, 3, disable_cache=True)
     self.assertEqual(kcount, len(Kernel.kernel_cnt))
 
+  def test_dedup_lins(self):
+    si = (Tensor.rand(16, 16) + 1).schedule()[-1]
+    # applying the same opts in a different order gives the same kernel
+    lins = [y for x in get_kernel_actions(Kernel(si.ast), include_0=False).values() for y in get_kernel_actions(x, include_0=False).values()]
+    deduped = _dedup_lins(lins)
+    self.assertLess(len(deduped), len(lins))
+    # no distinct program is lost
+    self.assertSetEqual(set(x.to_program("test").src for x in deduped), set(x.to_program("test").src for x in lins))
+
+  def test_beam_budget(self):
+    si = (Tensor.rand(64, 64) + 1).schedule()[-1]
+    lin = Kernel(si.ast)
+    getenv.cache_clear()
+    with patch.dict(os.environ, {"BEAM_BUDGET_SEC": "1e-9"}):
+      # out of budget before anything is timed, so the kernel is returned unoptimized
+      self.assertListEqual(beam_search(lin, bufs_from_lin(lin), 2, disable_cache=True).applied_opts, [])
+    getenv.cache_clear()
+
+  def test_pipelined_compile_timeout(self):
+    # a hung compile on the thread is skipped after the timeout, the rest still compile
+    hang = threading.Event()
+    def fxn(x):
+      if x[0] == 2: hang.wait()
+      return x[0], x[1]*2
+    st = time.perf_counter()
+    out = list(_compile_pipelined(fxn, [(i, i) for i in range(5)], 0.2))
+    hang.set()
+    self.assertListEqual(out, [(0, 0), (1, 2), (2, None), (3, 6), (4, 8)])
+    self.assertLess(time.perf_counter()-st, 5)
+
+  def test_cost_model(self):
+    si = (Tensor.rand(16, 16) + 1).schedule()[-1]
+    lins = list(get_kernel_actions(Kernel(si.ast)).values())
+    feats = cost_features(lins[0], lins[0].linearize().uops, {})
+    self.assertEqual(len(feats), len(UOps) + 6)
+    # a model that only looks at the upcast size
+    weights = [0.0] * len(feats)
+    weights[len(UOps)] = 1.0
+    with open(fn:=temp("test_cost_model.json"), "w") as f:
+      json.dump({"weights": weights, "bias": 0.0, "mean": [0.0]*len(feats), "std": [1.0]*len(feats)}, f)
+    ranked = _rank_lins(lins, load_cost_model(fn), {})
+    self.assertEqual(ranked[0].upcasted, 0)
+    def upcast_size(k): return prod(k.full_shape[k.shape_len-k.upcasted:])
+    self.assertEqual(upcast_size(ranked[-1]), max(upcast_size(x) for x in lins))
+
+  def test_cost_samples_table(self):
+    # beam timings are early stopped, they go to their own table and never into time_linearizer
+    si = (Tensor.rand(16, 16) + 1).schedule()[-1]
+    lin = Kernel(si.ast)
+    with patch("tinygrad.engine.search.BEAM_COST_SAMPLES", 1): beam_search(lin, bufs_from_lin(lin), 2, disable_cache=True)
+    samples = 0
+    for x in get_kernel_actions(lin, include_0=False).values():
+      key = {"ast": x.ast.key, "opts": str(x.applied_opts), "device": x.opts.device, "suffix": x.opts.suffix}
+      if (val:=diskcache_get("cost_samples", key)) is not None:
+        samples += 1
+        self.assertEqual(len(val[0]), len(UOps) + 6)
+      for allow_test_size,clear_l2 in [(True, False), (True, True), (False, True)]:
+        tl_key = {**key, "allow_test_size": allow_test_size, "max_global_size": 65536, "clear_l2": clear_l2}
+        self.assertIsNone(diskcache_get("time_linearizer", tl_key))
+    self.assertGreater(samples, 0)
+
 if __name__ == '__main__':
   unittest.main()
@@ -1,9 +1,11 @@
 import unittest
+from unittest.mock import patch
 
 from test.helpers import assert_jit_cache_len
 from tinygrad.engine.jit import TinyJit
 from tinygrad.shape.symbolic import Variable
 from tinygrad.tensor import Tensor
+from tinygrad.helpers import all_int, argfix
 import numpy as np
 
 class TestSymbolicJit(unittest.TestCase):
@@ -291,5 +293,86 @@ class TestSymbolicJit(unittest.TestCase):
         expected = a.var(1).numpy()
         np.testing.assert_allclose(symbolic, expected, atol=1e-6, rtol=1e-6)
 
+  def test_symbolic_batch(self):
+    def f(x, w): return (x@w).relu().realize()
+    jf = TinyJit(f, symbolic={0:{0:Variable("bs", 1, 16)}})
+    w = Tensor.rand(8, 4).realize()
+    captured = None
+    for bs in [3, 1, 7, 16, 2]:
+      x = Tensor.rand(bs, 8)
+      out = jf(x, w)
+      assert out.shape == (bs, 4)
+      np.testing.assert_allclose(out.numpy(), f(x, w).numpy(), atol=1e-6, rtol=1e-6)
+      if jf.captured is not None:
+        if captured is None: captured = jf.captured
+        assert jf.captured is captured
+    assert_jit_cache_len(jf, 1)
+    assert len(jf.concrete) == 0
+
+  def test_symbolic_kwarg_tuple_out(self):
+    def f(a, b=None): return (a+b).realize(), (a*b).realize()
+    jf = TinyJit(f, symbolic={0:{1:Variable("i", 1, 10)}, "b":{1:Variable("i", 1, 10)}})
+    for i in range(1, 5):
+      a, b = Tensor.rand(3, i), Tensor.rand(3, i)
+      s, m = jf(a, b=b)
+      np.testing.assert_allclose(s.numpy(), (a+b).numpy(), atol=1e-6, rtol=1e-6)
+      np.testing.assert_allclose(m.numpy(), (a*b).numpy(), atol=1e-6, rtol=1e-6)
+    assert_jit_cache_len(jf, 2)
+
+  def test_symbolic_out_of_range(self):
+    def f(a): return (a+1).realize()
+    jf = TinyJit(f, symbolic={0:{0:Variable("bs", 1, 4)}}, max_concrete=2)
+    for bs in [5, 6, 5, 7, 2, 3]:
+      a = Tensor.rand(bs, 3)
+      np.testing.assert_allclose(jf(a).numpy(), a.numpy()+1, atol=1e-6, rtol=1e-6)
+    assert not jf.symbolic_failed
+    assert_jit_cache_len(jf, 1)
+    assert [k[0][1] for k in jf.concrete.keys()] == [(5, 3), (7, 3)]
+
+  def test_symbolic_python_int_fallback(self):
+    # python control flow on a symbolic dim fails before any kernel runs, so the function runs again with concrete shapes
+    def f(a): return Tensor.stack(*[a[i]*i for i in range(a.shape[0])]).realize()
+    jf = TinyJit(f, symbolic={0:{0:Variable("bs", 1, 8)}})
+    for bs in [2, 3, 2, 3, 2]:
+      a = Tensor.rand(bs, 3)
+      np.testing.assert_allclose(jf(a).numpy(), a.numpy()*np.arange(bs)[:, None], atol=1e-6, rtol=1e-6)
+    assert jf.symbolic_failed
+    assert len(jf.concrete) == 2 and all(j.captured is not None for j in jf.concrete.values())
+
+  def test_symbolic_attention_fallback(self):
+    # scaled_dot_product_attention asserts the query shape is concrete
+    def f(q, k, v): return q.scaled_dot_product_attention(k, v).realize()
+    jf = TinyJit(f, symbolic={0:{1:Variable("seq", 1, 8)}, 1:{1:Variable("seq", 1, 8)}, 2:{1:Variable("seq", 1, 8)}})
+    for seq in [3, 4, 3]:
+      q, k, v = Tensor.rand(2, seq, 4), Tensor.rand(2, seq, 4), Tensor.rand(2, seq, 4)
+      np.testing.assert_allclose(jf(q, k, v).numpy(), f(q, k, v).numpy(), atol=1e-6, rtol=1e-6)
+    assert jf.symbolic_failed and len(jf.concrete) == 2
+
+  def test_symbolic_error_after_kernel_not_rerun(self):
+    # once a kernel ran the function isn't run again, the error is raised
+    calls = []
+    def f(a):
+      calls.append(a.shape)
+      b = (a+1).realize()
+      return Tensor.stack(*[b[i]*i for i in range(b.shape[0])]).realize()
+    jf = TinyJit(f, symbolic={0:{0:Variable("bs", 1, 8)}})
+    with self.assertRaises(TypeError): jf(Tensor.rand(2, 3))
+    assert len(calls) == 1 and not jf.symbolic_failed and len(jf.concrete) == 0
+
+  def test_symbolic_fallback(self):
+    # inputs that can't be made symbolic fall back before the function runs, each batch size gets its own capture
+    def f(a): return (a+1).realize()
+    jf = TinyJit(f, symbolic={0:{0:Variable("bs", 1, 8)}})
+    reshape = Tensor.reshape
+    def no_symbolic_reshape(self, shape, *args):
+      if not all_int(argfix(shape, *args)): raise AssertionError("no symbolic view")
+      return reshape(self, shape, *args)
+    with patch.object(Tensor, "reshape", no_symbolic_reshape): jf(Tensor.rand(2, 3))
+    assert jf.symbolic_failed
+    for bs in [2, 3, 2, 3, 2]:
+      a = Tensor.rand(bs, 3)
+      np.testing.assert_allclose(jf(a).numpy(), a.numpy()+1, atol=1e-6, rtol=1e-6)
+    assert len(jf.concrete) == 2 and all(j.captured is not None for j in jf.concrete.values())
+
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
@@ -1,5 +1,6 @@
-import unittest, struct
-from tinygrad import Tensor, dtypes
+import unittest, struct, gc
+import numpy as np
+from tinygrad import Tensor, Device, GlobalCounters, dtypes
 
 # format types: https://docs.python.org/3/library/struct.html
 
@@ -24,6 +25,14 @@ class TestTensorData(unittest.TestCase):
     assert dat[0] == 1
     assert dat[1] == 2
 
+  def test_list_dtype(self):
+    self.assertEqual(Tensor([[True, False], [False, True]]).dtype, dtypes.bool)
+    self.assertEqual(Tensor([[1, 2], [3, 4]]).dtype, dtypes.default_int)
+    self.assertEqual(Tensor([True, 2]).dtype, dtypes.default_int)
+    self.assertEqual(Tensor([[1, 2.5], [3, 4]]).dtype, dtypes.default_float)
+    self.assertEqual(Tensor([]).dtype, dtypes.default_float)
+    self.assertEqual(Tensor([[1.7, -2.7]], dtype=dtypes.int32).tolist(), [[1, -2]])
+
   def test_data_uint8(self):
     a = Tensor([1,2,3,4], dtype=dtypes.uint8)
     dat = a.data()
@@ -64,5 +73,32 @@ class TestTensorData(unittest.TestCase):
     assert dat.shape == (2,2)
     # NOTE: python can't deref float16
 
+@unittest.skipUnless(Device.DEFAULT in {"CLANG", "LLVM"}, "zero copy is for host memory")
+class TestZeroCopyData(unittest.TestCase):
+  def test_own_buffer_copied(self):
+    a = Tensor.arange(16).realize()
+    GlobalCounters.reset()
+    n = a.numpy()
+    self.assertEqual(GlobalCounters.kernel_count, 0)
+    a.assign(a+1).realize()
+    np.testing.assert_equal(n, np.arange(16))
+
+  def test_export_keeps_buffer(self):
+    # the transpose is realized into a new buffer that numpy() returns without a copy
+    a = Tensor.arange(1024).reshape(32, 32).realize()
+    n = a.T.numpy()
+    self.assertFalse(n.flags.owndata)
+    gc.collect()
+    # a new buffer of the same size can't come from the LRU cache while n exists
+    b = [Tensor.full((32, 32), 7).contiguous().realize() for _ in range(3)]
+    np.testing.assert_equal(n, np.arange(1024).reshape(32, 32).T)
+    np.testing.assert_equal(b[0].numpy(), 7)
+
+  def test_view(self):
+    a = Tensor.arange(16).realize()
+    n = a[4:12].numpy()
+    a.assign(a*0).realize()
+    np.testing.assert_equal(n, np.arange(4, 12))
+
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
@@ -1,15 +1,15 @@
 from typing import Optional, Tuple, Any, List
-import unittest, math
+import unittest, math, pickle
 import numpy as np
 from tinygrad.shape.shapetracker import ShapeTracker
 from tinygrad.tensor import Tensor, _to_np_dtype
 from tinygrad.helpers import CI, DEBUG, getenv, Context
 from tinygrad.dtype import dtypes, DType, PtrDType
 from tinygrad.device import Buffer, Device
-from tinygrad.ops import UOps, UOp, UPat, UnaryOps, BinaryOps, TernaryOps, ReduceOps, KernelInfo, exec_alu, spec # noqa F401
+from tinygrad.ops import UOps, UOp, UPat, UnaryOps, BinaryOps, TernaryOps, ReduceOps, KernelInfo, exec_alu, spec, graph_rewrite # noqa F401
 from tinygrad.renderer import Program
 from tinygrad.engine.schedule import create_schedule, reduceop_fusor
-from tinygrad.engine.realize import CompiledRunner, lower_schedule_item, get_kernel
+from tinygrad.engine.realize import CompiledRunner, lower_schedule_item, get_kernel, run_schedule
 from tinygrad.codegen.uopgraph import linearize_uop, full_graph_rewrite, constant_folder
 from tinygrad.shape.symbolic import Variable
 from test.helpers import is_dtype_supported, assert_equiv_uops
@@ -322,6 +322,33 @@ class TestLocalAccess(unittest.TestCase):
     sres = uop(uops, UOps.LOAD, dtypes.int32, (smem, ofs))
     self.assertEqual(_test_uops_result(dtypes.int32, uops, sres), 42)
 
+class TestPythonNumpyProgram(unittest.TestCase):
+  # the numpy emulator has to match the scalar one bit for bit
+  def _check(self, out:Tensor):
+    from tinygrad.runtime.ops_python import PythonProgram, PythonNumpyProgram
+    sched = create_schedule([out.lazydata])
+    run_schedule(sched[:-1])
+    ei = lower_schedule_item(sched[-1])
+    for b in ei.bufs: b.ensure_allocated()
+    rets = []
+    for prg in [PythonProgram, PythonNumpyProgram]:
+      ei.bufs[0].copyin(memoryview(bytearray(ei.bufs[0].nbytes)))
+      prg(ei.prg.p.function_name, ei.prg.lib)(*[b._buf for b in ei.bufs], global_size=tuple(ei.prg.p.global_size),
+                                              local_size=tuple(ei.prg.p.local_size), vals=tuple(v.val for v in ei.prg.p.vars))
+      rets.append(bytes(ei.bufs[0].as_buffer()))
+    self.assertEqual(rets[0], rets[1])
+
+  def test_elementwise(self):
+    a, b = Tensor.randn(33, 17, device="PYTHON").realize(), Tensor.randint(33, 17, low=-9, high=9, device="PYTHON").realize()
+    self._check((a.exp2()*b + a.sqrt() - (b//3).cast(dtypes.float32)*(b*7//-4).cast(dtypes.float32)).maximum(a.log2()))
+  def test_padded_where(self):
+    a = Tensor.randn(15, 9, device="PYTHON").realize()
+    self._check((a > 0).where(a.sin(), a.reciprocal()*100).pad(((2, 3), (1, 0))).cast(dtypes.int8))
+  def test_reduce_locals(self):
+    # a big reduce gets GROUPTOP, a local buffer per workgroup
+    self._check(Tensor.randn(4, 2048, device="PYTHON").realize().sum(axis=1))
+  def test_matmul(self): self._check(Tensor.randn(16, 24, device="PYTHON").realize() @ Tensor.randn(24, 8, device="PYTHON").realize())
+
 @unittest.skipUnless(getenv("PTX"), "This only tests assembly backends")
 class TestAssembly(unittest.TestCase):
   def test_bitshift_left(self):
@@ -374,6 +401,23 @@ class TestUOpMethod(unittest.TestCase):
     self.assertEqual((gidx0*3+6).const_factor(), 3)
     self.assertEqual((gidx0*3+1).const_factor(), 1)
 
+  def test_hash_consed(self):
+    gidx0 = UOp(UOps.SPECIAL, dtypes.int, (), ('gidx0', 8))
+    self.assertIs(gidx0*3+6, UOp(UOps.SPECIAL, dtypes.int, (), ('gidx0', 8))*3+6)
+    self.assertIs(pickle.loads(pickle.dumps(gidx0*3)), gidx0*3)
+    # equal args that aren't the same aren't merged
+    self.assertIsNot(UOp(UOps.CONST, dtypes.float, (), 0.0), UOp(UOps.CONST, dtypes.float, (), -0.0))
+    self.assertIsNot(UOp(UOps.CONST, dtypes.int, (), 1), UOp(UOps.CONST, dtypes.int, (), True))
+    self.assertIsNot(UOp(UOps.DEFINE_GLOBAL, PtrDType(dtypes.float), (), 0), UOp(UOps.DEFINE_GLOBAL, PtrDType(dtypes.float, True), (), 0))
+
+  def test_rewrite_cache(self):
+    a = UOp(UOps.DEFINE_VAR, dtypes.int, (), ("a", 0, 10))
+    expr = (a*2+0)*1
+    self.assertIs(graph_rewrite(expr, constant_folder), a*2)
+    self.assertIs(constant_folder.rewrite_cache[expr], a*2)
+    with Context(REWRITE_CACHE=0):
+      self.assertIs(graph_rewrite(expr, constant_folder), a*2)
+
 class TestUOpStr(unittest.TestCase):
   def test_uop_str(self):
     a = UOp(UOps.CONST, dtypes.float, (), 2.0) + UOp(UOps.CONST, dtypes.float, (), 3.0)
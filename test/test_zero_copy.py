@@ -1,5 +1,6 @@
-import unittest
-from tinygrad import Tensor, Device
+import unittest, gc, pickle
+import numpy as np
+from tinygrad import Tensor, Device, TinyJit, dtypes
 import time
 
 def time_tensor_numpy(out:Tensor):
@@ -23,5 +24,55 @@ class TestZeroCopy(unittest.TestCase):
     print(f"time(base): {t1*1e3:.2f} ms, time(copy): {t2*1e3:.2f} ms :  copy speed {gbps:.2f} GB/s")
     self.assertGreater(gbps, 600)  # more than 600 GB/s = no copy
 
+@unittest.skipUnless(Device.DEFAULT in {"CLANG", "LLVM"}, "numpy arrays are used in place on host devices")
+class TestZeroCopyFromNumpy(unittest.TestCase):
+  def test_uses_array(self):
+    a = np.arange(4096, dtype=np.float32)
+    t = Tensor.from_numpy(a)
+    self.assertEqual(t.lazydata.base.realized.options.external_ptr, a.ctypes.data)
+    np.testing.assert_equal((t+1).numpy(), a+1)
+
+  def test_keeps_array_alive(self):
+    t = Tensor.from_numpy(np.arange(4096, dtype=np.int32).reshape(64, 64))
+    gc.collect()
+    np.testing.assert_equal((t*2).numpy(), np.arange(4096).reshape(64, 64)*2)
+
+  def test_readonly_is_copied(self):
+    a = np.frombuffer(np.arange(64, dtype=np.int32).tobytes(), np.int32)
+    t = Tensor.from_numpy(a)
+    self.assertEqual(t.lazydata.base.realized, None)
+    np.testing.assert_equal((t+1).numpy(), np.arange(1, 65))
+
+  def test_assign_writes_array(self):
+    a = np.zeros(64, dtype=np.float32)
+    t = Tensor.from_numpy(a)
+    t.assign(t+1).realize()
+    np.testing.assert_equal(a, 1)
+
+  def test_constructor_copies(self):
+    a = np.zeros(64, dtype=np.float32)
+    t = Tensor(a).realize()
+    a[:] = 2
+    t.assign(t+1).realize()
+    np.testing.assert_equal(t.numpy(), 1)
+    np.testing.assert_equal(a, 2)
+
+  def test_jit_state_from_list(self):
+    c = Tensor([0], dtype=dtypes.int32)
+    @TinyJit
+    def f(): return c.assign(c+1).realize()
+    for _ in range(4): f()
+    self.assertEqual(c.item(), 4)
+
+  def test_unaligned_is_copied(self):
+    a = np.arange(65, dtype=np.float32)[1:]
+    t = Tensor.from_numpy(a)
+    self.assertEqual(t.lazydata.base.realized, None)
+    np.testing.assert_equal(t.numpy(), a)
+
+  def test_pickle(self):
+    t = pickle.loads(pickle.dumps(Tensor.from_numpy(np.arange(64, dtype=np.float32))))
+    np.testing.assert_equal(t.numpy(), np.arange(64))
+
 if __name__ == '__main__':
   unittest.main(verbosity=2)
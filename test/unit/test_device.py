@@ -3,8 +3,8 @@ import unittest
 from unittest.mock import patch
 import os
 from tinygrad import Tensor
-from tinygrad.device import Device, Compiler
-from tinygrad.helpers import diskcache_get, diskcache_put, getenv
+from tinygrad.device import Device, Compiler, _MallocAllocator
+from tinygrad.helpers import diskcache_get, diskcache_put, getenv, GlobalCounters
 
 class TestDevice(unittest.TestCase):
   def test_canonicalize(self):
@@ -19,6 +19,34 @@ class TestDevice(unittest.TestCase):
     assert Device.canonicalize("GPU:2") == "GPU:2"
     assert Device.canonicalize("disk:/dev/shm/test") == "DISK:/dev/shm/test"
 
+class TestLRUAllocator(unittest.TestCase):
+  def setUp(self):
+    self.allocator = _MallocAllocator()
+    GlobalCounters.reset()
+
+  def test_size_class(self):
+    self.allocator.bucket = 2
+    self.assertListEqual([self.allocator.size_class(x) for x in [1, 3, 4, 5, 1000, 1024, 1025]], [1, 4, 4, 8, 1024, 1024, 2048])
+    self.allocator.bucket = 1.25
+    for sz in range(1, 5000): self.assertGreaterEqual(self.allocator.size_class(sz), sz)
+    self.assertLess(len(set(self.allocator.size_class(sz) for sz in range(1000, 5000))), 10)
+
+  def test_bucket_reuse(self):
+    self.allocator.bucket = 2
+    self.allocator.free(self.allocator.alloc(1000), 1000)
+    buf = self.allocator.alloc(900)
+    self.assertEqual((GlobalCounters.lru_hits, GlobalCounters.lru_misses), (1, 1))
+    self.assertEqual(len(self.allocator.as_buffer(buf)), 1024)
+
+  def test_cache_max(self):
+    self.allocator.cache_max = 2500
+    bufs = [(self.allocator.alloc(sz), sz) for sz in [1000, 1000, 2000]]
+    for buf,sz in bufs: self.allocator.free(buf, sz)
+    # both 1000 byte buffers were freed before the 2000 byte one, so they are evicted first
+    self.assertEqual(self.allocator.cached_bytes, 2000)
+    self.assertEqual(GlobalCounters.lru_evicted_bytes, 2000)
+    self.assertEqual(len(self.allocator.cache[(1000, None)]), 0)
+
 class MockCompiler(Compiler):
   def __init__(self, key): super().__init__(key)
   def compile(self, src) -> bytes: return src.encode()
@@ -1,6 +1,8 @@
 import unittest
-import pickle
-from tinygrad.helpers import diskcache_get, diskcache_put, diskcache, diskcache_clear
+import pickle, time
+from unittest.mock import patch
+from tinygrad import helpers
+from tinygrad.helpers import diskcache_get, diskcache_put, diskcache, diskcache_clear, diskcache_flush, diskcache_prune, db_connection, temp, VERSION
 
 def remote_get(table,q,k): q.put(diskcache_get(table, k))
 def remote_put(table,k,v): diskcache_put(table, k, v)
@@ -81,6 +83,64 @@ class DiskCache(unittest.TestCase):
     diskcache_put(table, "key", "test")
     self.assertEqual(diskcache_get(table, "key"), "test")
 
+  def test_batched_put(self):
+    table = "test_batched_put"
+    diskcache_flush()
+    with patch.object(helpers, "CACHE_BATCH", 3):
+      diskcache_put(table, "k1", "v1")
+      diskcache_put(table, "k2", "v2")
+      # not committed yet, but visible to this process
+      self.assertEqual(diskcache_get(table, "k2"), "v2")
+      self.assertEqual(len(helpers._db_pending), 2)
+      diskcache_put(table, "k3", "v3")
+      self.assertEqual(len(helpers._db_pending), 0)
+    self.assertEqual(db_connection().execute(f"SELECT COUNT(*) FROM '{table}_{VERSION}'").fetchone()[0], 3)
+
+  def test_prune(self):
+    # prune on a scratch database, not the real cache
+    with patch.object(helpers, "CACHEDB", temp("test_prune.db")), patch.object(helpers, "_db_connection", None), \
+         patch.object(helpers, "_db_tables", set()):
+      diskcache_clear()
+      for i in range(4): diskcache_put("test_prune", i, b"x"*1000)
+      diskcache_flush()
+      db_connection().execute(f"UPDATE 'test_prune_{VERSION}' SET atime=0")
+      db_connection().commit()
+      # k0 and k1 are used again, so k2 and k3 are the least recently used
+      with patch.object(helpers, "CACHE_MAX_BYTES", 2500):
+        with patch.object(time, "time", return_value=10): self.assertIsNotNone(diskcache_get("test_prune", 0))
+        with patch.object(time, "time", return_value=20): self.assertIsNotNone(diskcache_get("test_prune", 1))
+      # a table of another VERSION isn't touched
+      db_connection().execute("CREATE TABLE 'test_prune_0.0.0' (key text, val blob)")
+      db_connection().execute("INSERT INTO 'test_prune_0.0.0' VALUES ('k', ?)", (b"x"*1000,))
+      db_connection().commit()
+      self.assertGreaterEqual(diskcache_prune(2500), 2000)
+      self.assertEqual([diskcache_get("test_prune", i) is not None for i in range(4)], [True, True, False, False])
+      self.assertEqual(db_connection().execute("SELECT COUNT(*) FROM 'test_prune_0.0.0'").fetchone()[0], 1)
+      diskcache_flush()
+      helpers._db_connection.close()
+
+  def test_table_without_atime(self):
+    # a table written before access times were tracked gets the column, VERSION stays the same
+    with patch.object(helpers, "CACHEDB", temp("test_no_atime.db")), patch.object(helpers, "_db_connection", None), \
+         patch.object(helpers, "_db_tables", set()):
+      diskcache_clear()
+      db_connection().execute(f"CREATE TABLE 'test_no_atime_{VERSION}' (key text, val blob, PRIMARY KEY (key))")
+      for i in range(3): db_connection().execute(f"INSERT INTO 'test_no_atime_{VERSION}' VALUES (?, ?)", (str(i), pickle.dumps(b"x"*1000)))
+      db_connection().commit()
+      with patch.object(helpers, "CACHE_MAX_BYTES", 1500), patch.object(time, "time", return_value=10):
+        self.assertIsNotNone(diskcache_get("test_no_atime", "1"))
+      diskcache_put("test_no_atime", "3", b"x"*1000)
+      self.assertGreaterEqual(diskcache_prune(2500), 2000)
+      self.assertEqual([diskcache_get("test_no_atime", str(i)) is not None for i in range(4)], [False, True, False, True])
+      helpers._db_connection.close()
+
+  def test_get_no_atime(self):
+    # without CACHE_MAX_BYTES a get doesn't leave anything to write at exit
+    diskcache_put("test_get_no_atime", "k", "v")
+    diskcache_flush()
+    with patch.object(helpers, "CACHE_MAX_BYTES", 0): self.assertEqual(diskcache_get("test_get_no_atime", "k"), "v")
+    self.assertEqual(len(helpers._db_touched), 0)
+
   @unittest.skip("disabled by default because this drops cache table")
   def test_clear_cache(self):
     # clear cache to start
@@ -5,7 +5,7 @@ import tarfile
 import numpy as np
 from tinygrad import Tensor, Device, dtypes
 from tinygrad.dtype import DType
-from tinygrad.nn.state import safe_load, safe_save, get_state_dict, torch_load, tar_extract
+from tinygrad.nn.state import safe_load, safe_load_bulk, safe_save, get_state_dict, torch_load, tar_extract
 from tinygrad.helpers import Timing, fetch, temp, CI
 from test.helpers import is_dtype_supported
 
@@ -120,6 +120,20 @@ class TestSafetensors(unittest.TestCase):
       for k in f.keys():
         np.testing.assert_array_equal(f.get_tensor(k).numpy(), state_dict[k].numpy())
 
+  def test_safe_load_bulk_index(self):
+    import json
+    shards = [{"a": Tensor.rand(3, 5), "b": Tensor.arange(1_500_000, dtype=dtypes.int32), "c": Tensor([1, 2, 3], dtype=dtypes.uint8)},
+              {"d": Tensor.rand(700, 1001), "e": Tensor.ones(7)}]
+    for i,sd in enumerate(shards): safe_save(sd, temp(f"bulk-{i}.safetensors"))
+    with open(temp("bulk.safetensors.index.json"), "w") as f:
+      json.dump({"weight_map": {k:f"bulk-{i}.safetensors" for i,sd in enumerate(shards) for k in sd}}, f)
+    ret = safe_load_bulk(temp("bulk.safetensors.index.json"), verbose=False)
+    self.assertEqual(sorted(ret), ["a", "b", "c", "d", "e"])
+    for sd in shards:
+      for k,v in sd.items():
+        self.assertEqual(ret[k].device, Device.DEFAULT)
+        np.testing.assert_equal(ret[k].numpy(), v.numpy())
+
   def test_efficientnet_safetensors(self):
     from extra.models.efficientnet import EfficientNet
     model = EfficientNet(0)
@@ -1,7 +1,8 @@
 import unittest, itertools
 from tinygrad.dtype import dtypes
 from tinygrad.ops import UOps, UOp, BinaryOps, TernaryOps, ReduceOps, UnaryOps # noqa: F401
-from tinygrad.ops import PatternMatcher, UPat
+from tinygrad.ops import PatternMatcher, UPat, compile_upat
+from tinygrad.helpers import Context
 
 class TestPatternMatcher(unittest.TestCase):
   def test_simple_match(self):
@@ -81,11 +82,14 @@ class TestPatternMatcher(unittest.TestCase):
   def test_dup_name(self):
     matcher = PatternMatcher([(UPat(UOps.ALU, name="x", src=(UPat(UOps.CONST, name="y"), UPat(UOps.CONST, name="y"))), lambda x, y: x)])
     y1 = UOp(UOps.CONST, dtypes.float, arg=1.0)
-    y2 = UOp(UOps.CONST, dtypes.float, arg=1.0)
+    y2 = UOp(UOps.CONST, dtypes.float, arg=2.0)
     c1 = UOp(UOps.ALU, dtypes.float, (y1, y1), BinaryOps.ADD)
     c2 = UOp(UOps.ALU, dtypes.float, (y1, y2), BinaryOps.ADD)
+    # UOps are hash consed, so the same const is the same UOp
+    c3 = UOp(UOps.ALU, dtypes.float, (y1, UOp(UOps.CONST, dtypes.float, arg=1.0)), BinaryOps.ADD)
     self.assertEqual(matcher.rewrite(c1), c1)
     self.assertEqual(matcher.rewrite(c2), None)
+    self.assertIs(c3, c1)
 
   def test_dtype(self):
     matcher = PatternMatcher([(UPat(UOps.CONST, name="x", dtype=dtypes.float32), lambda x: x)])
@@ -164,6 +168,30 @@ class TestPatternMatcher(unittest.TestCase):
     self.assertIsNotNone(matcher.rewrite(u1))
     self.assertIsNotNone(matcher.rewrite(u2))
 
+  def test_any(self):
+    c1 = UOp(UOps.CONST, dtypes.float, arg=1.0)
+    c2 = UOp(UOps.CONST, dtypes.int, arg=2)
+    matcher = PatternMatcher([(UPat(UOps.ALU, name="x", src=(UPat.any(UPat(UOps.CONST, dtypes.float, name="a"), UPat(UOps.CONST, name="b")),
+                                                             UPat(UOps.CONST, name="b"))), lambda x,**kw: UOp.const(dtypes.int, len(kw)))])
+    # the first alternative matches, so the second isn't tried even if b is different later
+    self.assertEqual(matcher.rewrite(UOp(UOps.ALU, dtypes.float, (c1, c2), BinaryOps.ADD)).arg, 2)
+    self.assertEqual(matcher.rewrite(UOp(UOps.ALU, dtypes.float, (c2, c2), BinaryOps.ADD)).arg, 1)
+    self.assertIsNone(matcher.rewrite(UOp(UOps.ALU, dtypes.float, (c2, c1), BinaryOps.ADD)))
+
+  def test_custom_early_reject(self):
+    c1 = UOp(UOps.CONST, dtypes.float, arg=1.0)
+    matcher = PatternMatcher([(UPat(UOps.ALU, name="x", custom_early_reject=set([(UOps.DEFINE_VAR, None)])), lambda x: x)])
+    self.assertIsNone(matcher.rewrite(UOp(UOps.ALU, dtypes.float, (c1, c1), BinaryOps.ADD)))
+    u = UOp(UOps.ALU, dtypes.float, (c1, UOp(UOps.DEFINE_VAR, dtypes.float)), BinaryOps.ADD)
+    self.assertIs(matcher.rewrite(u), u)
+
+  def test_first_match(self):
+    c1 = UOp(UOps.CONST, dtypes.float, arg=1.0)
+    c2 = UOp(UOps.CONST, dtypes.float, arg=2.0)
+    matcher = PatternMatcher([(UPat(UOps.ALU, src=[UPat(UOps.ALU, src=[UPat(name='a'), UPat(name='b')]), UPat(name='c')]), lambda a,b,c: a)])
+    self.assertIs(matcher.rewrite((c1 + c2) + (c2 + c1)), c1)
+    self.assertIs(matcher.rewrite(c2 + (c1 + c2)), c1)
+
   def _assert_eq_upat(self, a:UPat, b:UPat):
     assert (sorted(map(str,a.op)) if a.op else [] == (sorted(map(str,b.op)) if b.op else []))
     assert (sorted(a.dtype) if a.dtype else [] == (sorted(b.dtype) if b.dtype else []))
@@ -174,5 +202,19 @@ class TestPatternMatcher(unittest.TestCase):
       return u.src[0]
     for a,b in zip(simple_src(a), simple_src(b)): self._assert_eq_upat(a, b)
 
+class TestCompiledPatternMatcher(TestPatternMatcher):
+  def setUp(self):
+    self.ctx = Context(UPAT_COMPILE=1)
+    self.ctx.__enter__()
+  def tearDown(self): self.ctx.__exit__()
+
+  def test_compiled(self):
+    pat = UPat(UOps.ALU, src=[UPat(UOps.ALU, src=[UPat(name='a'), UPat.cvar('b')]), UPat(name='c')], name="x")
+    self.assertTrue(PatternMatcher([(pat, lambda **kw: None)]).compiled)
+    self.assertEqual(compile_upat(pat).__name__, "match")
+    c1 = UOp(UOps.CONST, dtypes.float, arg=1.0)
+    for u in [(c1 + c1) + c1, c1 + (c1 * c1), c1 * c1]:
+      self.assertEqual(compile_upat(pat)(u), (m[0] if (m:=pat.match(u, {})) else None))
+
 if __name__ == '__main__':
   unittest.main(verbosity=2)
@@ -70,6 +70,9 @@ def get_index(ast:UOp, opts:Renderer) -> IndexContext:
     # all loops are RANGES
     idxs = [UOp(UOps.RANGE, dtypes.pyint, (UOp.const(dtypes.pyint, 0), variable_to_uop(g)), (i, False))
                   for i,g in enumerate(full_shape[:first_reduce])]
+    # the threaded dim is a SPECIAL that the CPU runtime fills in per thread
+    if opts.has_threads and ki.threaded and global_dims > 0 and isinstance(full_shape[0], int) and full_shape[0] > 1:
+      idxs[0] = UOp(UOps.SPECIAL, dtypes.pyint, (), ("gidx0", full_shape[0]))
 
   # reduce loops
   idxs += [UOp(UOps.RANGE, dtypes.pyint, (UOp.const(dtypes.pyint, 0), variable_to_uop(g)), (i, True))
@@ -2,7 +2,7 @@ from __future__ import annotations
 from typing import Optional, Tuple, Dict, List, Set, cast, TYPE_CHECKING, Any, DefaultDict, Callable
 import functools, itertools, heapq, math, operator
 from collections import defaultdict
-from tinygrad.dtype import dtypes, PtrDType, ImageDType, ConstType
+from tinygrad.dtype import dtypes, DType, PtrDType, ImageDType, ConstType
 from tinygrad.ops import UnaryOps, BinaryOps, exec_alu, UOp, UOps, END_FOR_UOP, type_verify, print_uops, identity_element
 from tinygrad.ops import UPat, PatternMatcher, graph_rewrite
 from tinygrad.helpers import DEBUG, getenv, flatten, dedup, TRANSCENDENTAL, AMX, prod, CI, partition, all_same
@@ -73,7 +73,7 @@ def fix_unfoldable_image_load(load:UOp, buf:UOp):
 float4_folding = PatternMatcher([
   (UPat(UOps.VECTORIZE, src=UPat(UOps.LOAD, src=(UPat.var("buf"), UPat()), allow_any_len=True), name="ex"), fold_expanded),
   (UPat((UOps.BARRIER, UOps.SINK), src=UPat(UOps.STORE, src=(UPat.var("buf"), UPat(), UPat()), allow_any_len=True), name="ex"), fold_expanded),
-])
+], cache=True)
 
 # ***** mod *****
 
@@ -271,7 +271,7 @@ def simplify_valid_image_load(load:UOp, buf:UOp):
 @functools.lru_cache(None)
 def transcendental_folding(ops):
   return PatternMatcher([(UPat(UOps.ALU, dtype=TRANSCENDENTAL_SUPPORTED_DTYPES, src=(UPat.var("d"),), arg=k), cast(Callable, v))
-                         for k,v in ((UnaryOps.EXP2, xexp2), (UnaryOps.LOG2, xlog2), (UnaryOps.SIN, xsin)) if k not in ops])
+                         for k,v in ((UnaryOps.EXP2, xexp2), (UnaryOps.LOG2, xlog2), (UnaryOps.SIN, xsin)) if k not in ops], cache=True)
 
 # ***** threefry *****
 
@@ -316,10 +316,18 @@ def loop_collapse(compval, idx, multconst, rng:UOp, reduce, idx2=None, idx3=None
   if extra is not None: ret = ret + UOp(UOps.REDUCE, reduce.dtype, (extra,) + reduce.src[1:], reduce.arg)
   return ret
 
-def index_collapse(idx,rng,buf,ld,reduce,add=UOp.const(dtypes.int, 0),mul=UOp.const(dtypes.int, 1)):
-  if rng not in reduce.src: return None
-  return UOp(reduce.op, reduce.dtype, (UOp(ld.op, ld.dtype, (buf, add+mul*idx, ld.const_like(0), idx.ge(rng.src[0]) & idx.lt(rng.src[1]))),)+
-             tuple(x for x in reduce.src[1:] if x is not rng), reduce.arg)
+def index_collapse(idx,rng,buf,ld_idx,ld,reduce):
+  if rng not in reduce.src or rng in idx.sparents: return None
+  # the only term of the sum is where the range equals idx, load it directly
+  def _load(idx:UOp, ld_idx:UOp, dtype:DType):
+    valid = idx.ge(rng.src[0]) & idx.lt(rng.src[1])
+    return UOp(ld.op, dtype, (buf, replace_uop(ld_idx, rng, idx), UOp.const(dtype, 0), valid.broadcast(dtype.count) if dtype.count > 1 else valid))
+  if idx.dtype.count == 1 and ld.dtype.count == reduce.dtype.count: ret = _load(idx, ld_idx, ld.dtype)
+  # after expand, every lane can index with its own idx
+  else: ret = UOp(UOps.VECTORIZE, reduce.dtype, tuple(_load(idx.gep(i) if idx.dtype.count > 1 else idx,
+                                                         ld_idx.gep(i) if ld.dtype.count > 1 else ld_idx, ld.dtype.scalar())
+                                                   for i in range(reduce.dtype.count)))
+  return UOp(reduce.op, reduce.dtype, (ret,)+tuple(x for x in reduce.src[1:] if x is not rng), reduce.arg)
 
 # TODO: there's a lot shared with no_vectorized_wmma here
 def gep_through_wmma(gep:UOp, wmma:UOp):
@@ -401,13 +409,17 @@ constant_folder = PatternMatcher([
     arg=BinaryOps.ADD, name="reduce", allow_any_len=True), loop_collapse),
   # unrolled arange div folding
   (UPat(UOps.ALU, name="divs", src=[UPat(), UPat(UOps.ALU, arg=BinaryOps.IDIV)], arg=BinaryOps.ADD), fold_unrolled_divs),
-  # indexing, with cast or where
-  (UPat(UOps.REDUCE, src=(UPat.var("idx").eq(UPat(UOps.RANGE, name="rng")).cast()*
-    UPat(UOps.LOAD, src=(UPat.var("buf"), UPat.any(UPat.var("add")+UPat.var("mul")*UPat(UOps.RANGE, name="rng"), UPat(UOps.RANGE, name="rng"))),
-         name="ld"),), arg=BinaryOps.ADD, name="reduce", allow_any_len=True), index_collapse),
-  (UPat(UOps.REDUCE, src=(UPat.var("idx").eq(UPat(UOps.RANGE, name="rng")).where(
-    UPat(UOps.LOAD, src=(UPat.var("buf"), UPat.any(UPat.var("add")+UPat.var("mul")*UPat(UOps.RANGE, name="rng"), UPat(UOps.RANGE, name="rng"))),
-         name="ld"), UPat.const(None, 0.0)),), arg=BinaryOps.ADD, name="reduce", allow_any_len=True), index_collapse),
+  # indexing, with cast or where. the range is compared as pyint before no_pyint, it's folded here before an upcast vectorizes the LOAD
+  (UPat(UOps.CAST, dtypes.int, src=(UPat.var("x", dtypes.pyint) + UPat.cvar("c", vec=False),)), lambda x,c: x.cast(dtypes.int) + c.arg),
+  (UPat(UOps.REDUCE, src=(UPat.var("idx").eq(UPat.any(rng:=UPat(UOps.RANGE, name="rng"), rng.cast())).cast()*
+    UPat(UOps.LOAD, src=(UPat.var("buf"), UPat.var("ld_idx")), name="ld"),), arg=BinaryOps.ADD, name="reduce", allow_any_len=True), index_collapse),
+  (UPat(UOps.REDUCE, src=(UPat.var("idx").eq(UPat.any(rng, rng.cast())).where(
+    UPat(UOps.LOAD, src=(UPat.var("buf"), UPat.var("ld_idx")), name="ld"), UPat.const(None, 0.0)),), arg=BinaryOps.ADD, name="reduce",
+    allow_any_len=True), index_collapse),
+  # an unrolled arange only folds after expand, then the compare and the LOAD can be vectorized or broadcast
+  (UPat(UOps.REDUCE, src=(UPat.any(m:=UPat.var("idx").eq(UPat.any(rng, UPat(UOps.VECTORIZE, src=rng))).cast(), UPat(UOps.VECTORIZE, src=m))*
+    UPat.any(ld:=UPat(UOps.LOAD, src=(UPat.var("buf"), UPat.var("ld_idx")), name="ld"), UPat(UOps.VECTORIZE, src=ld)),),
+    arg=BinaryOps.ADD, name="reduce", allow_any_len=True), index_collapse),
   # max folding
   (UPat.max(UPat.var("x"), UPat.var("y")), lambda x,y: x if x.vmin >= y.vmax else y if x.vmax <= y.vmin else None),
   # GEP/CAST const rules
@@ -515,7 +527,7 @@ constant_folder = PatternMatcher([
   # ** move mul consts to end (NOTE: this is still happening before constant folding) **
   (UPat(UOps.ALU, arg=BinaryOps.MUL, src=(UPat.cvar("c1"), UPat.var("x"))), lambda c1,x: x*c1 if x.op not in (UOps.CONST, UOps.VCONST) else None),
   (UPat(UOps.ALU, arg=BinaryOps.MUL, src=(UPat.var("x"), UPat.cvar("c1"))) * UPat.var("y"), lambda x,c1,y: (x*y)*c1),
-])
+], cache=True)
 
 # *** uop expander ***
 
@@ -644,7 +656,7 @@ expander = PatternMatcher([
   # EXPAND GEP (needed for WMMA, generalize this) -> vectorized ALU
   (UPat(UOps.EXPAND, name="ex", src=tuple(UPat.var('x').gep(i)+UPat.var('y').gep(i) for i in range(256 if AMX else 8))),
     lambda ex,x,y: UOp(UOps.EXPAND, ex.dtype, tuple((x+y).gep(i) for i in range(256 if AMX else 8)), ex.arg)),
-])
+], cache=True)
 
 def no_vectorized_load_store(ls:UOp):
   idx = ls.src[1]
@@ -680,7 +692,7 @@ devectorize = PatternMatcher([
   (UPat(UOps.WMMA, name="wmma"), no_vectorized_wmma),
   (UPat(UOps.DEFINE_ACC, name="acc"), no_vectorized_acc),
   (UPat((UOps.LOAD, UOps.STORE), name="ls"), no_vectorized_load_store),
-])
+], cache=True)
 
 reducer = PatternMatcher([
   (UPat(UOps.CONST, name='c'),
@@ -693,10 +705,10 @@ reducer = PatternMatcher([
   (UPat(UOps.LOAD, src=(UPat.var("buf"), UPat()), allow_any_len=True, name="load"), fix_unfoldable_image_load),
   # image load valid simplification
   (UPat(UOps.LOAD, src=(UPat.var("buf"), UPat()), allow_any_len=True, name="load"), simplify_valid_image_load),
-])
+], cache=True)
 
 no_pyint = PatternMatcher([(UPat((UOps.CONST, UOps.VCONST, UOps.ALU, UOps.SPECIAL, UOps.RANGE, UOps.EXPAND, UOps.VECTORIZE), name="x"),
-  lambda x: UOp(x.op, dtypes.int32.vec(x.dtype.count), x.src, x.arg) if x.dtype.scalar() == dtypes.pyint else None)])
+  lambda x: UOp(x.op, dtypes.int32.vec(x.dtype.count), x.src, x.arg) if x.dtype.scalar() == dtypes.pyint else None)], cache=True)
 
 # *** uop graph ***
 
@@ -753,6 +765,11 @@ def linearize_uop(sink:UOp, skip_check:bool=not __debug__) -> List[UOp]:
   # scope children impact the toposort and END* insertion
   scope_children = {p:get_recursive_children(p, END_FOR_UOP[p.op][0]) for p in reversed(in_degree) if p.op in END_FOR_UOP}
   range_phi = {r:[p for p in scope_children[r] if p.op is UOps.ASSIGN] for r in scope_children if r.op is UOps.RANGE}
+  # for each uop, the scopes it's in (in scope_children order) and the number of children left in each scope
+  in_scopes: Dict[UOp, List[UOp]] = {}
+  for l,ss in scope_children.items():
+    for u in ss: in_scopes.setdefault(u, []).append(l)
+  scope_left = {l:len(ss) for l,ss in scope_children.items()}
 
   # assign priorities
   def get_priority(u:UOp):
@@ -764,7 +781,7 @@ def linearize_uop(sink:UOp, skip_check:bool=not __debug__) -> List[UOp]:
         priority += 10000*len([r for r in range_srcs[p] if not any(i in range_phi[u] for i in range_phi[r])])
     # prefer uops that are loop children
     else:
-      priority -= sum([(l.arg[0]+1) + 1000*l.arg[1] for l,ss in scope_children.items() if l.op is UOps.RANGE and u in ss])
+      priority -= sum([(l.arg[0]+1) + 1000*l.arg[1] for l in in_scopes.get(u, []) if l.op is UOps.RANGE])
     return priority
   priorities:Dict[UOp, int] = {u:get_priority(u) for u in children}
 
@@ -783,26 +800,30 @@ def linearize_uop(sink:UOp, skip_check:bool=not __debug__) -> List[UOp]:
   for u in children:
     if in_degree[u] == 0: push(u)
 
+  # DEFINE_ACCs are placed before their first RANGE and END*s after the last uop of their scope
   scope_end: Dict[UOp, UOp] = {}
+  order: Dict[UOp, int] = {}
+  before: Dict[UOp, List[UOp]] = {}
   _uops: List[UOp] = []
   while queue:
     p,x = heapq.heappop(queue)
     if DEBUG >= 7: print(f"{p:5d}", x.op, x.dtype, x.arg)
     if x in scope_children: scope_end[x] = x
-    if x.op is UOps.DEFINE_ACC:
-      idx = min([_uops.index(l) for l in x.src if l.op is UOps.RANGE])
-      _uops.insert(idx, x)
-    else: _uops.append(x)
-    for u, ss in scope_children.items():
-      if x in ss:
-        ss.remove(x)
-        if len(ss) == 0: scope_end[u] = x
+    if x.op is UOps.DEFINE_ACC: before.setdefault(min([l for l in x.src if l.op is UOps.RANGE], key=lambda l: order[l]), []).append(x)
+    else:
+      order[x] = len(_uops)
+      _uops.append(x)
+    for u in in_scopes.get(x, []):
+      scope_left[u] -= 1
+      if scope_left[u] == 0: scope_end[u] = x
     for u in children[x]:
       in_degree[u] -= 1
       if in_degree[u] == 0: push(u)
 
-  # end scopes in toposort order
-  for u, x in scope_end.items(): _uops.insert(_uops.index(x)+1, UOp(END_FOR_UOP[u.op][1], dtypes.void, (u,)))
+  # end scopes in toposort order, later ENDs for the same uop go first
+  after: Dict[UOp, List[UOp]] = {}
+  for u, x in scope_end.items(): after.setdefault(x, []).insert(0, UOp(END_FOR_UOP[u.op][1], dtypes.void, (u,)))
+  _uops = [y for x in _uops for z in before.get(x, [])+[x] for y in [z]+after.get(z, [])]
 
   # sanity checks (NOTE: these can cause things to be skipped in BEAM)
   if not skip_check:
@@ -1,10 +1,11 @@
 from __future__ import annotations
 import multiprocessing, decimal, statistics, random
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from collections import defaultdict
 from typing import List, Optional, Dict, Tuple, Any, cast, Protocol, Type
-import importlib, inspect, functools, pathlib, os, ctypes, atexit, time, contextlib, array
+import importlib, inspect, functools, pathlib, os, ctypes, atexit, time, contextlib, array, math, mmap
 from tinygrad.helpers import SAVE_SCHEDULE, getenv, diskcache_get, diskcache_put, DEBUG, GlobalCounters, flat_mv, from_mv, ProfileLogger, PROFILE
+from tinygrad.helpers import pin_mv
 from tinygrad.dtype import DType, ImageDType
 from tinygrad.renderer import Renderer
 
@@ -48,6 +49,7 @@ class BufferOptions:
   cpu_access: bool = False
   host: bool = False
   nolru: bool = False
+  external_ptr: Optional[int] = None  # memory that isn't ours (like a numpy array), it's never cached or freed
 
 class Buffer:
   def __init__(self, device:str, size:int, dtype:DType, opaque:Any=None, options:Optional[BufferOptions]=None,
@@ -94,7 +96,8 @@ class Buffer:
     if self.is_allocated() and not SAVE_SCHEDULE:
       buf = bytearray(self.nbytes)
       self.copyout(memoryview(buf))
-    return self.__class__, (self.device, self.size, self.dtype, None, self.options, buf, self.lb_refcount)
+    options = replace(self.options, external_ptr=None) if self.options is not None and self.options.external_ptr is not None else self.options
+    return self.__class__, (self.device, self.size, self.dtype, None, options, buf, self.lb_refcount)
   @property
   def nbytes(self): return self.size*self.dtype.itemsize
   def __del__(self):
@@ -107,9 +110,9 @@ class Buffer:
            (f" offset:{self.offset}" if hasattr(self, "base") else "") + \
            (">" if self.options is None else f" {self.options=}>")
   def as_buffer(self, allow_zero_copy=False, force_zero_copy=False) -> memoryview:
-    # zero copy with as_buffer (disabled by default due to use after free)
+    # zero copy with as_buffer, the memoryview holds a reference to this Buffer so it's not freed (or reused from the LRU cache) while exported
     if (force_zero_copy or allow_zero_copy) and hasattr(self.allocator, 'as_buffer') and (self.options is None or self.options.image is None):
-      return self.allocator.as_buffer(self._buf)
+      return pin_mv(self.allocator.as_buffer(self._buf)[:self.nbytes], self)
     assert not force_zero_copy, "force zero copy was passed, but copy is required"
     return self.copyout(memoryview(bytearray(self.nbytes)))
   def copyin(self, mv:memoryview):
@@ -145,20 +148,42 @@ class LRUAllocator(Allocator):  # pylint: disable=abstract-method
   """
   The LRU Allocator is responsible for caching buffers.
   It ensures that buffers are not freed until it is absolutely necessary, optimizing performance.
+  LRU_BUCKET rounds sizes up to geometric size classes (2 for powers of two, 1.25 for 1.25x steps) so buffers of similar sizes get reused,
+  and LRU_CACHE_MAX caps the bytes held in the cache, evicting the least recently used buffers.
   """
-  def __init__(self): self.cache: Dict[Tuple[int, Optional[BufferOptions]], Any] = defaultdict(list)
+  def __init__(self):
+    self.cache: Dict[Tuple[int, Optional[BufferOptions]], Any] = defaultdict(list)
+    self.bucket, self.cache_max, self.cached_bytes = getenv("LRU_BUCKET", 0.0), getenv("LRU_CACHE_MAX", 0), 0
+  def size_class(self, size:int, options:Optional[BufferOptions]=None, bucket:Optional[float]=None) -> int:
+    if (bucket:=self.bucket if bucket is None else bucket) <= 1 or size <= 1 or (options is not None and options.image is not None): return size
+    k = math.ceil(math.log(size, bucket))
+    while (ret:=math.ceil(bucket**k)) < size: k += 1
+    return ret
   def alloc(self, size:int, options:Optional[BufferOptions]=None):
-    if len(c := self.cache[(size, options)]): return c.pop()
-    try: return super().alloc(size, options)
+    key = (self.size_class(size, options), options)
+    if len(c := self.cache[key]):
+      GlobalCounters.lru_hits += 1
+      self.cached_bytes -= key[0]
+      return c.pop()
+    GlobalCounters.lru_misses += 1
+    try: return super().alloc(key[0], options)
     except (RuntimeError, MemoryError):
       self.free_cache()
-      return super().alloc(size, options)
-  def free_cache(self):
+      return super().alloc(key[0], options)
+  def free_cache(self, keep:int=0):
+    # the cache is ordered by last use, so this evicts the least recently used buffers first
     for (sz,options),opaques in self.cache.items():
-      for opaque in opaques: super().free(opaque, sz, options)
-      opaques.clear()
+      while len(opaques) and self.cached_bytes > keep:
+        super().free(opaques.pop(0), sz, options)
+        self.cached_bytes -= sz
+        GlobalCounters.lru_evicted_bytes += sz
   def free(self, opaque:Any, size:int, options:Optional[BufferOptions]=None):
-    if getenv("LRU", 1) and (options is None or not options.nolru): self.cache[(size, options)].append(opaque)
+    if getenv("LRU", 1) and (options is None or not (options.nolru or options.external_ptr is not None)):
+      key = (self.size_class(size, options), options)
+      (c := self.cache.pop(key, [])).append(opaque)
+      self.cache[key] = c
+      self.cached_bytes += key[0]
+      if self.cache_max and self.cached_bytes > self.cache_max: self.free_cache(self.cache_max)
     else: super().free(opaque, size, options)
 
 class _MallocAllocator(LRUAllocator):
@@ -167,6 +192,15 @@ class _MallocAllocator(LRUAllocator):
   def copyin(self, dest, src:memoryview): ctypes.memmove(dest, from_mv(src), len(src))
   def copyout(self, dest:memoryview, src): ctypes.memmove(from_mv(dest), src, len(dest))
   def offset(self, buf, size:int, offset:int): return from_mv(self.as_buffer(buf)[offset:offset+size])
+  def copy_from_disk_many(self, copies:List[Tuple[Any, Any, int]], seg_len:int=(2 << 20), seg_cnt:int=16):
+    # O_DIRECT reads need page aligned memory, so they land in mmaped staging buffers and are copied from there
+    stage = [mmap.mmap(-1, seg_len) for _ in range(seg_cnt)]
+    addrs, free = [ctypes.addressof(ctypes.c_char.from_buffer(x)) for x in stage], list(range(seg_cnt))
+    def _get_free_buf(): return (addrs[free[-1]], free.pop()) if free else None
+    srcs = [(src, size) for _,src,size in copies]
+    for (i, batch_info, dst_off, src_off, copy_size) in srcs[0][0].device.allocator._copyout_sharded(srcs, _get_free_buf, seg_len=seg_len):
+      ctypes.memmove(ctypes.addressof(copies[i][0]) + dst_off, batch_info[0] + src_off, copy_size)
+      free.append(batch_info[1])
 
 MallocAllocator = _MallocAllocator()
 
@@ -637,7 +671,8 @@ class HCQAllocator(LRUAllocator): # pylint: disable=abstract-method
         self.b_timeline[self.b_next] = self.device.timeline_value
         self.device.timeline_value += 1
 
-  def copy_from_disk(self, dest:HCQBuffer, src, size):
+  def copy_from_disk(self, dest:HCQBuffer, src, size): self.copy_from_disk_many([(dest, src, size)])
+  def copy_from_disk_many(self, copies:List[Tuple[HCQBuffer, Any, int]]):
     def _get_temp_buf():
       # Check if the next buffer is safe to be used (its signal has passed) and reserve it.
       if self.b_timeline[(self.b_next + 1) % len(self.b)] <= self.device.timeline_signal.value:
@@ -646,9 +681,10 @@ class HCQAllocator(LRUAllocator): # pylint: disable=abstract-method
       return None
 
     with hcq_profile(self.device, queue_type=self.device.hw_copy_queue_t, desc=f"DISK -> {self.device.dname}", enabled=PROFILE):
-      for (batch_info, dst_off, src_off, copy_size) in src.device.allocator._copyout_sharded(src, size, _get_temp_buf, seg_len=self.b[0].size):
+      srcs = [(src, size) for _,src,size in copies]
+      for (i, batch_info, dst_off, src_off, copy_size) in srcs[0][0].device.allocator._copyout_sharded(srcs, _get_temp_buf, seg_len=self.b[0].size):
         self.device.hw_copy_queue_t().wait(self.device.timeline_signal, self.device.timeline_value - 1) \
-                                     .copy(dest.va_addr + dst_off, batch_info[0] + src_off, copy_size) \
+                                     .copy(copies[i][0].va_addr + dst_off, batch_info[0] + src_off, copy_size) \
                                      .signal(self.device.timeline_signal, self.device.timeline_value).submit(self.device)
         self.b_timeline[batch_info[1]] = self.device.timeline_value
         self.device.timeline_value += 1
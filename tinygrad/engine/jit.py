@@ -1,19 +1,20 @@
 from __future__ import annotations
 from typing import TypeVar, Generic, Callable, List, Tuple, Union, Dict, cast, Optional, Any
-import functools, itertools, collections
+import functools, itertools, collections, pickle
 from tinygrad.tensor import Tensor
 from tinygrad.lazy import LazyBuffer
-from tinygrad.helpers import flatten, merge_dicts, DEBUG, Context, GRAPH, BEAM, getenv, colored, JIT, dedup, partition
+from tinygrad.helpers import flatten, merge_dicts, DEBUG, Context, GRAPH, BEAM, getenv, colored, JIT, dedup, partition, all_int, GlobalCounters
 from tinygrad.device import Buffer, Compiled, Device
 from tinygrad.dtype import DType
 from tinygrad.shape.shapetracker import ShapeTracker
-from tinygrad.shape.symbolic import Variable, sint, sym_infer
+from tinygrad.shape.symbolic import Node, Variable, sint, sym_infer
 from tinygrad.engine.realize import ExecItem, capturing, EmptyOp, ViewOp, BufferXfer, CompiledRunner, Runner, _internal_memory_planner
-from tinygrad.nn.state import get_parameters
+from tinygrad.nn.state import get_parameters, safe_save, safe_load_metadata
 from dataclasses import dataclass
 from weakref import WeakKeyDictionary
 
 class GraphException(Exception): pass
+class JitSymbolicError(Exception): pass
 
 def apply_graph_to_jit(jit_cache: List[ExecItem], input_rawbuffers: List[Buffer], var_vals: Dict[Variable, int], max_batch_size=0) -> List[ExecItem]:
   # Split JIT cache into batches for faster graph execution.
@@ -183,13 +184,30 @@ def _prepare_jit_inputs(args, kwargs):
   st_vars_dtype_device = [(x[0], tuple(sorted(x[1].keys(), key=lambda v: v.expr)), x[2], x[3]) for x in st_varvals_dtype_device]
   return input_buffers, var_vals, names, st_vars_dtype_device
 
+def _concretize_ret(ret, var_vals:Dict[Variable, int]):
+  if isinstance(ret, Tensor):
+    return ret if all_int(ret.shape) else ret.reshape(tuple(sym_infer(s.unbind()[0] if isinstance(s, Node) else s, var_vals) for s in ret.shape))
+  if isinstance(ret, (tuple, list)): return type(ret)(_concretize_ret(x, var_vals) for x in ret)
+  return ret
+
 class TinyJit(Generic[ReturnType]):
-  def __init__(self, fxn:Optional[Callable[..., ReturnType]], captured:Optional[CapturedJit]=None, prune=False):
+  def __init__(self, fxn:Optional[Callable[..., ReturnType]], captured:Optional[CapturedJit]=None, prune=False,
+               symbolic:Optional[Dict[Union[int, str], Dict[int, Variable]]]=None, max_concrete:int=4):
+    """
+    With `symbolic`, the listed dims of the input tensors (by arg index or kwarg name, then axis) are replaced by their Variable on every call.
+    One capture then serves every size in the Variable's range, and the returned tensors are reshaped back to concrete shapes.
+    Sizes out of range, or inputs that can't be given a symbolic shape, fall back to up to `max_concrete` concrete captures.
+    So does a function that fails on the first symbolic call before it runs a kernel, like one that needs Python ints from the shapes.
+    Later errors are raised, pass `symbolic=None` for functions that need concrete shapes.
+    """
     assert fxn or captured, "need either a function or a CapturedJit"
     self.fxn = fxn
     self.captured: Optional[CapturedJit] = captured
     self.cnt: int = 2 if self.fxn is None else 0
     self.prune = prune
+    self.symbolic, self.max_concrete = symbolic, max_concrete
+    self.symbolic_failed = False
+    self.concrete: collections.OrderedDict[Tuple, TinyJit[ReturnType]] = collections.OrderedDict()
 
   def add_buffer(self, b:Buffer) -> Buffer:
     if found:=self._buffer_replace.get(b, None): return found
@@ -207,10 +225,60 @@ class TinyJit(Generic[ReturnType]):
     assert self.fxn is not None, "can't reset without function"
     self.cnt = 0
     self.captured = None
+    self.symbolic_failed = False
+    self.concrete.clear()
 
   def __reduce__(self):
     assert self.captured is not None, "can't pickle an uncaptured JIT"
-    return self.__class__, (None, self.captured)
+    return self.__class__, (None, self.captured, False, self.symbolic)
+
+  def save(self, fn:str):
+    """
+    Saves the captured JIT to `fn`. The buffers it holds state in are written to `fn`.safetensors and referenced by offset.
+    """
+    assert self.captured is not None, "can't save an uncaptured JIT"
+    devices = dedup([b.device for ei in self.captured.jit_cache for b in ei.bufs if b is not None])
+    weights: Dict[str, Tensor] = {}
+    names: Dict[Buffer, str] = {}
+    class JitPickler(pickle.Pickler):
+      def persistent_id(self, obj):
+        if obj.__class__ is str and obj in devices: return ("device", devices.index(obj))
+        if obj.__class__ is not Buffer or obj._base is not None or not obj.is_allocated() or obj.device not in devices: return None
+        if (name:=names.get(obj)) is None:
+          names[obj] = name = str(len(names))
+          # intermediates are only scratch space, everything still referenced by a LazyBuffer is state
+          if obj.lb_refcount > 0: weights[name] = Tensor(bytes(obj.as_buffer()))
+        return ("buffer", name, devices.index(obj.device), obj.size, obj.dtype, obj.options, obj.lb_refcount)
+    with open(fn, "wb") as f:
+      pickle.dump(devices, f)
+      JitPickler(f).dump(self.captured)
+    safe_save(weights, f"{fn}.safetensors")
+
+  @staticmethod
+  def load(fn:str, device:Optional[str]=None) -> TinyJit:
+    """
+    Loads a JIT saved with `TinyJit.save`, optionally rebinding it to another device of the same backend.
+    """
+    _, json_len, metadata = safe_load_metadata(f"{fn}.safetensors")
+    buffers: Dict[str, Buffer] = {}
+    with open(fn, "rb") as f, open(f"{fn}.safetensors", "rb") as wf:
+      devices = pickle.load(f)
+      if device is not None:
+        if len(devices) != 1: raise RuntimeError(f"can only rebind a JIT on a single device, this one uses {devices}")
+        if (device:=Device.canonicalize(device)).split(":")[0] != devices[0].split(":")[0]:
+          raise RuntimeError(f"JIT was compiled for {devices[0]}, can't load it on {device}")
+        devices = [device]
+      class JitUnpickler(pickle.Unpickler):
+        def persistent_load(self, pid):
+          if pid[0] == "device": return devices[pid[1]]
+          _, name, dev, size, dtype, options, lb_refcount = pid
+          if (ret:=buffers.get(name)) is None:
+            buffers[name] = ret = Buffer(devices[dev], size, dtype, options=options, lb_refcount=lb_refcount).allocate()
+            if (meta:=metadata.get(name)) is not None:
+              wf.seek(8+json_len+meta['data_offsets'][0])
+              ret.copyin(memoryview(bytearray(wf.read(ret.nbytes))))
+          return ret
+      return TinyJit(None, JitUnpickler(f).load())
 
   # keep legacy code working
   @property
@@ -220,7 +288,54 @@ class TinyJit(Generic[ReturnType]):
 
   def __get__(self, obj, objtype): return functools.partial(self.__call__, obj) # add support for instance methods
 
+  def _bind_symbolic(self, args, kwargs) -> Optional[Tuple[tuple, Dict[str, Any], Dict[Variable, int]]]:
+    assert self.symbolic is not None
+    var_vals: Dict[Variable, int] = {}
+    bound: Dict[Union[int, str], Any] = {}
+    for name,t in itertools.chain(enumerate(args), kwargs.items()):
+      if t.__class__ is not Tensor or (axes:=self.symbolic.get(name)) is None: continue
+      shape = list(t.shape)
+      for ax,v in axes.items():
+        if not isinstance(val:=shape[ax], int) or not v.min <= val <= v.max: return None
+        if var_vals.setdefault(Variable(v.expr, v.min, v.max), val) != val: return None
+        shape[ax] = Variable(v.expr, v.min, v.max).bind(val)
+      try: bound[name] = t.reshape(tuple(shape))
+      except (AssertionError, ValueError) as e: raise JitSymbolicError(f"can't make input {name} symbolic: {e}") from e
+    return tuple(bound.get(i, a) for i,a in enumerate(args)), {k:bound.get(k, v) for k,v in kwargs.items()}, var_vals
+
+  def _call_concrete(self, args, kwargs) -> ReturnType:
+    key = tuple((name, t.shape, t.dtype, t.device) for name,t in itertools.chain(enumerate(args), sorted(kwargs.items())) if t.__class__ is Tensor)
+    if (jit:=self.concrete.pop(key, None)) is None:
+      assert self.fxn is not None, "can't fall back to a concrete JIT without a function"
+      jit = TinyJit(self.fxn, prune=self.prune)
+    self.concrete[key] = jit
+    while len(self.concrete) > self.max_concrete: self.concrete.popitem(last=False)
+    return jit(*args, **kwargs)
+
   def __call__(self, *args, **kwargs) -> ReturnType:
+    if self.symbolic is None or not JIT: return self._call(*args, **kwargs)
+    if self.symbolic_failed: return self._call_concrete(args, kwargs)
+    try: bound = self._bind_symbolic(args, kwargs)
+    except JitSymbolicError as e:
+      if self.cnt >= 2 or self.fxn is None: raise e
+      return self._symbolic_fallback(e, args, kwargs)
+    if bound is None: return self._call_concrete(args, kwargs)
+    sargs, skwargs, var_vals = bound
+    if self.cnt > 0: return _concretize_ret(self._call(*sargs, **skwargs), var_vals)
+    # the first call can fail on the symbolic shapes, as long as no kernel ran it's safe to run the function again concretely
+    Tensor.realize(*[t for t in itertools.chain(args, kwargs.values()) if t.__class__ is Tensor])
+    kernel_count = GlobalCounters.kernel_count
+    try: return _concretize_ret(self._call(*sargs, **skwargs), var_vals)
+    except Exception as e:
+      if GlobalCounters.kernel_count != kernel_count: raise e
+      return self._symbolic_fallback(e, args, kwargs)
+
+  def _symbolic_fallback(self, e:Exception, args, kwargs) -> ReturnType:
+    if DEBUG >= 1: print(f"JIT can't run {getattr(self.fxn, '__name__', self.fxn)} with symbolic shapes, falling back to concrete: {e!r}")
+    self.symbolic_failed, self.cnt, self.captured = True, 0, None
+    return self._call_concrete(args, kwargs)
+
+  def _call(self, *args, **kwargs) -> ReturnType:
     input_buffers, var_vals, names, st_vars_dtype_device = _prepare_jit_inputs(args, kwargs)
     if not JIT or self.cnt == 0:
       # jit ignore
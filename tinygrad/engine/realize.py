@@ -1,12 +1,13 @@
-from typing import List, Dict, Optional, cast, Generator, Tuple, Union
-import time, pprint
+from typing import List, Dict, Optional, cast, Generator, Tuple, Union, DefaultDict
+import time, pprint, os
 from collections import defaultdict
 from dataclasses import dataclass, replace
 from tinygrad.helpers import colored, getenv, DEBUG, GlobalCounters, ansilen, BEAM, NOOPT, all_int, CAPTURING, Metadata, Context, TRACEMETA, dedup
-from tinygrad.helpers import NO_MEMORY_PLANNER
+from tinygrad.helpers import NO_MEMORY_PLANNER, ARENA_PLANNER, ARENA_ALIGN, round_up, RUNNER_CACHE, CPU_THREADS, diskcache_get, diskcache_put
+from tinygrad.helpers import ContextVar
 from tinygrad.ops import MetaOps, UOps, UOp
 from tinygrad.dtype import dtypes
-from tinygrad.device import Device, Buffer
+from tinygrad.device import Device, Buffer, BufferOptions, Compiler, LRUAllocator
 from tinygrad.shape.symbolic import Variable, sym_infer, sint
 from tinygrad.renderer import Renderer, Program
 from tinygrad.codegen.kernel import Kernel
@@ -130,7 +131,7 @@ class BufferCopy(Runner):
       dest.allocator.copy_from_disk(dest._buf, src._buf, src.nbytes)
     elif src.device.startswith("DISK") and hasattr(dest.allocator, 'as_buffer'):
       # fast(ish) path, uses readinto in diskbuffers
-      src.allocator.copyout(dest.allocator.as_buffer(dest._buf), src._buf)
+      src.allocator.copyout(dest.allocator.as_buffer(dest._buf)[:dest.nbytes], src._buf)
     else:
       dest.copyin(src.as_buffer(allow_zero_copy=True))  # may allocate a CPU buffer depending on allow_zero_copy
   def __call__(self, rawbufs:List[Buffer], var_vals:Dict[Variable, int], wait=False):
@@ -148,6 +149,15 @@ class BufferXfer(BufferCopy):
 # **************** method cache ****************
 
 method_cache: Dict[Tuple[str, bytes, int, int, bool], CompiledRunner] = {}
+
+# any setting can change what an ast is lowered to, so the on-disk runner cache is keyed by the compiler, the environment and every ContextVar
+# except these, which only change what's printed, profiled or cached
+UNKEYED_ENV = {"DEBUG", "BEAM_DEBUG", "RUNNER_CACHE", "CACHELEVEL", "CACHEDB", "CACHE_MAX_BYTES", "PROFILE", "PROFILEPATH", "GRAPH", "GRAPHPATH",
+               "TRACEMETA", "CAPTURING", "SAVE_SCHEDULE", "PWD", "OLDPWD", "SHLVL", "_"}
+def _lowering_key(compiler:Compiler) -> str:
+  env = {**os.environ, **{k:str(v.value) for k,v in ContextVar._cache.items()}}
+  return ",".join([compiler.cachekey or type(compiler).__name__] + [f"{k}={v}" for k,v in sorted(env.items()) if k not in UNKEYED_ENV])
+
 def get_runner(dname:str, ast:UOp) -> CompiledRunner:
   ckey = (dname, ast.key, BEAM.value, NOOPT.value, False)
   if cret:=method_cache.get(ckey): return cret
@@ -155,11 +165,22 @@ def get_runner(dname:str, ast:UOp) -> CompiledRunner:
   if bret:=method_cache.get(bkey):
     method_cache[ckey] = ret = CompiledRunner(replace(bret.p, dname=dname), bret.lib)
   else:
-    prg: Program = get_kernel(Device[dname].renderer, ast).to_program()
-    if getenv("FUZZ_UOPS"):
-      from test.external.fuzz_uops import UOpsFuzzerRunner
-      return UOpsFuzzerRunner(replace(prg, dname=dname))
-    method_cache[ckey] = method_cache[bkey] = ret = CompiledRunner(replace(prg, dname=dname))
+    # opt-in on-disk cache of the lowered Program and its lib, a warm start skips optimizing, linearizing, rendering and compiling
+    renderer = Device[dname].renderer
+    dkey = {"device": bkey[0], "ast": ast.key, "beam": BEAM.value, "noopt": NOOPT.value, "renderer": f"{type(renderer).__name__}{renderer.suffix}",
+            "threads": CPU_THREADS.value if renderer.has_threads else 1, "lowering": _lowering_key(Device[dname].compiler)}
+    if RUNNER_CACHE and (cached:=diskcache_get("get_runner", dkey)) is not None:
+      prg, lib = cached
+      if DEBUG >= 3: print(f"runner cache hit for {prg.name}")
+    else:
+      prg = get_kernel(renderer, ast).to_program()
+      if getenv("FUZZ_UOPS"):
+        from test.external.fuzz_uops import UOpsFuzzerRunner
+        return UOpsFuzzerRunner(replace(prg, dname=dname))
+      lib = Device[dname].compiler.compile_cached(prg.src)
+      # a BEAM search with a time budget may be cut short, that result isn't stored for later runs
+      if RUNNER_CACHE and not (BEAM >= 1 and getenv("BEAM_BUDGET_SEC", 0.0)): diskcache_put("get_runner", dkey, (prg, lib))
+    method_cache[ckey] = method_cache[bkey] = ret = CompiledRunner(replace(prg, dname=dname), lib)
   return ret
 
 # **************** lowering functions ****************
@@ -225,6 +246,20 @@ def run_schedule(schedule:List[ScheduleItem], var_vals:Optional[Dict[Variable, i
 
 # **************** memory planning ****************
 
+def _arena_offsets(requests:List[Tuple[int, int, Buffer]], align:int) -> Tuple[Dict[Buffer, int], int]:
+  # greedy by size strip packing: the largest buffer first
+  # each goes at the lowest offset that doesn't overlap a placed buffer that is live at the same time
+  placed: List[Tuple[int, int, int, int]] = []  # offset, end offset, first step, last step
+  offsets: Dict[Buffer, int] = {}
+  for st, en, buf in sorted(requests, key=lambda x: (-x[2].nbytes, x[0])):
+    off = 0
+    for poff, pend, _, _ in sorted(x for x in placed if x[2] <= en and st <= x[3]):
+      if poff - off >= buf.nbytes: break
+      off = max(off, round_up(pend, align))
+    placed.append((off, off+buf.nbytes, st, en))
+    offsets[buf] = off
+  return offsets, max([x[1] for x in placed], default=0)
+
 def _internal_memory_planner(buffers:List[Union[List[Buffer], Tuple[Buffer, ...]]], noopt_buffers=None, debug_prefix="") -> Dict[Buffer, Buffer]:
   if NO_MEMORY_PLANNER: return {}
   first_appearance, last_appearance = {}, {}
@@ -248,16 +283,33 @@ def _internal_memory_planner(buffers:List[Union[List[Buffer], Tuple[Buffer, ...]
 
     return seg_buf if seg_buf.nbytes == buf.nbytes else Buffer(buf.device, buf.size, buf.dtype, base=seg_buf)
 
+  # on compute devices whose allocator can offset into a buffer, all buffers of a device are packed into one arena and become views of it
+  def use_arena(buf:Buffer) -> bool:
+    return buf.device.split(":")[0].upper() not in {"DISK", "NPY"} and hasattr(Device[buf.device].allocator, "offset") and \
+      (buf.options is None or buf.options.image is None)
   buffer_requests = sorted([(first_appearance[buf], last_appearance[buf], buf) for buf in first_appearance.keys()], key=lambda x: -x[2].nbytes)
-  assigned = {buf:find_replace_buffer(buf, st, en) for st, en, buf in buffer_requests}
+  arena_requests: DefaultDict[Tuple[str, Optional[BufferOptions]], List[Tuple[int, int, Buffer]]] = defaultdict(list)
+  assigned: Dict[Buffer, Buffer] = {}
+  for st, en, buf in buffer_requests:
+    if ARENA_PLANNER and use_arena(buf):
+      arena_requests[(buf.device, buf.options)].append((st, en, buf))
+    else: assigned[buf] = find_replace_buffer(buf, st, en)
+  for (device, options), reqs in arena_requests.items():
+    offsets, arena_size = _arena_offsets(reqs, ARENA_ALIGN.value)
+    # every schedule needs an arena of another size, rounded up to a size class (1.25x steps without LRU_BUCKET) the LRU cache can reuse it
+    if isinstance(allocator:=Device[device].allocator, LRUAllocator):
+      arena_size = allocator.size_class(arena_size, options, max(allocator.bucket, 1.25))
+    arena = Buffer(device, arena_size, dtypes.uint8, options=options)
+    for _, _, buf in reqs: assigned[buf] = Buffer(buf.device, buf.size, buf.dtype, base=arena, offset=offsets[buf])
 
   for i,u in enumerate(buffers):
     for buf in u:
       if buf.is_allocated() or buf.lb_refcount > 0 or (noopt_buffers is not None and buf.base in noopt_buffers): continue
-      if buf._base is not None: assigned[buf] = Buffer(buf.device, buf.size, buf.dtype, base=assigned.get(buf.base, buf.base).base, offset=buf.offset)
+      if buf._base is not None and (rbase:=assigned.get(buf.base, buf.base)) is not buf.base:
+        assigned[buf] = Buffer(buf.device, buf.size, buf.dtype, base=rbase.base, offset=rbase.offset+buf.offset)
       else: assigned[buf] = assigned.get(buf, buf)
 
-  if DEBUG >= 1 and len(ak:=dedup(x for x in assigned.keys() if x._base is None)) != len(av:=dedup(x for x in assigned.values() if x._base is None)):
+  if DEBUG >= 1 and len(ak:=dedup(x for x in assigned.keys() if x._base is None)) != len(av:=dedup(x.base for x in assigned.values())):
     print(debug_prefix+f"memory reduced from {sum([x.nbytes for x in ak])/1e6:.2f} MB -> {sum([x.nbytes for x in av])/1e6:.2f} MB,",
           f"{len(ak)} -> {len(av)} bufs")
   return assigned
@@ -1,16 +1,16 @@
 import sys, pickle, atexit, importlib, contextlib
 from collections import defaultdict, deque
 from dataclasses import dataclass
-from typing import Callable, Tuple, List, Dict, Optional, DefaultDict, cast, get_args
-from tinygrad.ops import REDUCE_ALU, MetaOps, ReduceOps, UNSAFE_PAD_OPS, UnaryOps, UOp, UOps, PatternMatcher, UPat, graph_rewrite
+from typing import Callable, Tuple, List, Dict, Optional, DefaultDict, Set, cast, get_args
+from tinygrad.ops import REDUCE_ALU, MetaOps, ReduceOps, BinaryOps, UNSAFE_PAD_OPS, UnaryOps, UOp, UOps, PatternMatcher, UPat, graph_rewrite
 from tinygrad.engine.graph import log_lazybuffer, realized_lazybuffer
-from tinygrad.helpers import GRAPH, DEBUG, MULTIOUTPUT, SAVE_SCHEDULE, FUSE_CONV_BW, FUSE_ARANGE, AST_REWRITE, \
+from tinygrad.helpers import GRAPH, DEBUG, MULTIOUTPUT, SAVE_SCHEDULE, FUSE_CONV_BW, FUSE_ARANGE, AST_REWRITE, SCHEDULE_CACHE, \
                              GlobalCounters, all_same, colored, prod, dedup, all_int, merge_dicts, getenv, Metadata, unwrap
 from tinygrad.shape.symbolic import Variable, sint
 from tinygrad.dtype import ConstType, ImageDType, PtrDType, dtypes
 from tinygrad.lazy import LazyBuffer
 from tinygrad.shape.shapetracker import ShapeTracker
-from tinygrad.device import Buffer
+from tinygrad.device import Buffer, Device
 from tinygrad.shape.view import View, strides_for_shape
 
 # creation can recurse a lot
@@ -263,6 +263,63 @@ def _get_isolated_children(r:LazyBuffer, reduce_for_op:Dict[LazyBuffer, LazyBuff
   for tr in group: _recursive_group(tr, tr.st, tr, children, realizes, reduce_for_op, descendants, cache={})
   return merge_dicts([group, {} if any(tr in group for tr in descendants) else descendants])
 
+def _is_compared(buf:LazyBuffer, r:LazyBuffer, realizes:Dict[LazyBuffer, None], cache:Dict[LazyBuffer, Optional[bool]]) -> Optional[bool]:
+  """if every path from buf up to r goes through a CMPNE, None if r isn't a parent of buf in its kernel."""
+  if buf is r: return False
+  if buf in cache: return cache[buf]
+  rets = [c for x in buf.srcs if x.base.realized is None and (x.base is r or x.base not in realizes)
+          and (c:=_is_compared(x.base, r, realizes, cache)) is not None]
+  cache[buf] = ret = (buf.op is BinaryOps.CMPNE or all(rets)) if rets else None
+  return ret
+
+def _kernel_ends(buf:LazyBuffer, children:DefaultDict[LazyBuffer, Dict[LazyBuffer, None]], realizes:Dict[LazyBuffer, None]) -> Set[LazyBuffer]:
+  """the reduces and realized buffers reached from buf without leaving its kernel."""
+  ret: Set[LazyBuffer] = set()
+  todo, seen = [buf], set()
+  while todo:
+    if (x:=todo.pop()) in seen: continue
+    seen.add(x)
+    if x in realizes or isinstance(x.op, ReduceOps): ret.add(x)
+    else: todo.extend(children[x])
+  return ret
+
+def _reduce_inputs(r:LazyBuffer, realizes:Dict[LazyBuffer, None]) -> Set[LazyBuffer]:
+  """the buffers the kernel of reduce r loads before reducing."""
+  ret: Set[LazyBuffer] = set()
+  todo, seen = [r.srcs[0].base], set()
+  while todo:
+    if (x:=todo.pop()) in seen or x.op is MetaOps.CONST: continue
+    seen.add(x)
+    if x.realized is not None or x in realizes: ret.add(x)
+    else: todo.extend(s.base for s in x.srcs)
+  return ret
+
+def _needs_group(r:LazyBuffer) -> bool:
+  """if hand_coded_optimizations would GROUP the kernel of reduce r. a kernel with sibling reduces can't, so they stay apart there."""
+  if not ((renderer:=Device[r.device].renderer).has_local and renderer.has_shared) or not all_int(r.srcs[0].shape): return False
+  return prod(r.shape) <= 2048 and prod(r.srcs[0].shape) // prod(r.shape) >= 16
+
+def _can_share_kernel(r0:LazyBuffer, r1:LazyBuffer, reduce_groups:Dict[LazyBuffer, List[LazyBuffer]],
+                      children:DefaultDict[LazyBuffer, Dict[LazyBuffer, None]], realizes:Dict[LazyBuffer, None]) -> bool:
+  """if nothing in the kernel of r1 needs a kernel that runs after the kernel of r0. r0 can feed the outputs of r1 inside the kernel."""
+  outs, group = set(reduce_groups[r0]+reduce_groups[r1]), set(reduce_groups[r1])
+  todo, seen, later = [r0], set(), []
+  while todo:
+    if (x:=todo.pop()) in seen: continue
+    seen.add(x)
+    for c in children[x]:
+      if c is r1: return False
+      # another kernel, or a view the output can't be stored through
+      if (c in realizes and c not in outs) or isinstance(c.op, ReduceOps) or not all(s.st.contiguous for s in c.srcs if s.base is x): later.append(c)
+      else: todo.append(c)
+  seen = set()
+  while later:
+    if (x:=later.pop()) in seen: continue
+    if x is r1 or x in group: return False
+    seen.add(x)
+    later.extend(children[x])
+  return True
+
 def _get_output_groups(outs:List[LazyBuffer]) -> \
   Tuple[DefaultDict[LazyBuffer, List[LazyBuffer]],  # these are the output groups
         Dict[LazyBuffer, None],                     # these are all the realizes in the graph
@@ -331,19 +388,55 @@ def _get_output_groups(outs:List[LazyBuffer]) -> \
       top_reduce = reduceop.base.srcs[0].base
       if len(children[top_reduce]) == 1: del realizes[top_reduce]
 
+  gather_kernels: Set[LazyBuffer] = set()
   for r in reduce_of_const:
     group = {tr:None for tr,rop in reduce_for_op.items() if rop is r}
     if DEBUG_ARANGE:=(getenv("DEBUG_ARANGE")): print(f"checking {r} {group=}")
     if any(tr.forced_realize for tr in group) or any(x.base in group for x in outs): continue
     kernel_children = {c for tr in group for c in children[tr] if c.op not in {MetaOps.COPY, MetaOps.VIEW}}
     if len(kernel_children) == 0: continue
+    # by default only an arange that's compared to an index folds, this is a gather and it becomes one load in the child kernel
+    if FUSE_ARANGE < 2:
+      if not all(_is_compared(tr, r, realizes, {}) or all(c.op is BinaryOps.CMPNE for c in children[tr]) for tr in group): continue
+      # a gather sums the compare, one per kernel. the scheduler can't fold the aranges of multi dim indexing together yet
+      ends = set().union(*[_kernel_ends(c, children, realizes) for c in kernel_children])
+      if len(kernel_children) > 1 or any(e.op is not ReduceOps.SUM for e in ends) or gather_kernels.intersection(ends): continue
+      gather_kernels.update(ends)
     if DEBUG_ARANGE: print(colored(f"folding {r}", "green"))
     for tr in group: del realizes[tr]
 
+  # reduces over the same input and axis that don't depend on each other share a kernel, each with its own accumulator
+  reduce_kernel: Dict[LazyBuffer, LazyBuffer] = {}
+  if MULTIOUTPUT:
+    reduce_groups: DefaultDict[LazyBuffer, List[LazyBuffer]] = defaultdict(list)
+    for tr,r in reduce_for_op.items():
+      if tr in realizes: reduce_groups[r].append(tr)
+    # a reduce that's realized itself is its own kernel
+    for r in realizes:
+      if isinstance(r.op, ReduceOps) and r.realized is None and r not in reduce_for_op: reduce_groups[r].append(reduce_for_op.setdefault(r, r))
+    siblings: DefaultDict[Tuple, List[LazyBuffer]] = defaultdict(list)
+    for r,trs in reduce_groups.items():
+      if any(tr.op is MetaOps.ASSIGN or isinstance(tr.dtype, ImageDType) for tr in trs) or _needs_group(r): continue
+      for x in _reduce_inputs(r, realizes): siblings[(x, r.device, r.srcs[0].shape, r.arg)].append(r)
+    for rs in siblings.values():
+      for i,r in enumerate(rs):
+        if r in reduce_kernel: continue
+        for prev in rs[:i]:
+          members = [x for x in reduce_groups if reduce_kernel.get(x, x) is reduce_kernel.get(prev, prev)]
+          if all(_can_share_kernel(a, b, reduce_groups, children, realizes) for x in members for a,b in [(r,x), (x,r)]):
+            reduce_kernel[r] = reduce_kernel.get(prev, prev)
+            break
+    # a reduce that was only realized to feed the other outputs of its kernel doesn't need a store anymore
+    for r in reduce_groups:
+      if r not in reduce_kernel and r not in reduce_kernel.values(): continue
+      if reduce_groups[r] != [r] or r.forced_realize or any(x.base is r for x in outs): continue
+      kernel_outs = {tr for x,trs in reduce_groups.items() if reduce_kernel.get(x, x) is reduce_kernel.get(r, r) for tr in trs if tr is not r}
+      if set().union(*[_kernel_ends(c, children, realizes) for c in children[r]]).issubset(kernel_outs): del realizes[r]
+
   output_groups: DefaultDict[LazyBuffer, List[LazyBuffer]] = defaultdict(list)
   for buf in realizes:
     if buf.realized is not None or buf.op is MetaOps.CONST: continue
-    output_groups[reduce_for_op[buf] if buf in reduce_for_op and MULTIOUTPUT else buf].append(buf)
+    output_groups[reduce_kernel.get(r:=reduce_for_op[buf], r) if buf in reduce_for_op and MULTIOUTPUT else buf].append(buf)
 
     # make things that can't be images not images
     if isinstance(buf.dtype, ImageDType) and (prod(buf.shape) != prod(buf.dtype.shape) or
@@ -395,31 +488,87 @@ def _graph_schedule(outs:List[LazyBuffer]) -> \
     SCHEDULES.append((graph, in_degree))
   return graph, in_degree, var_vals
 
+# *** schedule cache: structurally equal lazy graphs get the same kernels ***
+
+def _recurse_key(buf:LazyBuffer, nodes:Dict[LazyBuffer, int], keys:List[Tuple], var_vals:Dict[Variable, int]) -> int:
+  if (idx:=nodes.get(buf)) is not None: return idx
+  st, vv = buf.st.unbind()
+  var_vals.update(vv)
+  if buf is not buf.base: k: Tuple = (st, _recurse_key(buf.base, nodes, keys, var_vals))
+  # realized buffers are placeholders, only their position in the graph matters
+  elif buf.realized is not None: k = (buf.device, buf.dtype, st, buf.op is MetaOps.CONST)
+  else:
+    arg = buf.arg
+    if isinstance(arg, Variable):
+      arg, val = arg.unbind()
+      var_vals[arg] = val
+    # the view an ASSIGN writes to can be symbolic too
+    if buf.op is MetaOps.ASSIGN and arg:
+      arg, vv = arg[0].unbind()
+      var_vals.update(vv)
+    k = (buf.device, buf.dtype, st, buf.op, arg, buf.forced_realize, buf.metadata, tuple(_recurse_key(x, nodes, keys, var_vals) for x in buf.srcs))
+  nodes[buf] = len(keys)
+  keys.append(k)
+  return nodes[buf]
+
+def _schedule_key(outs:List[LazyBuffer]) -> Tuple[Tuple, Dict[LazyBuffer, int], Dict[Variable, int]]:
+  """hash the unrealized graph with realized buffers as placeholders, bound Variables are unbound and their values returned"""
+  nodes: Dict[LazyBuffer, int] = {}
+  keys: List[Tuple] = []
+  var_vals: Dict[Variable, int] = {}
+  out_idxs = tuple(_recurse_key(x, nodes, keys, var_vals) for x in outs)
+  return (MULTIOUTPUT.value, FUSE_CONV_BW.value, FUSE_ARANGE.value, AST_REWRITE.value, out_idxs, tuple(keys)), nodes, var_vals
+
+# key -> (LBScheduleItems in order with bufs as node indexes, Variables in the schedule)
+schedule_cache: Dict[Tuple, Tuple[List[Tuple[UOp, Tuple[int, ...], Optional[Tuple[Metadata, ...]]]], Tuple[Variable, ...]]] = {}
+
 # *** DAG ordering: breadth first search ***
 
-def create_schedule_with_vars(outs:List[LazyBuffer]) -> Tuple[List[ScheduleItem], Dict[Variable, int]]:
+def _order_schedule(outs:List[LazyBuffer]) -> Tuple[List[LBScheduleItem], Dict[Variable, int]]:
   graph, in_degree, var_vals = _graph_schedule(outs)
   if getenv("RUN_PROCESS_REPLAY") and getenv("COMPARE_SCHEDULE", 1):
     # NOTE: process relpay needs PYTHONPATH=., remove this once it just pickles LazyBuffers
     with contextlib.suppress(Exception): importlib.import_module("test.external.process_replay.diff_schedule").process_replay(outs, graph, in_degree)
 
   queue = deque(lsi for lsi,deg in in_degree.items() if deg == 0)
+  ordered: List[LBScheduleItem] = []
+  while queue:
+    ordered.append(lsi:=queue.popleft())
+    for x in graph[lsi]:
+      in_degree[x] -= 1
+      if in_degree[x] == 0: queue.append(x)
+
+  # confirm everything was scheduled correctly
+  if any(degree != 0 for degree in in_degree.values()) or len(in_degree) != len(ordered):
+    raise RuntimeError(f"cycle detected in graph, prescheduled {len(in_degree)} but only scheduled {len(ordered)}")
+  return ordered, var_vals
+
+def create_schedule_with_vars(outs:List[LazyBuffer]) -> Tuple[List[ScheduleItem], Dict[Variable, int]]:
+  key = None
+  if SCHEDULE_CACHE and not (GRAPH or SAVE_SCHEDULE or getenv("RUN_PROCESS_REPLAY")):
+    key, nodes, key_var_vals = _schedule_key(outs)
+    # the scheduler changes the dtype of some image buffers, don't cache those
+    if any(isinstance(x.dtype, ImageDType) for x in nodes): key = None
+  if key is not None and (hit:=schedule_cache.pop(key, None)) is not None:
+    # rebind the cached kernels to the buffers of this graph
+    schedule_cache[key] = hit
+    bufs = list(nodes)
+    ordered = [LBScheduleItem(ast, tuple(bufs[i] for i in idxs), metadata) for ast,idxs,metadata in hit[0]]
+    var_vals = {v:key_var_vals[v] for v in hit[1]}
+  else:
+    ordered, var_vals = _order_schedule(outs)
+    if key is not None and all(x in nodes for lsi in ordered for x in lsi.bufs):
+      schedule_cache[key] = ([(lsi.ast, tuple(nodes[x] for x in lsi.bufs), lsi.metadata) for lsi in ordered], tuple(var_vals))
+      while len(schedule_cache) > SCHEDULE_CACHE.value: del schedule_cache[next(iter(schedule_cache))]
+
   schedule: List[ScheduleItem] = []
   kernel_number = GlobalCounters.kernel_count
-  while queue:
-    lsi = queue.popleft()
+  for lsi in ordered:
     if GRAPH:
       kernel_number += 1
       for out in lsi.outputs: realized_lazybuffer(out, kernel_number)
     for out in lsi.outputs: del out.srcs  # can only schedule once
     schedule.append(ScheduleItem(lsi.ast, tuple(x.buffer for x in lsi.bufs if x.size != 0), lsi.metadata))
-    for x in graph[lsi]:
-      in_degree[x] -= 1
-      if in_degree[x] == 0: queue.append(x)
-
-  # confirm everything was scheduled correctly
-  if any(degree != 0 for degree in in_degree.values()) or len(in_degree) != len(schedule):
-    raise RuntimeError(f"cycle detected in graph, prescheduled {len(in_degree)} but only scheduled {len(schedule)}")
   if DEBUG >= 1 and len(schedule) >= 10: print(f"scheduled {len(schedule)} kernels")
   return schedule, var_vals
 
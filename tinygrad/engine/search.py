@@ -1,8 +1,8 @@
-from typing import Dict, List, cast, DefaultDict, Optional, Tuple, Callable
-import itertools, functools, random, math, time, multiprocessing, traceback, signal
-from collections import defaultdict
+from typing import Dict, List, cast, DefaultDict, Optional, Tuple, Callable, Iterable, Generator
+import itertools, functools, random, math, time, multiprocessing, traceback, signal, threading, queue, contextlib, json
+from collections import defaultdict, Counter
 from dataclasses import replace
-from tinygrad.ops import UOp, UOps
+from tinygrad.ops import UOp, UOps, flops_mem
 from tinygrad.device import Device, Buffer, Compiler
 from tinygrad.helpers import prod, flatten, DEBUG, CACHELEVEL, diskcache_get, diskcache_put, getenv, Context, colored, to_function_name
 from tinygrad.dtype import ImageDType
@@ -22,6 +22,7 @@ if getenv("BEAM_PADTO", 1): actions += [Opt(op=OptOps.PADTO, axis=axis, amt=amt)
 actions += [Opt(op=OptOps.LOCAL, axis=0, amt=32), Opt(op=OptOps.UPCASTMID, axis=1, amt=4), Opt(op=OptOps.TC, axis=0, amt=0)]
 actions += [Opt(op=OptOps.TC, axis=axis, amt=getenv("TC_OPT", 2)) for axis in range(9)] # covers resnet kernels (3 global * 3 reduce)
 actions += [Opt(op=OptOps.SWAP, axis=axis, amt=amt) for axis in range(5) for amt in range(axis+1, 5)]
+actions += [Opt(op=OptOps.THREAD, axis=axis, amt=amt) for amt in [2,4,8,16,32,64] for axis in range(3)]
 if getenv("NOLOCALS"): actions += [Opt(op=OptOps.NOLOCALS)]
 
 def _get_test_global_size(global_size, max_global_size, var_vals):
@@ -57,9 +58,10 @@ class TimeoutException(Exception): pass
 def timeout_handler(signum, frame): raise TimeoutException()
 
 def _try_compile_linearized_w_idx(x:Tuple[int,Kernel], compiler:Compiler) -> Tuple[int, Optional[Tuple[Program, bytes, float]]]:
-  signal.signal(signal.SIGALRM, timeout_handler)
-  # set timeout
-  signal.alarm(getenv("BEAM_TIMEOUT_SEC", 10))
+  # set timeout, signals only work on the main thread so the compile thread of the pipelined search runs without one
+  if (use_alarm:=threading.current_thread() is threading.main_thread()):
+    signal.signal(signal.SIGALRM, timeout_handler)
+    signal.alarm(getenv("BEAM_TIMEOUT_SEC", 10))
   try:
     p = x[1].to_program(name_override="test")
     assert p.uops is not None, "uop list wasn't generated?"
@@ -77,9 +79,80 @@ def _try_compile_linearized_w_idx(x:Tuple[int,Kernel], compiler:Compiler) -> Tup
     if getenv("BEAM_STRICT_MODE"): raise e
     ret = None
   finally:
-    signal.alarm(0)
+    if use_alarm: signal.alarm(0)
   return x[0], ret
 
+def _compile_pipelined(fxn:Callable, xs:List[Tuple[int,Kernel]], timeout:float):
+  # compile ahead on a thread while the caller times, the bounded queue limits how many compiled programs wait for timing
+  # SIGALRM doesn't reach the thread, so a compile that runs past the timeout is skipped and a new thread takes the rest
+  q: queue.Queue = queue.Queue(getenv("BEAM_QUEUE", 8))
+  def put(x, stop:threading.Event) -> bool:
+    while not stop.is_set():
+      with contextlib.suppress(queue.Full):
+        q.put(x, timeout=0.1)
+        return True
+    return False
+  def worker(start:int, stop:threading.Event, cur:List):
+    for j in range(start, len(xs)):
+      cur[:] = [j, time.perf_counter()]
+      if not put(fxn(xs[j]), stop): return
+    put(None, stop)
+  def start(j:int) -> Tuple[threading.Event, List]:
+    stop, cur = threading.Event(), [j, time.perf_counter()]
+    threading.Thread(target=worker, args=(j, stop, cur), daemon=True).start()
+    return stop, cur
+  stop, cur = start(0)
+  try:
+    while True:
+      try: ret = q.get(timeout=0.1)
+      except queue.Empty:
+        if time.perf_counter() - cur[1] > timeout:
+          stop.set()
+          yield xs[cur[0]][0], None
+          stop, cur = start(cur[0]+1)
+        continue
+      if ret is None: break
+      yield ret
+  finally:
+    stop.set()
+
+def _dedup_lins(lins:List[Kernel]) -> List[Kernel]:
+  # candidates with the same shapetrackers and opt state render to the same program, only compile the first one
+  ret: Dict[Tuple, Kernel] = {}
+  for x in lins: ret.setdefault((tuple(x.sts), x.group_for_reduces, x.upcasted, x.local_dims, x.dont_use_locals, x.threaded, x.use_tensor_cores,
+                                 str(x.tensor_core_opts)), x)
+  return list(ret.values())
+
+# *** cost model ***
+
+def cost_features(lin:Kernel, uops:List[UOp], var_vals:Dict[Variable, int]) -> List[float]:
+  # log2 counts of each uop type, then the upcast/local/global/reduce sizes, the flops and the bytes loaded
+  cnt, sizes = Counter(u.op for u in uops), {"upcast": 1, "local": 1, "global": 1, "reduce": 1}
+  for sz,c in zip(lin.full_shape, lin.colors()):
+    sizes["upcast" if c in {"magenta", "yellow"} else "local" if c in {"cyan", "green", "white"} else "global" if c == "blue" else "reduce"] *= \
+      sym_infer(sz, var_vals)
+  flops, lds = flops_mem(uops, ignore_indexing=True)
+  return [math.log2(1+cnt[op]) for op in UOps] + [math.log2(x) for x in sizes.values()] + \
+    [math.log2(1+sym_infer(flops, var_vals)), math.log2(1+sym_infer(lds, var_vals))]
+
+@functools.lru_cache(None)
+def load_cost_model(fn:str) -> Callable[[List[float]], float]:
+  # a linear model on standardized features predicting log runtime, see extra/optimization/train_cost_model.py
+  with open(fn) as f: m = json.load(f)
+  if len(m["weights"]) != len(UOps) + 6: raise RuntimeError(f"cost model {fn} has {len(m['weights'])} features, expected {len(UOps) + 6}")
+  return lambda x: m["bias"] + sum(w*(v-mu)/sd for w,v,mu,sd in zip(m["weights"], x, m["mean"], m["std"]))
+
+def _rank_lins(lins:List[Kernel], cost_model:Callable[[List[float]], float], var_vals:Dict[Variable, int]) -> List[Kernel]:
+  def predict(lin:Kernel) -> float:
+    try: return cost_model(cost_features(lin, lin.linearize().uops, var_vals))
+    except Exception: return math.inf
+  return sorted(lins, key=predict)
+
+def _log_cost_sample(lin:Kernel, p:Program, tms:List[float], var_vals:Dict[Variable, int]):
+  # training samples for the cost model get their own table, they are never read back as timings
+  key = {"ast": lin.ast.key, "opts": str(lin.applied_opts), "device": lin.opts.device, "suffix": lin.opts.suffix}
+  diskcache_put("cost_samples", key, (cost_features(lin, cast(List[UOp], p.uops), var_vals), tms))
+
 # workers should ignore ctrl c
 def _init_worker(): signal.signal(signal.SIGINT, signal.SIG_IGN)
 
@@ -118,7 +191,7 @@ def get_kernel_actions(lin:Kernel, include_0=True) -> Dict[int, Kernel]:
     except KernelOptError: pass
   return acted_lins
 
-beam_pool, BEAM_DEBUG = None, getenv("BEAM_DEBUG")
+beam_pool, BEAM_DEBUG, BEAM_COST_SAMPLES = None, getenv("BEAM_DEBUG"), getenv("BEAM_COST_SAMPLES")
 def beam_search(lin:Kernel, rawbufs:List[Buffer], amt:int, allow_test_size=True, disable_cache=getenv("IGNORE_BEAM_CACHE")) -> Kernel:
   global beam_pool
   key = {"ast": lin.ast.key, "amt": amt, "allow_test_size": allow_test_size, "device": lin.opts.device, "suffix": lin.opts.suffix}
@@ -131,6 +204,8 @@ def beam_search(lin:Kernel, rawbufs:List[Buffer], amt:int, allow_test_size=True,
   seen_libs = set()
 
   default_parallel = multiprocessing.cpu_count() if lin.opts.device in {"CUDA", "AMD", "NV"} else 0
+  # a compile thread shares the cores with the CPU programs being timed
+  default_pipeline = 0 if lin.opts.device in {"CLANG", "LLVM"} else 1
   if beam_pool is None and (workers := getenv("PARALLEL", default_parallel)):
     beam_pool = multiprocessing.get_context("spawn").Pool(workers, _init_worker, (), getenv("BEAM_MAX_TASKS_PER_CHILD", 16))
 
@@ -141,14 +216,26 @@ def beam_search(lin:Kernel, rawbufs:List[Buffer], amt:int, allow_test_size=True,
   try:
     rawbufs = _ensure_buffer_alloc(rawbufs)
     var_vals: Dict[Variable, int] = {k:(k.max+k.min)//2 for k in lin.ast.variables()}
-    exiting, st = False, time.perf_counter()
+    exiting, st, budget, out_of_budget = False, time.perf_counter(), getenv("BEAM_BUDGET_SEC", 0.0), False
+    cost_model = load_cost_model(fn) if (fn:=getenv("BEAM_COST_MODEL", "")) else None
     dev = Device[lin.opts.device]
     while not exiting:
-      acted_lins: List[Kernel] = flatten([get_kernel_actions(lin, include_0=False).values() for lin,_ in beam])
+      acted_lins: List[Kernel] = _dedup_lins(flatten([get_kernel_actions(lin, include_0=False).values() for lin,_ in beam]))
+      # with a cost model, only the candidates it ranks best get compiled and timed
+      if cost_model is not None and 0 < (topk:=getenv("BEAM_COST_TOPK", 16)) < len(acted_lins):
+        acted_lins = _rank_lins(acted_lins, cost_model, var_vals)[:topk]
       timed_lins: List[Tuple[Kernel, float]] = []
       _compile_fn = functools.partial(_try_compile_linearized_w_idx, compiler=dev.compiler)
       least_compute_ops = math.inf
-      for i,proc in (map(_compile_fn, enumerate(acted_lins)) if beam_pool is None else beam_pool.imap_unordered(_compile_fn, enumerate(acted_lins))):
+      compiled: Iterable[Tuple[int, Optional[Tuple[Program, bytes, float]]]]
+      if beam_pool is not None: compiled = beam_pool.imap_unordered(_compile_fn, enumerate(acted_lins))
+      elif getenv("BEAM_PIPELINE", default_pipeline):
+        compiled = _compile_pipelined(_compile_fn, list(enumerate(acted_lins)), getenv("BEAM_TIMEOUT_SEC", 10))
+      else: compiled = map(_compile_fn, enumerate(acted_lins))
+      for i,proc in compiled:
+        if budget and time.perf_counter() - st > budget:
+          out_of_budget = True
+          break
         if proc is None: continue
         p, lib, compile_et = proc
         if lib in seen_libs: continue
@@ -160,12 +247,20 @@ def beam_search(lin:Kernel, rawbufs:List[Buffer], amt:int, allow_test_size=True,
         try: tms = _time_program(p, lib, var_vals, rawbufs, early_stop=beam[0][1]*3 if len(beam) else 1.0, clear_l2=hasattr(dev, 'invalidate_caches'))
         except RuntimeError: continue # for runtime issues
         timed_lins.append((acted_lins[i], min(tms)))
+        if BEAM_COST_SAMPLES and CACHELEVEL >= 2:
+          _log_cost_sample(acted_lins[i], p, tms, var_vals)
         if BEAM_DEBUG > 1: print(f"{time.perf_counter() - st:7.2f}s: {i:5d} {len(cast(List, p.uops)):5d} uops {compile_et*1e6:12.2f} us compile/{timed_lins[-1][1]*1e6:12.2f} us run       {len(timed_lins):4d}/{len(acted_lins):4d}         {timed_lins[-1][0].colored_shape()}")  # noqa: E501
         elif DEBUG >= 2: print(f"\r{time.perf_counter() - st:7.2f}s: {timed_lins[-1][1]*1e6:12.2f} us       {len(timed_lins):4d}/{len(acted_lins):4d}         {timed_lins[-1][0].colored_shape()}\033[K", end="")  # noqa: E501
+      if out_of_budget:
+        # don't leave the compiles of this round running behind the next search
+        if beam_pool is not None:
+          beam_pool.terminate()
+          beam_pool = None
+        elif isinstance(compiled, Generator): compiled.close()
 
       # done
       opts = sorted(timed_lins, key=lambda x: x[1])
-      exiting = len(opts) == 0 or (opts[0][1] < min_progress) or (len(beam) > 0 and ((beam[0][1]-opts[0][1]) < min_progress))
+      exiting = out_of_budget or len(opts) == 0 or (opts[0][1] < min_progress) or (len(beam) > 0 and ((beam[0][1]-opts[0][1]) < min_progress))
       if not exiting: beam = opts[:amt]
       elif len(opts) > 0 and opts[0][1] < beam[0][1]: beam = opts[:1]
       if DEBUG >= 2: print(f"\r{time.perf_counter() - st:7.2f}s:", colored(f"{beam[0][1]*1e6:12.2f} us", "green" if exiting else None), f"from {len(acted_lins):3d} -> {len(opts):3d} actions\033[K", beam[0][0].colored_shape())  # noqa: E501
@@ -173,8 +268,10 @@ def beam_search(lin:Kernel, rawbufs:List[Buffer], amt:int, allow_test_size=True,
     if beam_pool is not None: beam_pool.terminate()
     raise e
 
-  if CACHELEVEL >= 1: diskcache_put("beam_search", key, beam[0][0].applied_opts)
-  if BEAM_DEBUG: print(f"BEAM_SEARCH: final tm={beam[0][1]*1e6:0.2f} us, applied_opts={beam[0][0].applied_opts}")
+  # a search cut short by the budget isn't cached, so a later search without a budget doesn't reuse it
+  if CACHELEVEL >= 1 and not out_of_budget: diskcache_put("beam_search", key, beam[0][0].applied_opts)
+  if BEAM_DEBUG:
+    print(f"BEAM_SEARCH: final tm={beam[0][1]*1e6:0.2f} us, applied_opts={beam[0][0].applied_opts}{' (out of budget)' if out_of_budget else ''}")
   return beam[0][0]
 
 def optimize_local_size(clprg:Callable, global_size:List[int], rawbufs:List[Buffer]) -> List[int]:
@@ -203,5 +300,7 @@ def time_linearizer(lin:Kernel, rawbufs:List[Buffer], allow_test_size=True, max_
   tms = _time_program(p, dev.compiler.compile(p.src), var_vals, rawbufs,
                       max_global_size=max_global_size if allow_test_size else None, clear_l2=clear_l2, cnt=cnt, name=to_function_name(lin.name))
 
-  if CACHELEVEL >= 2: diskcache_put("time_linearizer", key, tms)
+  if CACHELEVEL >= 2:
+    diskcache_put("time_linearizer", key, tms)
+    _log_cost_sample(lin, p, tms, var_vals)
   return min(tms)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 import os, functools, platform, time, re, contextlib, operator, hashlib, pickle, sqlite3, tempfile, pathlib, string, ctypes, sys, gzip
-import itertools, urllib.request, subprocess, shutil, math, json, contextvars
+import itertools, urllib.request, subprocess, shutil, math, json, contextvars, concurrent.futures, atexit
 from dataclasses import dataclass
 from typing import Dict, Tuple, Union, List, ClassVar, Optional, Iterable, Any, TypeVar, TYPE_CHECKING, Callable, Sequence
 if TYPE_CHECKING:  # TODO: remove this and import TypeGuard from typing once minimum python supported version is 3.10
@@ -109,8 +109,12 @@ WINO, CAPTURING, TRACEMETA = ContextVar("WINO", 0), ContextVar("CAPTURING", 1),
 GRAPH, GRAPHPATH, SAVE_SCHEDULE, RING = ContextVar("GRAPH", 0), getenv("GRAPHPATH", "/tmp/net"), ContextVar("SAVE_SCHEDULE", 0), ContextVar("RING", 1)
 MULTIOUTPUT, PROFILE, PROFILEPATH = ContextVar("MULTIOUTPUT", 1), ContextVar("PROFILE", 0), ContextVar("PROFILEPATH", temp("tinygrad_profile.json"))
 USE_TC, TC_OPT, AMX, TRANSCENDENTAL = ContextVar("TC", 1), ContextVar("TC_OPT", 0), ContextVar("AMX", 0), ContextVar("TRANSCENDENTAL", 1)
-FUSE_ARANGE, FUSE_CONV_BW = ContextVar("FUSE_ARANGE", 0), ContextVar("FUSE_CONV_BW", 0)
+FUSE_ARANGE, FUSE_CONV_BW, ONEPASS_VAR = ContextVar("FUSE_ARANGE", 1), ContextVar("FUSE_CONV_BW", 0), ContextVar("ONEPASS_VAR", 0)
 SPLIT_REDUCEOP, AST_REWRITE, NO_MEMORY_PLANNER = ContextVar("SPLIT_REDUCEOP", 1), ContextVar("AST_REWRITE", 1), ContextVar("NO_MEMORY_PLANNER", 0)
+CPU_THREADS, RUNNER_CACHE = ContextVar("CPU_THREADS", os.cpu_count() or 1), ContextVar("RUNNER_CACHE", 0)
+ARENA_PLANNER, ARENA_ALIGN = ContextVar("ARENA_PLANNER", 1), ContextVar("ARENA_ALIGN", 512)
+SCHEDULE_CACHE = ContextVar("SCHEDULE_CACHE", 256)
+FLASH_ATTENTION = ContextVar("FLASH_ATTENTION", -1)
 
 @dataclass(frozen=True)
 class Metadata:
@@ -132,8 +136,13 @@ class GlobalCounters:
   time_sum_s: ClassVar[float] = 0.0
   kernel_count: ClassVar[int] = 0
   mem_used: ClassVar[int] = 0   # NOTE: this is not reset
+  lru_hits: ClassVar[int] = 0
+  lru_misses: ClassVar[int] = 0
+  lru_evicted_bytes: ClassVar[int] = 0
   @staticmethod
-  def reset(): GlobalCounters.global_ops, GlobalCounters.global_mem, GlobalCounters.time_sum_s, GlobalCounters.kernel_count = 0,0,0.0,0
+  def reset():
+    GlobalCounters.global_ops, GlobalCounters.global_mem, GlobalCounters.time_sum_s, GlobalCounters.kernel_count = 0,0,0.0,0
+    GlobalCounters.lru_hits, GlobalCounters.lru_misses, GlobalCounters.lru_evicted_bytes = 0,0,0
 
 # **************** timer and profiler ****************
 
@@ -207,7 +216,7 @@ class ProfileLogger:
 
 _cache_dir: str = getenv("XDG_CACHE_HOME", os.path.expanduser("~/Library/Caches" if OSX else "~/.cache"))
 CACHEDB: str = getenv("CACHEDB", os.path.abspath(os.path.join(_cache_dir, "tinygrad", "cache.db")))
-CACHELEVEL = getenv("CACHELEVEL", 2)
+CACHELEVEL, CACHE_BATCH, CACHE_MAX_BYTES = getenv("CACHELEVEL", 2), getenv("CACHE_BATCH", 1), getenv("CACHE_MAX_BYTES", 0)
 
 VERSION = 16
 _db_connection = None
@@ -219,41 +228,107 @@ def db_connection():
     # another connection has set it already or is in the process of setting it
     # that connection will lock the database
     with contextlib.suppress(sqlite3.OperationalError): _db_connection.execute("PRAGMA journal_mode=WAL").fetchone()
+    # in WAL mode NORMAL only syncs on checkpoints, not on every commit. reads go through a shared memory map
+    _db_connection.execute("PRAGMA synchronous=NORMAL")
+    _db_connection.execute(f"PRAGMA mmap_size={getenv('CACHE_MMAP_SIZE', 1<<28)}")
     if DEBUG >= 7: _db_connection.set_trace_callback(print)
   return _db_connection
 
 def diskcache_clear():
+  _db_pending.clear()
+  _db_touched.clear()
   cur = db_connection().cursor()
   drop_tables = cur.execute("SELECT 'DROP TABLE IF EXISTS ' || quote(name) || ';' FROM sqlite_master WHERE type = 'table';").fetchall()
   cur.executescript("\n".join([s[0] for s in drop_tables]))
 
+# puts that aren't committed yet and the access times of gets, both are written in one transaction by diskcache_flush
+_db_pending: Dict[Tuple[str, Tuple], bytes] = {}
+_db_touched: Dict[Tuple[str, Tuple], int] = {}
+
 def diskcache_get(table:str, key:Union[Dict, str, int]) -> Any:
   if CACHELEVEL == 0: return None
   if isinstance(key, (str,int)): key = {"key": key}
+  if (pending:=_db_pending.get((table, tuple(key.items())))) is not None: return pickle.loads(pending)
   conn = db_connection()
   cur = conn.cursor()
   try:
     res = cur.execute(f"SELECT val FROM '{table}_{VERSION}' WHERE {' AND '.join([f'{x}=?' for x in key.keys()])}", tuple(key.values()))
   except sqlite3.OperationalError:
     return None  # table doesn't exist
-  if (val:=res.fetchone()) is not None: return pickle.loads(val[0])
+  if (val:=res.fetchone()) is not None:
+    # access times are only needed to prune, so read only users don't write at exit
+    if CACHE_MAX_BYTES: _db_touched[(table, tuple(key.items()))] = int(time.time())
+    return pickle.loads(val[0])
   return None
 
 _db_tables = set()
 def diskcache_put(table:str, key:Union[Dict, str, int], val:Any):
   if CACHELEVEL == 0: return val
   if isinstance(key, (str,int)): key = {"key": key}
+  _db_pending[(table, tuple(key.items()))] = pickle.dumps(val)
+  if len(_db_pending) >= CACHE_BATCH: diskcache_flush()
+  return val
+
+def _db_add_atime(cur:sqlite3.Cursor, name:str):
+  # tables written before access times were tracked get the column in place, so they stay readable by every tinygrad of this VERSION
+  if "atime" not in [col[1] for col in cur.execute(f"PRAGMA table_info('{name}')").fetchall()]:
+    cur.execute(f"ALTER TABLE '{name}' ADD COLUMN atime integer")
+
+def diskcache_flush():
+  if not _db_pending and not _db_touched: return
   conn = db_connection()
   cur = conn.cursor()
-  if table not in _db_tables:
-    TYPES = {str: "text", bool: "integer", int: "integer", float: "numeric", bytes: "blob"}
-    ltypes = ', '.join(f"{k} {TYPES[type(key[k])]}" for k in key.keys())
-    cur.execute(f"CREATE TABLE IF NOT EXISTS '{table}_{VERSION}' ({ltypes}, val blob, PRIMARY KEY ({', '.join(key.keys())}))")
-    _db_tables.add(table)
-  cur.execute(f"REPLACE INTO '{table}_{VERSION}' ({', '.join(key.keys())}, val) VALUES ({', '.join(['?']*len(key.keys()))}, ?)", tuple(key.values()) + (pickle.dumps(val), ))  # noqa: E501
+  now = int(time.time())
+  for (table, items),val in _db_pending.items():
+    key = dict(items)
+    if table not in _db_tables:
+      TYPES = {str: "text", bool: "integer", int: "integer", float: "numeric", bytes: "blob"}
+      ltypes = ', '.join(f"{k} {TYPES[type(key[k])]}" for k in key.keys())
+      cur.execute(f"CREATE TABLE IF NOT EXISTS '{table}_{VERSION}' ({ltypes}, val blob, atime integer, PRIMARY KEY ({', '.join(key.keys())}))")
+      _db_add_atime(cur, f"{table}_{VERSION}")
+      _db_tables.add(table)
+    cur.execute(f"REPLACE INTO '{table}_{VERSION}' ({', '.join(key.keys())}, val, atime) VALUES ({', '.join(['?']*len(key.keys()))}, ?, ?)", tuple(key.values()) + (val, now))  # noqa: E501
+  for (table, items),atime in _db_touched.items():
+    # the table can be gone if it was cleared in the meantime
+    with contextlib.suppress(sqlite3.OperationalError):
+      if table not in _db_tables:
+        _db_add_atime(cur, f"{table}_{VERSION}")
+        _db_tables.add(table)
+      cur.execute(f"UPDATE '{table}_{VERSION}' SET atime=? WHERE {' AND '.join([f'{x}=?' for x,_ in items])}", (atime,) + tuple(v for _,v in items))
   conn.commit()
   cur.close()
-  return val
+  _db_pending.clear()
+  _db_touched.clear()
+
+def diskcache_prune(max_bytes:int) -> int:
+  """
+  Deletes the least recently used entries of this VERSION until they take at most `max_bytes`, returns the number of bytes freed.
+  Tables of other VERSIONs can belong to another tinygrad sharing the cache, they are left alone.
+  """
+  diskcache_flush()
+  conn = db_connection()
+  cur = conn.cursor()
+  freed = 0
+  tables = [name for (name,) in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall() if name.endswith(f"_{VERSION}")]
+  for name in tables: _db_add_atime(cur, name)
+  entries = sorted([(atime or 0, name, rowid, sz) for name in tables
+                    for rowid,atime,sz in cur.execute(f"SELECT rowid, atime, LENGTH(val) FROM '{name}'").fetchall()])
+  total = sum(x[3] for x in entries)
+  for _,name,rowid,sz in entries:
+    if total <= max_bytes: break
+    cur.execute(f"DELETE FROM '{name}' WHERE rowid=?", (rowid,))
+    total, freed = total-sz, freed+sz
+  conn.commit()
+  cur.close()
+  return freed
+
+@atexit.register
+def _diskcache_exit():
+  if _db_connection is None and not _db_pending: return
+  # another process can hold the lock, losing the last writes of this one is fine
+  with contextlib.suppress(sqlite3.OperationalError):
+    diskcache_flush()
+    if CACHE_MAX_BYTES: diskcache_prune(CACHE_MAX_BYTES)
 
 def diskcache(func):
   def wrapper(*args, **kwargs) -> bytes:
@@ -304,6 +379,27 @@ def cpu_time_execution(cb, enable):
   cb()
   if enable: return time.perf_counter()-st
 
+_cpu_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+def _cpu_worker(cb, start:int, end:int) -> float:
+  st = time.perf_counter()
+  for core_id in range(start, end): cb(core_id)
+  return time.perf_counter()-st
+
+def cpu_threaded_execution(cb, threads:int, enable):
+  # runs cb(core_id) for every core_id in range(threads), split into contiguous chunks over a persistent pool of CPU_THREADS workers
+  global _cpu_pool
+  if _cpu_pool is None or _cpu_pool._max_workers != CPU_THREADS.value:
+    _cpu_pool = concurrent.futures.ThreadPoolExecutor(max_workers=CPU_THREADS.value, thread_name_prefix="tinygrad_cpu")
+  workers = max(1, min(threads, CPU_THREADS.value))
+  bounds = [threads*i//workers for i in range(workers+1)]
+  if enable or DEBUG >= 2: st = time.perf_counter()
+  futures = [_cpu_pool.submit(_cpu_worker, cb, s, e) for s,e in zip(bounds[1:-1], bounds[2:])]
+  busy = [_cpu_worker(cb, bounds[0], bounds[1])] + [f.result() for f in futures]
+  if enable or DEBUG >= 2: et = time.perf_counter()-st
+  if DEBUG >= 2: print(f"  cpu {threads:4d} threads on {workers:3d} cores, utilization {sum(busy)/(workers*et)*100:5.1f}% [" +
+                       ' '.join(f"{b/et*100:3.0f}" for b in busy) + "]")
+  if enable: return et
+
 def cpu_objdump(lib, objdump_tool='objdump'):
   with tempfile.NamedTemporaryFile(delete=True) as f:
     pathlib.Path(f.name).write_bytes(lib)
@@ -324,6 +420,11 @@ def init_c_struct_t(fields: Tuple[Tuple[str, ctypes._SimpleCData], ...]):
   return CStruct
 def init_c_var(ctypes_var, creat_cb): return (creat_cb(ctypes_var), ctypes_var)[1]
 def flat_mv(mv:memoryview): return mv if len(mv) == 0 else mv.cast("B", shape=(mv.nbytes,))
+def pin_mv(mv:memoryview, owner:Any) -> memoryview:
+  # the returned memoryview (and anything made from it, like a numpy array) keeps owner alive
+  if len(mv) == 0 or mv.readonly: return mv
+  (arr:=(ctypes.c_uint8 * len(mv)).from_buffer(mv))._owner = owner  # type: ignore[attr-defined]
+  return memoryview(arr).cast("B")
 
 # *** tqdm
 
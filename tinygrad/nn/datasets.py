@@ -1,4 +1,9 @@
-from tinygrad.tensor import Tensor
+import os, random, threading, queue, contextlib, collections, weakref
+from multiprocessing import Process, Queue, Event, shared_memory
+from typing import Iterable, Iterator, Optional, List, Tuple, Dict, Callable, Any, cast
+import numpy as np
+from tinygrad.tensor import Tensor, _from_np_dtype, _to_np_dtype
+from tinygrad.dtype import DType
 from tinygrad.helpers import fetch
 from tinygrad.nn.state import tar_extract
 
@@ -12,3 +17,188 @@ def cifar(device=None):
   train = Tensor.cat(*[tt[f"cifar-10-batches-bin/data_batch_{i}.bin"].reshape(-1, 3073).to(device) for i in range(1,6)])
   test = tt["cifar-10-batches-bin/test_batch.bin"].reshape(-1, 3073).to(device)
   return train[:, 1:].reshape(-1,3,32,32), train[:, 0], test[:, 1:].reshape(-1,3,32,32), test[:, 0]
+
+def _to_device(x:Any, device:Optional[str], out:List[Tensor]) -> Any:
+  if isinstance(x, (tuple, list)): return type(x)(_to_device(y, device, out) for y in x)
+  out.append(ret:=x.to(device) if isinstance(x, Tensor) else Tensor(x, device=device))
+  return ret
+
+def prefetch(batches:Iterable, device:Optional[str]=None, depth:int=2) -> Iterator:
+  """
+  Yields the numpy arrays (or tuples of them) from `batches` as realized Tensors on `device`.
+
+  `batches` is iterated on a thread up to `depth` batches ahead, so loading the next batch overlaps with the step.
+  tinygrad isn't thread safe, so iterating it must not build Tensors. A DataLoader only fills its ring on the thread.
+  The copy of a batch is issued when it's asked for, after the step using the one before it is queued.
+  On HCQ devices the host side of it (into the staging buffers) runs while that step does, the device copy follows it on the timeline.
+  """
+  # the DataLoader ring and its Tensors are made here, only the wait on its workers is on the thread
+  host, wrap = (batches._load(), batches._batch) if isinstance(batches, DataLoader) else (iter(batches), None)
+  q: queue.Queue = queue.Queue(depth)
+  stop, done = threading.Event(), object()
+  def worker():
+    try:
+      for x in host:
+        if stop.is_set(): break
+        q.put(x)
+    except Exception as e: q.put(e)
+    q.put(done)
+  (t:=threading.Thread(target=worker, daemon=True)).start()
+  try:
+    while (x:=q.get()) is not done:
+      if isinstance(x, Exception): raise x
+      if wrap is not None: x = wrap(*x)
+      ts: List[Tensor] = []
+      ret = _to_device(x, device, ts)
+      if ts: Tensor.realize(*ts)
+      del x
+      yield ret
+  finally:
+    stop.set()
+    while t.is_alive() or not q.empty():
+      with contextlib.suppress(queue.Empty):
+        # batches the thread loaded that were never wrapped give their slot back
+        if (x:=q.get(timeout=0.1)) is not done and wrap is not None and not isinstance(x, Exception): cast(DataLoader, batches)._free.append(x[0])
+
+# **************** DataLoader ****************
+
+def _fields(x:Any) -> Tuple[np.ndarray, ...]: return tuple(np.asarray(y) for y in x) if isinstance(x, (tuple, list)) else (np.asarray(x),)
+
+def _open_ring(specs:List[Tuple[str, Tuple[int, ...], DType]]) -> Tuple[List[Tensor], List[np.ndarray]]:
+  # the ring is opened through the DISK device in every process, so the numpy arrays workers write are the memory the Tensors view
+  ts = [Tensor.empty(*shape, dtype=dtype, device=f"disk:shm:{name}").realize() for name,shape,dtype in specs]
+  return ts, [np.frombuffer(t.lazydata.base.realized.as_buffer(force_zero_copy=True), dtype=_to_np_dtype(t.dtype)).reshape(t.shape) for t in ts]
+
+def _load_samples(dataset, transform:Optional[Callable], ring:List[np.ndarray], seed:Optional[int], epoch:int, row:int, idxs:np.ndarray):
+  for i,idx in enumerate(idxs.tolist()):
+    if seed is not None:
+      # reseed per sample, random transforms don't depend on which worker loaded it
+      random.seed(s:=hash((seed, epoch, idx)) % 2**32)
+      np.random.seed(s)
+    x = dataset[idx]
+    for arr,y in zip(ring, _fields(transform(x) if transform is not None else x)): arr[row+i] = y
+
+def _loader_process(q_in, q_out, stop, dataset, transform:Optional[Callable], specs, seed:Optional[int]):
+  import signal
+  signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent shuts the workers down
+  _, ring = _open_ring(specs)
+  while (task:=q_in.get()) is not None:
+    epoch, slot, row, idxs = task
+    if stop.is_set(): continue
+    try:
+      _load_samples(dataset, transform, ring, seed, epoch, row, idxs)
+      q_out.put((slot, len(idxs), None))
+    except Exception as e: q_out.put((slot, 0, e))
+  q_out.put(None)
+
+def _get(q_out, procs:List[Process]):
+  while True:
+    try: return q_out.get(timeout=0.1)
+    except queue.Empty:
+      if (dead:=[p for p in procs if not p.is_alive()]): raise RuntimeError(f"DataLoader worker exited with code {dead[0].exitcode}")
+
+def _release(free:collections.deque, refs:List[int], slot:int):
+  refs.pop()
+  if not refs: free.append(slot)
+
+def _unlink(shms:List[shared_memory.SharedMemory]):
+  for shm in shms:
+    with contextlib.suppress(FileNotFoundError): shm.unlink()
+
+class DataLoader:
+  """
+  Loads `dataset[i]` (numpy arrays, or tuples of them) in batches of `batch_size` on `num_workers` processes, `cpu_count()` by default.
+
+  Workers write the samples, after `transform`, straight into a shared memory ring of `depth` batches.
+  Batches are yielded as Tensors on the DISK device that view the ring, use `.to(device)` or `prefetch` to move them.
+  A batch's slot in the ring is refilled once its Tensors, and anything not yet realized that was computed from them, are freed.
+  `shuffle` draws a new order every epoch. With a `seed` that order, and `random`/`np.random` in `transform`, are deterministic.
+  """
+  def __init__(self, dataset, batch_size:int, num_workers:Optional[int]=None, shuffle:bool=False, seed:Optional[int]=None,
+               transform:Optional[Callable]=None, drop_last:bool=False, depth:int=4):
+    assert batch_size > 0 and depth > 1, f"need a positive batch size and a ring of at least two batches, got {batch_size=} {depth=}"
+    self.dataset, self.batch_size, self.shuffle, self.seed, self.transform = dataset, batch_size, shuffle, seed, transform
+    self.num_workers = (os.cpu_count() or 1) if num_workers is None else num_workers
+    self.drop_last, self.depth, self.epoch = drop_last, depth, 0
+    self.ring: Optional[List[Tensor]] = None
+
+  def __len__(self) -> int: return len(self.dataset) // self.batch_size if self.drop_last else -(-len(self.dataset) // self.batch_size)
+
+  def _alloc_ring(self) -> List[Tensor]:
+    first = self.transform(self.dataset[0]) if self.transform is not None else self.dataset[0]
+    self._tuple, sample = isinstance(first, (tuple, list)), _fields(first)
+    self._shms = [shared_memory.SharedMemory(create=True, size=max(1, self.depth*self.batch_size*x.nbytes)) for x in sample]
+    for shm in self._shms: shm.close()
+    self._specs = [(shm.name, (self.depth*self.batch_size, *x.shape), _from_np_dtype(x.dtype)) for shm,x in zip(self._shms, sample)]
+    self._free: collections.deque = collections.deque(range(self.depth))
+    self.ring, self._arrays = _open_ring(self._specs)
+    self._closer = weakref.finalize(self, _unlink, self._shms)
+    return self.ring
+
+  def close(self):
+    """Unlinks the shared memory of the ring. The mapping stays open in this process for the Tensors that still view it."""
+    if self.ring is not None: self._closer()
+
+  def __iter__(self) -> Iterator:
+    for slot,cnt in self._load(): yield self._batch(slot, cnt)
+
+  def _batch(self, slot:int, cnt:int) -> Any:
+    ts = tuple(t[slot*self.batch_size:slot*self.batch_size+cnt] for t in cast(List[Tensor], self.ring))
+    refs = [0]*len(ts)
+    for t in ts: weakref.finalize(t.lazydata, _release, self._free, refs, slot)
+    return ts if self._tuple else ts[0]
+
+  def _load(self) -> Iterator[Tuple[int, int]]:
+    # the ring is made before the generator starts, the generator only touches numpy and the worker queues so prefetch can run it on its thread
+    if self.ring is None: self._alloc_ring()
+    self.epoch += 1
+    return self._load_epoch(self.epoch-1)
+
+  def _load_epoch(self, epoch:int) -> Iterator[Tuple[int, int]]:
+    # yields (slot, count) once a batch is in the ring, the slot is the caller's until it's passed to _batch or back to _free
+    n, bs = len(self.dataset), self.batch_size
+    order = np.random.default_rng(None if self.seed is None else (self.seed, epoch)).permutation(n) if self.shuffle else np.arange(n)
+    batches = [order[i:i+bs] for i in range(0, len(self)*bs, bs)]
+    chunk = -(-bs // max(1, self.num_workers))
+
+    q_in: Queue = Queue()
+    q_out: Queue = Queue()
+    stop = Event()
+    procs = [Process(target=_loader_process, args=(q_in, q_out, stop, self.dataset, self.transform, self._specs, self.seed), daemon=True)
+             for _ in range(self.num_workers)]
+    for p in procs: p.start()
+
+    nxt, slot_of, left = 0, cast(Dict[int, int], {}), [0]*self.depth
+    def fill():
+      nonlocal nxt
+      while nxt < len(batches) and self._free:
+        slot_of[nxt] = slot = self._free.popleft()
+        left[slot] = len(idxs:=batches[nxt])
+        if procs:
+          for i in range(0, len(idxs), chunk): q_in.put((epoch, slot, slot*bs+i, idxs[i:i+chunk]))
+        nxt += 1
+
+    try:
+      for b in range(len(batches)):
+        fill()
+        if b not in slot_of: raise RuntimeError(f"all {self.depth} batches in the ring are still referenced, free them or raise depth")
+        slot = slot_of.pop(b)
+        if not procs: _load_samples(self.dataset, self.transform, self._arrays, self.seed, epoch, slot*bs, batches[b])
+        else:
+          while left[slot]:
+            s, cnt, err = _get(q_out, procs)
+            if err is not None: raise err
+            left[s] -= cnt
+        yield slot, len(batches[b])
+    finally:
+      # workers skip the tasks left in the queue once stop is set, each one acks its None
+      stop.set()
+      for _ in procs: q_in.put(None)
+      done = 0
+      while done < len(procs) and any(p.is_alive() for p in procs):
+        with contextlib.suppress(queue.Empty): done += q_out.get(timeout=0.1) is None
+      for p in procs: p.join()
+      q_in.cancel_join_thread()
+      q_in.close()
+      q_out.close()
+      self._free.extend(slot_of.values())
@@ -1,6 +1,8 @@
 import os, json, pathlib, zipfile, pickle, tarfile, struct
-from typing import Dict, Union, List, Optional, Any, Tuple
+from typing import Dict, Union, List, Optional, Any, Tuple, cast
 from tinygrad.tensor import Tensor
+from tinygrad.device import Device, Buffer
+from tinygrad.lazy import LazyBuffer
 from tinygrad.dtype import dtypes
 from tinygrad.helpers import prod, argsort, DEBUG, Timing, CI, unwrap, GlobalCounters, tqdm
 from tinygrad.shape.view import strides_for_shape
@@ -35,6 +37,41 @@ def safe_load(fn:Union[Tensor,str]) -> Dict[str, Tensor]:
     ret[k] = t[8+json_len+v['data_offsets'][0]:8+json_len+v['data_offsets'][0]+sz].bitcast(dtype).reshape(v['shape'])
   return ret
 
+def safe_load_bulk(fn:str, device:Optional[str]=None, verbose=True) -> Dict[str, Tensor]:
+  """
+  Loads a .safetensor file, or all the shards in a `model.safetensors.index.json`, into realized Tensors on `device`.
+  The reads are planned in file offset order and go through one io_uring queue across all files when the device supports it.
+
+  ```python
+  state_dict = nn.state.safe_load_bulk("model.safetensors.index.json")
+  ```
+  """
+  if fn.endswith(".json"):
+    with open(fn) as fp: files = [str(pathlib.Path(fn).parent / x) for x in sorted(set(json.load(fp)['weight_map'].values()))]
+  else: files = [fn]
+  device = Device.canonicalize(device)
+  # (file, offset in file, name, disk tensor) for every tensor
+  plan: List[Tuple[int, int, str, Tensor]] = []
+  disk_bufs: List[Optional[Buffer]] = []
+  for i,f in enumerate(files):
+    t, json_len, metadata = safe_load_metadata(f)
+    disk_bufs.append(cast(LazyBuffer, t.lazydata).base.realized)
+    plan += [(i, 8+json_len+metadata[k]['data_offsets'][0], k, v) for k,v in safe_load(t).items()]
+  plan = sorted(plan, key=lambda x: x[:2])
+  total = sum(x[3].nbytes() for x in plan)
+  with Timing("loaded weights in ", lambda et_ns: f", {total/1e9:.2f} GB from {len(files)} files at {total/et_ns:.2f} GB/s", enabled=verbose):
+    dalloc = Device[device].allocator
+    if hasattr(dalloc, 'copy_from_disk_many') and all(b is not None and hasattr(Device[b.device], 'io_uring') and hasattr(Device[b.device], 'fd')
+                                                      for b in disk_bufs):
+      ret = {k:Tensor.empty(*dt.shape, dtype=dt.dtype, device=device) for _,_,k,dt in plan}
+      Tensor.realize(*ret.values())
+      dalloc.copy_from_disk_many([(cast(Buffer, cast(LazyBuffer, ret[k].lazydata).base.realized)._buf,
+                                   cast(Buffer, disk_bufs[i]).view(dt.nbytes(), dtypes.uint8, off).ensure_allocated()._buf, dt.nbytes())
+                                  for i,off,k,dt in plan if dt.nbytes() > 0])
+      Device[device].synchronize()
+    else: ret = {k:dt.to(device).realize() for _,_,k,dt in plan}
+  return ret
+
 def safe_save(tensors:Dict[str, Tensor], fn:str, metadata:Optional[Dict[str, Any]]=None):
   """
   Saves a state_dict to disk in a .safetensor file with optional metadata.
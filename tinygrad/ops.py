@@ -1,6 +1,6 @@
 from __future__ import annotations
-from typing import Any, List, Optional, Set, Union, Tuple, Dict, Callable, cast, TYPE_CHECKING, TypeVar, DefaultDict
-import sys, time, functools, itertools, math, operator, hashlib
+from typing import Any, List, Optional, Set, Union, Tuple, Dict, Callable, cast, TYPE_CHECKING, TypeVar, DefaultDict, Iterator
+import sys, time, functools, itertools, math, operator, hashlib, weakref
 from enum import auto, IntEnum, Enum
 from collections import defaultdict
 from dataclasses import dataclass, field
@@ -136,7 +136,24 @@ BUFFER_UOPS = {UOps.LOAD, UOps.STORE, UOps.VALID}
 COMMUTATIVE = {BinaryOps.ADD, BinaryOps.MUL, BinaryOps.MAX, BinaryOps.CMPNE, BinaryOps.XOR, BinaryOps.AND, BinaryOps.OR}
 END_FOR_UOP = {UOps.IF:(UOps.STORE, UOps.ENDIF), UOps.RANGE:(UOps.ASSIGN, UOps.ENDRANGE)}
 
-class UOp(MathTrait):
+def _arg_key(x:Any) -> Any:
+  # args that compare equal but aren't the same: -0.0 and 0.0, 1 and True
+  if x.__class__ is float: return (x, math.copysign(1.0, x))
+  if x.__class__ is tuple: return tuple(_arg_key(y) for y in x)
+  return (x.__class__, x)
+
+class UOpMetaClass(type):
+  ucache: weakref.WeakValueDictionary[Tuple, UOp] = weakref.WeakValueDictionary()
+  def __call__(cls, op:UOps, dtype:DType=dtypes.void, src:Tuple[UOp,...]=tuple(), arg:Any=None):
+    # identical (op, dtype, src, arg) is always the same UOp. PtrDType == DType ignores local, so the dtype class and local are in the key
+    key = (op, dtype, dtype.__class__, getattr(dtype, "local", False), src, _arg_key(arg))
+    try:
+      if (ret:=UOpMetaClass.ucache.get(key)) is not None: return ret
+    except TypeError: return super().__call__(op, dtype, src, arg)  # unhashable arg
+    UOpMetaClass.ucache[key] = ret = super().__call__(op, dtype, src, arg)
+    return ret
+
+class UOp(MathTrait, metaclass=UOpMetaClass):
   __slots__ = ["op", "dtype", "src", "arg"]
   def __init__(self, op: UOps, dtype:DType=dtypes.void, src: Tuple[UOp,...]=tuple(), arg:Any=None):
     # TODO: instant check rules here make debugging easier
@@ -145,6 +162,7 @@ class UOp(MathTrait):
     #if op is UOps.ALU and arg not in (BinaryOps.CMPNE, BinaryOps.CMPLT, TernaryOps.WHERE): assert all_same([dtype] + [x.dtype for x in src])
     #if op is UOps.CAST: assert dtype.count == src[0].dtype.count, f"cast can't change vectorization {src[0].dtype} --> {dtype}"
     self.op, self.dtype, self.src, self.arg = op, dtype, src, arg
+  def __reduce__(self): return UOp, (self.op, self.dtype, self.src, self.arg)
   def replace(self, op: Optional[UOps]=None, dtype:Optional[DType]=None, src: Optional[Tuple[UOp,...]]=None, arg:Any=None):
     return UOp(op or self.op, dtype or self.dtype, self.src if src is None else src, self.arg if arg is None else arg)
   @property
@@ -291,6 +309,7 @@ class KernelInfo:
   local_dims: int = 0           # number of local dimensions  (this is remapping RANGE to SPECIAL)
   upcasted: int = 0             # count that are upcasted     (this is remapping RANGE to EXPAND)
   dont_use_locals: bool = False # don't use local indexing
+  threaded: bool = False        # first global dim is run across CPU threads (this is remapping RANGE to SPECIAL)
 
 # ***** ops in python *****
 
@@ -462,9 +481,103 @@ class UPatAny(UPat):
       if (match:=x.match(uop, store.copy())): return match
     return []
 
+# *** compiled UPat matching ***
+
+UPAT_COMPILE = ContextVar("UPAT_COMPILE", 0)
+REWRITE_CACHE = ContextVar("REWRITE_CACHE", 16384)
+class UPatCompileError(Exception): pass
+
+def _upat_code(p:UPat, var:str, bound:Dict[str, str], cont:Callable[[Dict[str, str], int], List[str]], ind:int, fail:str,
+               consts:Dict[str, Any], cnt:Iterator[int]) -> List[str]:
+  """lines matching `var` against `p`, then running `cont`. every branch ends in a return or in `fail`, choice points are one-shot loops"""
+  def const(x) -> str:
+    name = f"c{len(consts)}"
+    consts[name] = x
+    return name
+  sp = " "*ind
+  if isinstance(p, UPatAny):
+    # the first alternative that matches is the only one tried
+    lines, flag = [], f"a{next(cnt)}"
+    lines.append(f"{sp}{flag} = False")
+    for i,alt in enumerate(p.src[0]):
+      if i != 0: lines.append(f"{sp}if not {flag}:")
+      aind = ind + (i != 0)
+      lines.append(f"{' '*aind}for _ in ONCE:")
+      lines += _upat_code(alt, var, bound, lambda b,i: [f"{' '*i}{flag} = True"]+cont(b,i), aind+1, "continue", consts, cnt)
+    return lines+[f"{sp}{fail}"]
+  conds = []
+  if p.name is not None:
+    if p.name in bound: conds.append(f"{var} is {bound[p.name]}")
+    else: bound = {**bound, p.name:var}
+  if p.op is not None: conds.append(f"{var}.op is {const(p.op[0])}" if len(p.op) == 1 else f"{var}.op in {const(frozenset(p.op))}")
+  if p.dtype is not None: conds.append(f"{var}.dtype in {const(p.dtype)}")
+  if p.arg is not None: conds.append(f"not ({const(p.arg)} != {var}.arg)")
+  if p.allowed_len != -1: conds.append(f"len({var}.src) == {p.allowed_len}")
+  lines = [f"{sp}if not ({' and '.join(conds)}): {fail}"] if conds else []
+  if p.src is None: return lines+cont(bound, ind)
+  if isinstance(p.src[0], itertools.repeat):
+    q = next(p.src[0])
+    # without names every src is matched on its own
+    if all(y.name is None for y in _upat_walk(q)):
+      lines.append(f"{sp}if not all({const(q)}.match(x, {{}}) for x in {var}.src): {fail}")
+      return lines+cont(bound, ind)
+    # the first src binds the names, the rest are matched in a loop. q has at most one match here
+    k = next(cnt)
+    lines += [f"{sp}if len({var}.src) == 0:"]+cont(bound, ind+1)+[f"{sp}x{k} = {var}.src[0]"]
+    def rest(b:Dict[str, str], rind:int) -> List[str]:
+      return [f"{' '*rind}for r{k} in {var}.src[1:]:"]+_upat_code(q, f"r{k}", b, lambda _,i: [f"{' '*i}continue"], rind+1, "break", consts, cnt)+\
+             [f"{' '*rind}else:"]+cont(b, rind+1)+[f"{' '*rind}{fail}"]
+    return lines+_upat_code(q, f"x{k}", bound, rest, ind, fail, consts, cnt)
+  def chain(vp:Tuple[UPat, ...], i:int, b:Dict[str, str], cind:int, cfail:str) -> List[str]:
+    if i == len(vp): return cont(b, cind)
+    if (k:=next(cnt)) > 2000: raise UPatCompileError("pattern too large to compile")
+    lines = [f"{' '*cind}x{k} = {var}.src[{i}]"]
+    # src is zipped, with allow_any_len the uop can have fewer srcs than the pattern
+    if p.allowed_len == -1: lines = [f"{' '*cind}if len({var}.src) <= {i}:"]+cont(b, cind+1)+lines
+    return lines+_upat_code(vp[i], f"x{k}", b, lambda b2,ci: chain(vp, i+1, b2, ci, cfail), cind, cfail, consts, cnt)
+  if len(p.src) == 1: return lines+chain(p.src[0], 0, bound, ind, fail)
+  for vp in p.src:
+    lines.append(f"{sp}for _ in ONCE:")
+    lines += chain(vp, 0, bound, ind+1, "continue")
+  return lines+[f"{sp}{fail}"]
+
+def _upat_walk(p:UPat) -> List[UPat]:
+  if p.src is None: return [p]
+  return [p]+[y for vp in p.src for x in ([next(vp)] if isinstance(vp, itertools.repeat) else vp) for y in _upat_walk(x)]
+
+@functools.lru_cache(None)
+def compile_upat(p:UPat) -> Callable[[UOp], Optional[Dict[str, UOp]]]:
+  """returns a function that gives the first match of `p.match(uop, {})` or None, specialized to the pattern in generated python"""
+  def interpret(uop:UOp) -> Optional[Dict[str, UOp]]:
+    if not p.early_reject.issubset(set([v for u in uop.src for v in ((u.op, u.arg), (u.op, None))])): return None
+    return m[0] if (m:=p.match(uop, {})) else None
+  # repeats that bind names and can match more than one way stay in the interpreter
+  def named_choice(q:UPat) -> bool:
+    walk = _upat_walk(q)
+    return any(y.name is not None for y in walk) and any(isinstance(y, UPatAny) or (y.src is not None and len(y.src) > 1) for y in walk)
+  if any(named_choice(next(vp)) for x in _upat_walk(p) for vp in (x.src or []) if isinstance(vp, itertools.repeat)): return interpret
+  consts: Dict[str, Any] = {"ONCE": (None,)}
+  lines = ["def match(x0):"]
+  # early_reject is implied by the pattern, unless it's custom or not all srcs are matched
+  implied = set((pp.op[0], pp.arg) for pp in ([] if p.src is None else [next(p.src[0])] if isinstance(p.src[0], itertools.repeat) else p.src[0])
+                if pp.op is not None and len(pp.op) == 1)
+  if p.early_reject and (p.allowed_len == -1 or p.early_reject != implied):
+    consts["ER"] = p.early_reject
+    lines.append(" if not ER.issubset(set([v for u in x0.src for v in ((u.op, u.arg), (u.op, None))])): return None")
+  try:
+    lines += _upat_code(p, "x0", {}, lambda b,i: [f"{' '*i}return {{{', '.join(f'{k!r}:{v}' for k,v in b.items())}}}"], 1, "return None", consts,
+                        itertools.count(1))
+    exec(compile("\n".join(lines), f"<upat {p.location[0]}:{p.location[1]}>", "exec"), consts)
+  except (UPatCompileError, SyntaxError): return interpret  # python also limits the number of nested loops
+  return consts["match"]
+
 class PatternMatcher:
-  def __init__(self, patterns:List[Tuple[UPat, Callable]]):
+  def __init__(self, patterns:List[Tuple[UPat, Callable]], cache:bool=False):
     self.patterns = patterns
+    # cache=True means the rewrites only depend on the UOp, so graph_rewrite results are kept across calls
+    self.cache = cache
+    self.rewrite_cache: Dict[UOp, UOp] = {}
+    self.compiled = bool(UPAT_COMPILE)
     self.pdict: DefaultDict[Tuple[UOps, Any], List[Tuple[UPat, Callable, Set]]] = defaultdict(list)
     # uop is required, arg is optional
     for p,fxn in self.patterns:
@@ -472,9 +585,18 @@ class PatternMatcher:
       for uop in p.op: self.pdict[(uop, p.arg)].append((p, fxn, p.early_reject))
 
   @functools.lru_cache(None)  # pylint: disable=method-cache-max-size-none
-  def __add__(self, more:PatternMatcher): return PatternMatcher(self.patterns+more.patterns)
+  def __add__(self, more:PatternMatcher): return PatternMatcher(self.patterns+more.patterns, self.cache and more.cache)
+
+  @functools.cached_property
+  def cdict(self) -> Dict[Tuple[UOps, Any], List[Tuple[Callable, Callable]]]:
+    # same order as rewrite: patterns for the arg, then the ones for any arg
+    return {k:[(compile_upat(p), fxn) for p,fxn,_ in v+(self.pdict.get((k[0], None), []) if k[1] is not None else [])] for k,v in self.pdict.items()}
 
   def rewrite(self, uop:UOp, ctx=None) -> Optional[UOp]:
+    if self.compiled:
+      for match,fxn in self.cdict.get((uop.op, uop.arg)) or self.cdict.get((uop.op, None), []):
+        if (store:=match(uop)) is not None and (ret:=(fxn(ctx, **store) if ctx is not None else fxn(**store))) is not None: return ret
+      return None
     ler = set([v for u in uop.src for v in ((u.op, u.arg), (u.op, None))])
     for p,fxn,early_reject in self.pdict[(uop.op, uop.arg)] + ([] if uop.arg is None else self.pdict[(uop.op, None)]):
       if not early_reject.issubset(ler): continue
@@ -493,8 +615,8 @@ class TrackedRewriteContext:
   rewrites: List[Tuple[UOp, UOp, UPat]] = field(default_factory=list)     # all rewrites of sparents. (before, after, UPat)
 contexts: List[TrackedRewriteContext] = []
 class TrackedPatternMatcher(PatternMatcher):
-  def __init__(self, patterns:List[Tuple[UPat, Callable]]):
-    super().__init__(patterns)
+  def __init__(self, patterns:List[Tuple[UPat, Callable]], cache:bool=False):
+    super().__init__(patterns, cache)
     for p,_ in self.patterns:
       if p not in match_stats: match_stats[p] = [0,0,0.0,0.0]
 
@@ -542,15 +664,23 @@ class RewriteContext:
   def __init__(self, pm, ctx):
     self.pm: PatternMatcher = pm
     self.ctx = ctx
-    self.nodes: Dict[Tuple, UOp] = {}
+    self.nodes: Dict[UOp, UOp] = {}
     self.replace: Dict[UOp, UOp] = {}
+    # LRU of rewrites shared with other graph_rewrite calls, so kernels with common subgraphs only rewrite them once
+    self.cache = pm.rewrite_cache if pm.cache and ctx is None and REWRITE_CACHE and not TRACK_MATCH_STATS else None
   def rewrite(self, n:UOp) -> UOp:
     if rn := self.replace.get(n): return rn
-    replace_source = (n.op, n.dtype, new_src:=tuple(map(self.rewrite, n.src)), n.arg)
-    if found := self.nodes.get(replace_source): self.replace[n] = found
-    else:
-      x = UOp(*replace_source) if new_src != n.src else n
-      self.nodes[replace_source] = self.replace[n] = found = self.rewrite(new_x) if (new_x := self.pm.rewrite(x, self.ctx)) else x
+    if self.cache is not None and (found:=self.cache.pop(n, None)) is not None:
+      self.replace[n] = self.cache[n] = found
+      return found
+    new_src = tuple(map(self.rewrite, n.src))
+    # UOps are hash consed, so the node with the rewritten sources is the key
+    x = UOp(n.op, n.dtype, new_src, n.arg) if new_src != n.src else n
+    if found := self.nodes.get(x): self.replace[n] = found
+    else: self.nodes[x] = self.replace[n] = found = self.rewrite(new_x) if (new_x := self.pm.rewrite(x, self.ctx)) else x
+    if self.cache is not None:
+      self.cache[n] = found
+      if len(self.cache) > REWRITE_CACHE.value: del self.cache[next(iter(self.cache))]
     return found
 def graph_rewrite(sink:UOp, pm:PatternMatcher, ctx=None) -> UOp:
   if TRACK_MATCH_STATS >= 2:
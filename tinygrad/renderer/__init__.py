@@ -81,6 +81,7 @@ class Renderer:
   supports_float4: bool = True
   has_local: bool = True
   has_shared: bool = True
+  has_threads: bool = False # the outermost global dim can be split across CPU threads with OptOps.THREAD
   # NOTE: these two should be in (x,y,z) order to match the max_sizes argument in get_grouped_dims
   global_max: Optional[Tuple[int, ...]] = (0x8FFFFFFF,) * (3) # TODO: UOps.SPECIAL int32 indexes right now
   local_max: Optional[Tuple[int, ...]] = (0x8FFFFFFF,) * (3) # TODO: UOps.SPECIAL int32 indexes right now
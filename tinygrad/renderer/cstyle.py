@@ -197,12 +197,14 @@ class ClangRenderer(CStyleLanguage):
   device = "CLANG"
   float4 = "(float4)"
   has_local = False
+  has_threads = True
   global_max = None
   infinity = "__builtin_inff()"
   nan = '__builtin_nanf("")'
 
   # language options
   buffer_suffix = " restrict"
+  code_for_workitem = {"g": lambda x: "core_id"}
   type_map = {dtypes.bool:"_Bool", dtypes.half:"__fp16"}
   code_for_op = {**({k:v for k,v in CStyleLanguage().code_for_op.items() if k not in [UnaryOps.EXP2, UnaryOps.SIN, UnaryOps.LOG2]}),
                  UnaryOps.SQRT: lambda x,dtype: f"__builtin_sqrtl({x})" if dtype == dtypes.float64 else f"__builtin_sqrtf({x})",
@@ -217,6 +219,8 @@ class ClangRenderer(CStyleLanguage):
 
   def render_kernel(self, function_name, kernel, bufs, uops, prefix=None) -> str:
     prefix, macros = [self.render_vector_prefix(dt) for dt in dedup(uop.dtype for uop in uops if uop.dtype.count>1)], []
+    # threaded kernels take the core_id as the last argument
+    if any(u.op is UOps.SPECIAL for u in uops): bufs = bufs + [("core_id", (dtypes.int, False))]
     # https://github.com/corsix/amx
     for name, (N, M, _), dtype_in, _, _, _, _, _ in dedup([uop.arg for uop in uops if uop.op is UOps.WMMA]):
       macros = [
@@ -455,6 +459,7 @@ static inline __attribute__((device)) bool operator==(hip_bfloat16 a, hip_bfloat
 class DSPRenderer(ClangRenderer):
   device = "DSP"
   supports_float4 = False
+  has_threads = False
   buffer_suffix = " restrict __attribute__((align_value(128)))"
   kernel_prefix = "__attribute__((noinline)) "
   type_map = { **ClangRenderer().type_map, dtypes.uint64: "unsigned long long", dtypes.int64: "long long" }
@@ -51,6 +51,7 @@ class LLVMRenderer(Renderer):
   supports_float4 = False
   has_local = False
   has_shared = False
+  has_threads = True
   global_max = None
   code_for_op: Dict[Op, Callable] = {
     UnaryOps.RECIP: lambda builder, x, dtype: builder.fdiv(const(1, dtype), x, flags=MFLAGS),
@@ -71,6 +72,8 @@ class LLVMRenderer(Renderer):
 
     # extract global buffers (NOTE: this isn't right if DEFINE_GLOBAL is out of order)
     buf_to_dtype = {u.arg:u.dtype for u in uops if u.op in {UOps.DEFINE_GLOBAL, UOps.DEFINE_VAR}}
+    # threaded kernels take the core_id as the last argument
+    buf_to_dtype.update({u.arg:dtypes.int32 for u in uops if u.op is UOps.SPECIAL})
     buf_index = {x:i for i,x in enumerate(buf_to_dtype.keys())}
 
     # create llvm function
@@ -139,7 +142,7 @@ class LLVMRenderer(Renderer):
         elif uop is UOps.ALU:
           lvars[u] = self.code_for_op[args](bb[-1], *[lvars[x] for x in src], src[0].dtype if args in {BinaryOps.CMPLT, BinaryOps.CMPNE} else dtype)
         elif uop in {UOps.CAST, UOps.BITCAST}: lvars[u] = cast(bb, lvars[src[0]], src[0].dtype, dtype, bitcast=uop is UOps.BITCAST)
-        elif uop in {UOps.DEFINE_GLOBAL, UOps.DEFINE_VAR}: lvars[u] = func.args[buf_index[args]]
+        elif uop in {UOps.DEFINE_GLOBAL, UOps.DEFINE_VAR, UOps.SPECIAL}: lvars[u] = func.args[buf_index[args]]
         elif uop is UOps.CONST: lvars[u] = const(args, dtype)
         else: raise RuntimeError(f"failed to render {uop}")
 
@@ -1,5 +1,5 @@
-from typing import List, Dict, cast
-import ctypes
+from typing import List, Dict, Union, cast
+import ctypes, itertools
 from tinygrad.helpers import dedup, cpu_time_execution, DEBUG
 from tinygrad.engine.jit import GraphRunner, GraphException
 from tinygrad.device import Buffer, Device
@@ -14,26 +14,43 @@ class ClangGraph(GraphRunner):
     super().__init__(jit_cache, input_rawbuffers, var_vals)
     if not all(isinstance(ji.prg, CompiledRunner) for ji in jit_cache): raise GraphException
 
-    prgs = '\n'.join(dedup([cast(CompiledRunner, ji.prg).p.src for ji in jit_cache]))
+    # threaded kernels (the ones with a global_size) run on the CPU thread pool, each run of kernels between them is one batched C function
+    threaded = [cast(CompiledRunner, ji.prg).p.global_size is not None for ji in jit_cache]
+    steps = [(t, list(js)) for t,js in itertools.groupby(range(len(jit_cache)), lambda j: threaded[j])]
+    prgs = '\n'.join(dedup([cast(CompiledRunner, ji.prg).p.src for ji,t in zip(jit_cache, threaded) if not t]))
     args = [f"{render_dtype(x.dtype)}* arg{i}" for i,x in enumerate(input_rawbuffers)]
     args += sorted([f"int {v.expr}" for v in var_vals])
-    code = ["void batched("+','.join(args)+") {"]
-    for ji in jit_cache:
-      args = []
-      for buf in ji.bufs:
-        assert buf is not None
-        if buf in input_rawbuffers:
-          args.append(f"arg{input_rawbuffers.index(buf)}")
-        else:
-          args.append(f"({render_dtype(buf.dtype)}*)0x{ctypes.addressof(buf._buf):X}")
-      args += [x.expr for x in cast(CompiledRunner, ji.prg).p.vars]
-      code.append(f"  {cast(CompiledRunner, ji.prg).p.function_name}({','.join(args)});")
-    code.append("}")
+    code = []
+    for i,(t,js) in enumerate(steps):
+      if t: continue
+      code.append(f"void batched{i}("+','.join(args)+") {")
+      for j in js:
+        ji, kargs = jit_cache[j], []
+        for buf in ji.bufs:
+          assert buf is not None
+          if buf in input_rawbuffers:
+            kargs.append(f"arg{input_rawbuffers.index(buf)}")
+          else:
+            kargs.append(f"({render_dtype(buf.dtype)}*)0x{ctypes.addressof(buf._buf):X}")
+        kargs += [x.expr for x in cast(CompiledRunner, ji.prg).p.vars]
+        code.append(f"  {cast(CompiledRunner, ji.prg).p.function_name}({','.join(kargs)});")
+      code.append("}")
     if DEBUG >= 4: print("\n".join(code))
-    compiler = Device["CLANG"].compiler
-    assert compiler is not None
-    self.clprg = ClangProgram("batched", compiler.compile(prgs+"\n"+"\n".join(code))) # no point in caching the pointers
+    if code:
+      compiler = Device["CLANG"].compiler
+      assert compiler is not None
+      lib = compiler.compile(prgs+"\n"+"\n".join(code)) # no point in caching the pointers
+    self.steps: List[Union[ClangProgram, List[int]]] = [js if t else ClangProgram(f"batched{i}", lib) for i,(t,js) in enumerate(steps)]
 
   def __call__(self, rawbufs: List[Buffer], var_vals: Dict[Variable, int], wait=False):
-    return cpu_time_execution(
-    lambda: self.clprg(*[x._buf for x in rawbufs], *[x[1] for x in sorted(var_vals.items(), key=lambda x: x[0].expr)]), enable=wait)
\ No newline at end of file
+    def run():
+      bufs, vals = [x._buf for x in rawbufs], [x[1] for x in sorted(var_vals.items(), key=lambda x: x[0].expr)]
+      for step in self.steps:
+        if isinstance(step, ClangProgram):
+          step.fxn(*bufs, *vals)
+          continue
+        for j in step:
+          ji = self.jit_cache[j]
+          kbufs = [rawbufs[self.input_replace[(j,i)]] if (j,i) in self.input_replace else cast(Buffer, b) for i,b in enumerate(ji.bufs)]
+          ji.prg(kbufs, var_vals)
+    return cpu_time_execution(run, enable=wait)
\ No newline at end of file
@@ -1,7 +1,7 @@
-from typing import Optional, List
+from typing import Optional, List, Tuple
 import ctypes, subprocess, pathlib, tempfile
 from tinygrad.device import Compiled, Compiler, MallocAllocator
-from tinygrad.helpers import cpu_time_execution, DEBUG, cpu_objdump
+from tinygrad.helpers import cpu_time_execution, cpu_threaded_execution, DEBUG, cpu_objdump
 from tinygrad.renderer.cstyle import ClangRenderer
 
 class ClangCompiler(Compiler):
@@ -25,7 +25,9 @@ class ClangProgram:
       pathlib.Path(cached_file_path.name).write_bytes(lib)
       self.fxn = ctypes.CDLL(str(cached_file_path.name))[name]
 
-  def __call__(self, *bufs, vals=(), wait=False): return cpu_time_execution(lambda: self.fxn(*bufs, *vals), enable=wait)
+  def __call__(self, *bufs, vals=(), global_size:Tuple[int,int,int]=(1,1,1), local_size:Tuple[int,int,int]=(1,1,1), wait=False):
+    if global_size[0] == 1: return cpu_time_execution(lambda: self.fxn(*bufs, *vals), enable=wait)
+    return cpu_threaded_execution(lambda core_id: self.fxn(*bufs, *vals, core_id), global_size[0], enable=wait)
 
 class ClangDevice(Compiled):
   def __init__(self, device:str):
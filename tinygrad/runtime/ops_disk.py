@@ -1,6 +1,6 @@
 from __future__ import annotations
 import os, sys, mmap, _posixshmem, io, ctypes, ctypes.util, platform, contextlib
-from typing import Optional, Generator, Tuple, Callable, List
+from typing import Optional, Generator, Tuple, Callable, List, Any
 from tinygrad.helpers import OSX, round_up
 from tinygrad.device import Compiled, Allocator
 from tinygrad.runtime.autogen import io_uring, libc
@@ -31,36 +31,48 @@ class DiskAllocator(Allocator):
     else:
       dest[:] = src._buf()
 
-  def _copyout_sharded(self, src:DiskBuffer, size:int, _get_free_buf:Callable, seg_len:int) -> Generator[Tuple[int, int, int, int], None, None]:
+  def _copyout_sharded(self, srcs:List[Tuple[DiskBuffer, int]], _get_free_buf:Callable, seg_len:int) \
+      -> Generator[Tuple[int, Any, int, int, int], None, None]:
+    """reads all (src, size) in order through one io_uring queue, srcs can be in different files. yields (src index, batch, dst, src offset, size)"""
     assert hasattr(DiskDevice, 'io_uring'), "function requires io uring support"
 
-    fd_offset = src.offset - (minor_offset := src.offset % mmap.PAGESIZE)
-    processed_reqs_cnt, copied_in, next_read_offset, total_copy_size = 0, 0, 0, round_up(size + minor_offset, mmap.PAGESIZE)
-    reqs: List[Tuple[int, int, int, int]] = []
-
-    while next_read_offset < total_copy_size or len(reqs) != processed_reqs_cnt:
-      if next_read_offset < total_copy_size and (copy_batch := _get_free_buf()) is not None:
+    def _segments() -> Generator[Tuple[int, int, int, int, int, int, int], None, None]:
+      for i, (src, size) in enumerate(srcs):
+        fd_offset = src.offset - (minor_offset := src.offset % mmap.PAGESIZE)
+        copied_in, next_read_offset, total_copy_size = 0, 0, round_up(size + minor_offset, mmap.PAGESIZE)
+        while next_read_offset < total_copy_size:
+          read_len = min(seg_len, total_copy_size - next_read_offset)
+          real_copy_size = min(read_len - minor_offset, size - copied_in)
+          yield i, src.device.fd, fd_offset + next_read_offset, read_len, copied_in, minor_offset, real_copy_size
+          next_read_offset += read_len
+          copied_in += real_copy_size
+          minor_offset = 0
+
+    ring, segments, processed_reqs_cnt = DiskDevice.io_uring, _segments(), 0
+    reqs: List[Tuple[int, Any, int, int, int]] = []
+    seg = next(segments, None)
+    while seg is not None or len(reqs) != processed_reqs_cnt:
+      if seg is not None and (copy_batch := _get_free_buf()) is not None:
         # Prepare sqe
-        sqe_index = (tail:=DiskDevice.io_uring.sq.ktail[0]) & DiskDevice.io_uring.sq.kring_mask[0]
-        sqe = DiskDevice.io_uring.sq.sqes[sqe_index]
-        sqe.opcode, sqe.fd, sqe.off = io_uring.IORING_OP_READ, self.device.fd, fd_offset + next_read_offset
-        sqe.addr, sqe.len, sqe.user_data = copy_batch[0], min(seg_len, total_copy_size - next_read_offset), len(reqs)
-
-        # Send sqe
-        DiskDevice.io_uring.sq.array[sqe_index] = sqe_index
-        DiskDevice.io_uring.sq.ktail[0] = tail + 1
-        libc.syscall(io_uring.NR_io_uring_enter, DiskDevice.io_uring.ring_fd, 1, 1, io_uring.IORING_ENTER_GETEVENTS)
-
-        reqs.append((copy_batch, copied_in, minor_offset, real_copy_size:=min(sqe.len - minor_offset, size - copied_in)))
-        next_read_offset += sqe.len
-        copied_in += real_copy_size
-        minor_offset = 0
-
-      if (head:=DiskDevice.io_uring.cq.khead[0]) != DiskDevice.io_uring.cq.ktail[0]:
-        cqe = DiskDevice.io_uring.cq.cqes[head & DiskDevice.io_uring.cq.kring_mask[0]]
+        sqe_index = (tail:=ring.sq.ktail[0]) & ring.sq.kring_mask[0]
+        sqe = ring.sq.sqes[sqe_index]
+        sqe.opcode, sqe.fd, sqe.off, sqe.addr, sqe.len, sqe.user_data = io_uring.IORING_OP_READ, seg[1], seg[2], copy_batch[0], seg[3], len(reqs)
+
+        # Send sqe, don't wait for it so reads from all srcs are in flight together
+        ring.sq.array[sqe_index] = sqe_index
+        ring.sq.ktail[0] = tail + 1
+        libc.syscall(io_uring.NR_io_uring_enter, ring.ring_fd, 1, 0, 0)
+        reqs.append((seg[0], copy_batch, seg[4], seg[5], seg[6]))
+        seg = next(segments, None)
+      elif ring.cq.khead[0] == ring.cq.ktail[0] and len(reqs) != processed_reqs_cnt:
+        # no free batch, wait for a read to finish
+        libc.syscall(io_uring.NR_io_uring_enter, ring.ring_fd, 0, 1, io_uring.IORING_ENTER_GETEVENTS)
+
+      if (head:=ring.cq.khead[0]) != ring.cq.ktail[0]:
+        cqe = ring.cq.cqes[head & ring.cq.kring_mask[0]]
         assert cqe.res >= 0, f"read from disk failed, err: {cqe.res}"
         yield reqs[cqe.user_data]
-        DiskDevice.io_uring.cq.khead[0] = head + 1 # advance
+        ring.cq.khead[0] = head + 1 # advance
         processed_reqs_cnt += 1
 
   def offset(self, buf:DiskBuffer, size:int, offset:int): return DiskBuffer(buf.device, size, offset)
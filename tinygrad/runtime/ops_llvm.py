@@ -2,7 +2,7 @@ from __future__ import annotations
 import ctypes, functools
 from typing import Tuple
 from tinygrad.device import Compiled, Compiler, MallocAllocator
-from tinygrad.helpers import DEBUG, cpu_time_execution, cpu_objdump
+from tinygrad.helpers import DEBUG, cpu_time_execution, cpu_threaded_execution, cpu_objdump
 from tinygrad.renderer.llvmir import LLVMRenderer
 import llvmlite.binding as llvm
 
@@ -24,10 +24,12 @@ class LLVMProgram:
     device.engine.add_object_file(llvm.object_file.ObjectFileRef.from_data(lib))
     self.fxn = device.engine.get_function_address(name)
 
-  def __call__(self, *bufs, vals:Tuple[int, ...]=(), wait=False):
+  def __call__(self, *bufs, vals:Tuple[int, ...]=(), global_size:Tuple[int,int,int]=(1,1,1), local_size:Tuple[int,int,int]=(1,1,1), wait=False):
+    threaded = global_size[0] > 1
     if not hasattr(self, 'cfunc'):
-      self.cfunc = ctypes.CFUNCTYPE(ctypes.c_int, *([ctypes.c_void_p]*len(bufs)), *([ctypes.c_int32]*len(vals)))(self.fxn)
-    return cpu_time_execution(lambda: self.cfunc(*bufs, *vals), enable=wait)
+      self.cfunc = ctypes.CFUNCTYPE(ctypes.c_int, *([ctypes.c_void_p]*len(bufs)), *([ctypes.c_int32]*(len(vals)+threaded)))(self.fxn)
+    if not threaded: return cpu_time_execution(lambda: self.cfunc(*bufs, *vals), enable=wait)
+    return cpu_threaded_execution(lambda core_id: self.cfunc(*bufs, *vals, core_id), global_size[0], enable=wait)
 
 class LLVMDevice(Compiled):
   def __init__(self, device:str):
@@ -2,12 +2,13 @@
 # a python uops emulator
 # works to test the tensor cores, and all the uops in general
 # this is the (living) definition of uops
-from typing import Tuple, List, Optional, Any, Dict
-import pickle, base64, itertools, time, struct
+from typing import Tuple, List, Optional, Any, Dict, Callable, Union
+import pickle, base64, itertools, time, struct, math
+import numpy as np
 from tinygrad.dtype import DType, dtypes, ImageDType
 from tinygrad.helpers import all_same, getenv, flatten, prod
 from tinygrad.device import Compiled, Compiler, Allocator
-from tinygrad.ops import BinaryOps, TernaryOps, exec_alu, truncate, UOps, UOp
+from tinygrad.ops import BinaryOps, TernaryOps, UnaryOps, Op, exec_alu, python_alu, truncate, UOps, UOp
 from tinygrad.renderer import Renderer
 from tinygrad.renderer.cstyle import CUDARenderer, MetalRenderer, AMDRenderer, IntelRenderer, ClangRenderer
 
@@ -23,6 +24,64 @@ def _store(m, i, v):
   if i < 0 or i >= len(m): raise IndexError(f"store out of bounds, size is {len(m)}, access is {i}, value is {v}")
   m[i] = v
 
+# here are the models for the WMMA instruction on the different hardware
+# inp is A, B and C as a list of elements with a value for each thread of the warp
+def wmma(arg, inp:List[List[Any]], warp_size:int) -> List[List[Any]]:
+  def wmma_helper(WARP_THREADS, K, NUM_A, NUM_B, NUM_C, a_elem, b_elem, c_map):
+    assert len(inp[0]) == NUM_A, f"A must have {NUM_A} elements per thread, it has {len(inp[0])}"
+    assert len(inp[1]) == NUM_B, f"B must have {NUM_B} elements per thread, it has {len(inp[1])}"
+    assert len(inp[2]) == NUM_C, f"C must have {NUM_C} elements per thread, it has {len(inp[2])}"
+    assert len(flatten(inp[0])) == NUM_A * warp_size, f"WMMA must have {NUM_A * warp_size} total elements for A in WMMA"
+    assert len(flatten(inp[1])) == NUM_B * warp_size, f"WMMA must have {NUM_B * warp_size} total elements for B in WMMA"
+    assert len(flatten(inp[2])) == NUM_C * warp_size, f"WMMA must have {NUM_C * warp_size} total elements for C in WMMA"
+    assert warp_size > 0 and warp_size % WARP_THREADS == 0, f"must have multiples of {WARP_THREADS} warp threads"
+    out = [inp[2][elem_idx][:] for elem_idx in range(NUM_C)]
+    for goff in range(0, warp_size, WARP_THREADS):
+      for lane_id in range(WARP_THREADS):
+        for elem_idx in range(NUM_C): # calculate new muls and add to acc
+          (c_i, c_j) = c_map(lane_id, elem_idx)
+          out[elem_idx][goff+lane_id] += sum(a_elem(inp[0], _k, c_j, goff) * b_elem(inp[1], c_i, _k, goff) for _k in range(K))
+    return out
+
+  # TODO: refactor these to a shared TensorCoreLayout in kernel.py
+  if arg[4] == "METAL":
+    # A (2 elements on 32 threads): row major
+    def a_b_elem(x, i, j, goff): return x[(i%2)][goff+(i//2)%2+(j%4)*2+(i//4)*8+(j//4)*16]
+    # (i, j), C, D (2 elements on 32 threads): row major same as A/B
+    def c_map(lane, elem): return (elem + ((lane%2)*2) + ((lane//8)%2)*4, ((lane//2)%4) + (lane//16)*4)
+    return wmma_helper(32, 8, 2, 2, 2, a_b_elem, a_b_elem, c_map)
+  elif arg[4] == "AMD":
+    # A (16 elements on 32 threads): col major, lane 16-32 == lane 0-15
+    def a_elem(x, i, j, goff):
+      assert np.all(x[i][goff+j] == x[i][goff+j+16]), "warp elements not duplicated properly across lanes"
+      return x[i][goff+j]
+    # B (16 elements on 32 threads): row major, lane 16-32 == lane 0-15
+    def b_elem(x, i, j, goff): return a_elem(x, j, i, goff)  # pylint: disable=arguments-out-of-order
+    def c_map(lane, elem): return (lane%16, lane//16+elem*2) # (i, j), C, D (8 elements on 32 threads): row major
+    return wmma_helper(32, 16, 16, 16, 8, a_elem, b_elem, c_map)
+  elif arg[4] == "CUDA":
+    # A (8 elements on 32 threads)
+    def a_elem(x, i, j, goff): return x[(i%2)+(j//8)*2+(i//8)*4][goff+((i//2)%4)+(j%8)*4]
+    # B (4 elements on 32 threads)
+    def b_elem(x, i, j, goff): return x[(j%2)+(j//8)*2][goff+(j//2)%4+(i)*4]
+    # (i, j), C, D (4 elements on 32 threads)
+    def c_map(lane, elem): return ((elem%2)+(lane%4)*2, (lane//4)+(elem//2)*8)
+    return wmma_helper(32, 16, 8, 4, 4, a_elem, b_elem, c_map)
+  elif arg[4] == "INTEL":
+    # A (16 elements on 8 threads)
+    def a_elem(x, i, j, goff): return x[i%2+j*2][goff+i//2]
+    # B (16 elements on 8 threads)
+    def b_elem(x, i, j, goff): return x[j][goff+i]
+    # C, D (8 elements on 8 threads)
+    def c_map(lane, elem): return (lane, elem)
+    return wmma_helper(8, 16, 16, 16, 8, a_elem, b_elem, c_map)
+  elif arg[4] == "CLANG":
+    wmma_sz = [prod(x[1] for x in l) for l in arg[6]]
+    def elem(x, i, j, _): return x[i+j][0]
+    def c_map(_, elem): return (elem%wmma_sz[0], elem//wmma_sz[0])
+    return wmma_helper(1, 1, wmma_sz[0], wmma_sz[1], wmma_sz[2], elem, elem, c_map)
+  else: raise NotImplementedError(f"unimplemented tensor core {arg}")
+
 class PythonProgram:
   def __init__(self, name:str, lib:bytes):
     self.uops: List[Tuple[UOps, Optional[DType], List[int], Any]] = pickle.loads(lib)
@@ -129,62 +188,7 @@ class PythonProgram:
         elif uop is UOps.GEP:
           assert len(arg) == 1
           ul[i] = inp[0][arg[0]]
-        elif uop is UOps.WMMA:
-          # here are the models for the WMMA instruction on the different hardware
-          def wmma_helper(WARP_THREADS, K, NUM_A, NUM_B, NUM_C, a_elem, b_elem, c_map):
-            assert len(inp[0]) == NUM_A, f"A must have {NUM_A} elements per thread, it has {len(inp[0])}"
-            assert len(inp[1]) == NUM_B, f"B must have {NUM_B} elements per thread, it has {len(inp[1])}"
-            assert len(inp[2]) == NUM_C, f"C must have {NUM_C} elements per thread, it has {len(inp[2])}"
-            assert len(flatten(inp[0])) == NUM_A * warp_size, f"WMMA must have {NUM_A * warp_size} total elements for A in WMMA"
-            assert len(flatten(inp[1])) == NUM_B * warp_size, f"WMMA must have {NUM_B * warp_size} total elements for B in WMMA"
-            assert len(flatten(inp[2])) == NUM_C * warp_size, f"WMMA must have {NUM_C * warp_size} total elements for C in WMMA"
-            assert warp_size > 0 and warp_size % WARP_THREADS == 0, f"must have multiples of {WARP_THREADS} warp threads"
-            out = [inp[2][elem_idx][:] for elem_idx in range(NUM_C)]
-            for goff in range(0, warp_size, WARP_THREADS):
-              for lane_id in range(WARP_THREADS):
-                for elem_idx in range(NUM_C): # calculate new muls and add to acc
-                  (c_i, c_j) = c_map(lane_id, elem_idx)
-                  out[elem_idx][goff+lane_id] += sum(a_elem(inp[0], _k, c_j, goff) * b_elem(inp[1], c_i, _k, goff) for _k in range(K))
-            return out
-
-          # TODO: refactor these to a shared TensorCoreLayout in kernel.py
-          if arg[4] == "METAL":
-            # A (2 elements on 32 threads): row major
-            def a_b_elem(x, i, j, goff): return x[(i%2)][goff+(i//2)%2+(j%4)*2+(i//4)*8+(j//4)*16]
-            # (i, j), C, D (2 elements on 32 threads): row major same as A/B
-            def c_map(lane, elem): return (elem + ((lane%2)*2) + ((lane//8)%2)*4, ((lane//2)%4) + (lane//16)*4)
-            ul[i] = wmma_helper(32, 8, 2, 2, 2, a_b_elem, a_b_elem, c_map)
-          elif arg[4] == "AMD":
-            # A (16 elements on 32 threads): col major, lane 16-32 == lane 0-15
-            def a_elem(x, i, j, goff):
-              assert x[i][goff+j] == x[i][goff+j+16], "warp elements not duplicated properly across lanes"
-              return x[i][goff+j]
-            # B (16 elements on 32 threads): row major, lane 16-32 == lane 0-15
-            def b_elem(x, i, j, goff): return a_elem(x, j, i, goff)  # pylint: disable=arguments-out-of-order
-            def c_map(lane, elem): return (lane%16, lane//16+elem*2) # (i, j), C, D (8 elements on 32 threads): row major
-            ul[i] = wmma_helper(32, 16, 16, 16, 8, a_elem, b_elem, c_map)
-          elif arg[4] == "CUDA":
-            # A (8 elements on 32 threads)
-            def a_elem(x, i, j, goff): return x[(i%2)+(j//8)*2+(i//8)*4][goff+((i//2)%4)+(j%8)*4]
-            # B (4 elements on 32 threads)
-            def b_elem(x, i, j, goff): return x[(j%2)+(j//8)*2][goff+(j//2)%4+(i)*4]
-            # (i, j), C, D (4 elements on 32 threads)
-            def c_map(lane, elem): return ((elem%2)+(lane%4)*2, (lane//4)+(elem//2)*8)
-            ul[i] = wmma_helper(32, 16, 8, 4, 4, a_elem, b_elem, c_map)
-          elif arg[4] == "INTEL":
-            # A (16 elements on 8 threads)
-            def a_elem(x, i, j, goff): return x[i%2+j*2][goff+i//2]
-            # B (16 elements on 8 threads)
-            def b_elem(x, i, j, goff): return x[j][goff+i]
-            # C, D (8 elements on 8 threads)
-            def c_map(lane, elem): return (lane, elem)
-            ul[i] = wmma_helper(8, 16, 16, 16, 8, a_elem, b_elem, c_map)
-          elif arg[4] == "CLANG":
-            wmma_sz = [prod(x[1] for x in l) for l in arg[6]]
-            def elem(x, i, j, _): return x[i+j][0]
-            def c_map(_, elem): return (elem%wmma_sz[0], elem//wmma_sz[0])
-            ul[i] = wmma_helper(1, 1, wmma_sz[0], wmma_sz[1], wmma_sz[2], elem, elem, c_map)
-          else: raise NotImplementedError(f"unimplemented tensor core {arg}")
+        elif uop is UOps.WMMA: ul[i] = wmma(arg, inp, warp_size)
         elif uop is UOps.ALU:
           assert all_same([len(x) for x in inp]), f"{[len(x) for x in inp]} doesn't match on {arg}"
           assert all_same([dtype] + dtp) or arg in {BinaryOps.CMPNE, BinaryOps.CMPLT, TernaryOps.WHERE}, f"dtype mismatch on {arg}"
@@ -193,6 +197,163 @@ class PythonProgram:
         i += 1
     return time.perf_counter() - st
 
+# *** the same emulator on numpy arrays ***
+# every uop has one value per thread of the launch, all the warps run the program together
+# floats are float64 and ints are int64 like the python values above, and they are truncated after every alu the same way
+
+def _np_reg(dtype:DType) -> type:
+  if dtype == dtypes.bool: return np.bool_
+  if dtype == dtypes.uint64: return np.uint64
+  return np.float64 if dtypes.is_float(dtype) else np.int64
+
+def _np_fmt(dtype:Optional[DType]) -> np.dtype:
+  assert dtype is not None and dtype.fmt is not None, f"no numpy type for {dtype}"
+  return np.dtype(dtype.fmt)
+
+def _np_truncate(x:np.ndarray, dtype:DType) -> np.ndarray:
+  if dtype not in truncate or dtype.fmt is None: return x
+  return x.astype(np.dtype(dtype.fmt)).astype(_np_reg(dtype))
+
+np_alu: Dict[Op, Callable] = {
+  UnaryOps.SQRT: lambda x: np.where(x >= 0, np.sqrt(x), math.nan), UnaryOps.RECIP: lambda x: np.divide(1.0, x),
+  BinaryOps.SHR: np.right_shift, BinaryOps.SHL: np.left_shift,
+  BinaryOps.MUL: np.multiply, BinaryOps.ADD: np.add, BinaryOps.XOR: np.bitwise_xor, BinaryOps.OR: np.bitwise_or, BinaryOps.AND: np.bitwise_and,
+  BinaryOps.MAX: lambda x,y: np.where(y > x, y, x), BinaryOps.CMPNE: np.not_equal, BinaryOps.CMPLT: np.less,
+  BinaryOps.MOD: lambda x,y: np.where(x < 0, -(r:=np.abs(x) % np.abs(y)), r),
+  BinaryOps.IDIV: lambda x,y: np.where((x < 0) != (y < 0), -(q:=np.abs(x) // np.abs(y)), q),
+  TernaryOps.MULACC: lambda x,y,z: (x*y)+z, TernaryOps.WHERE: np.where}
+
+def np_exec_alu(op:Op, dtype:DType, operands:List[np.ndarray]) -> np.ndarray:
+  with np.errstate(all="ignore"):
+    # the transcendentals come from the math module, numpy's aren't rounded the same
+    if op not in np_alu: ret = np.array([python_alu[op](*x) for x in zip(*[o.ravel().tolist() for o in operands])]).reshape(operands[0].shape)
+    else: ret = np_alu[op](*operands)
+    return _np_truncate(ret.astype(_np_reg(dtype)), dtype)
+
+class NumpyBuffer:
+  def __init__(self, mem:np.ndarray, size:int, off:Union[int, np.ndarray]=0): self.mem, self.size, self.off = mem, size, off
+  def _check(self, idx:np.ndarray, valid:np.ndarray, op:str, val:Optional[np.ndarray]=None):
+    if (oob:=valid & ((idx < 0) | (idx >= self.size))).any():
+      raise IndexError(f"{op} out of bounds, size is {self.size}, access is {idx[oob][0]}" + ("" if val is None else f", value is {val[oob][0]}"))
+  def load(self, idx:np.ndarray, gate:Optional[np.ndarray]=None, default:Optional[np.ndarray]=None) -> np.ndarray:
+    valid = np.ones(idx.shape, dtype=np.bool_) if gate is None else gate
+    self._check(idx, valid, "load")
+    ret = self.mem[np.where(valid, idx, 0) + self.off]
+    if gate is None: return ret
+    assert default is not None, "gated load without a default"
+    return np.where(gate, ret, default)
+  def store(self, idx:np.ndarray, val:np.ndarray, gate:Optional[np.ndarray]=None):
+    valid = np.ones(idx.shape, dtype=np.bool_) if gate is None else gate
+    self._check(idx, valid, "store", val)
+    # numpy writes a repeated index in order, so the last thread wins like in the loop above
+    self.mem[(idx + self.off)[valid]] = val[valid]
+
+class PythonNumpyProgram(PythonProgram):
+  def __call__(self, *bufs, global_size:Tuple[int,int,int]=(1,1,1), local_size:Tuple[int,int,int]=(1,1,1), vals:Tuple[int, ...]=(), wait=False):
+    st = time.perf_counter()
+    warp_size, groups = prod(local_size), prod(global_size)
+    mems = [np.frombuffer(b, dtype=_np_fmt(u[1])) for b,u in zip(bufs, [u for u in self.uops if u[0] is UOps.DEFINE_GLOBAL])]
+    # the warps are independent, run as many at once as fit in a bounded number of threads
+    step = max(1, getenv("PYTHON_THREADS", 1<<16) // warp_size)
+    for g0 in range(0, groups, step):
+      self._run(mems, vals, global_size, local_size, np.arange(g0*warp_size, min(groups, g0+step)*warp_size))
+    return time.perf_counter() - st
+
+  def _run(self, mems:List[np.ndarray], vals:Tuple[int, ...], global_size:Tuple[int,int,int], local_size:Tuple[int,int,int], tid:np.ndarray):
+    warp_size, n = prod(local_size), len(tid)
+    # gidx0 and lidx0 change fastest, the order of itertools.product above
+    gid, lid = tid // warp_size, tid % warp_size
+    def special(x:np.ndarray, size:Tuple[int,int,int], dim:int) -> np.ndarray: return x // prod(size[:dim]) % size[dim]
+    def lanes(x:np.ndarray) -> List[List[np.ndarray]]: return [[v.reshape(-1, warp_size)[:, j].copy() for j in range(warp_size)] for v in x]
+    ul: Dict[int, Any] = {}
+    dl: Dict[int, DType] = {}
+    pmems, pvals = list(mems), list(vals)
+    i = 0
+    loop_ends: Dict[int, int] = {}
+    void_ops = {UOps.STORE, UOps.ENDRANGE, UOps.BARRIER, UOps.IF, UOps.ENDIF}
+    while i < len(self.uops):
+      uop, dtype, idp, arg = self.uops[i]
+      if uop is UOps.DEFINE_ACC: idp = [idp[0]]
+      inp = [ul[v] for v in idp if self.uops[v][0] not in void_ops]
+      dtp = [dl[v] for v in idp if self.uops[v][0] not in void_ops]
+      if getenv("TRACE"): print(i, uop, dtype, arg, inp, dtp)
+      if uop is UOps.STORE:
+        gate = inp[3] if len(inp) == 4 else None
+        if isinstance(dtp[0], ImageDType):
+          assert dtp[2].count == 4
+          ox, oy = inp[1]
+          assert np.all((ox >= 0) & (ox < dtp[0].shape[1]) & (oy >= 0) & (oy < dtp[0].shape[0]))
+          for j,val in enumerate(inp[2]): inp[0].store(ox*4 + oy*dtp[0].shape[1]*4 + j, val, gate)
+        elif dtp[2].count > 1:
+          for j,val in enumerate(inp[2]): inp[0].store(inp[1]+j, val, gate)
+        else: inp[0].store(inp[1], inp[2], gate)
+        i += 1
+        continue
+      if uop is UOps.ENDRANGE:
+        loop_ends[idp[0]] = i
+        i = idp[0]
+        continue
+      if uop in (UOps.BARRIER, UOps.IF, UOps.ENDIF):
+        i += 1
+        continue
+      assert dtype is not None, f"{uop} is missing a dtype"
+      dl[i] = dtype
+      if uop is UOps.DEFINE_GLOBAL:
+        mem = pmems.pop(0)
+        ul[i] = NumpyBuffer(mem, len(mem))
+      elif uop is UOps.DEFINE_LOCAL:
+        # a local buffer for each warp
+        ul[i] = NumpyBuffer(np.zeros(arg[1]*(gid[-1]-gid[0]+1), dtype=_np_fmt(dtype)), arg[1], (gid-gid[0])*arg[1])
+      elif uop is UOps.DEFINE_VAR: ul[i] = np.full(n, pvals.pop(0), dtype=np.int64)
+      elif uop is UOps.SPECIAL:
+        if arg[0][0] == 'g': ul[i] = special(gid, global_size, int(arg[0][-1]))
+        elif arg[0][0] == 'l': ul[i] = special(lid, local_size, int(arg[0][-1]))
+      elif uop is UOps.CONST:
+        # float consts stay python doubles like above, ints wrap to fit the register (-1 in a uint64)
+        ul[i] = np.full(n, truncate[dtype](arg) if dtypes.is_int(dtype) else arg, dtype=_np_reg(dtype))
+      elif uop is UOps.DEFINE_ACC: ul[i] = inp[0].copy()
+      elif uop is UOps.RANGE:
+        if i not in ul: ul[i] = np.full(n, inp[0][0], dtype=np.int64)
+        else:
+          ul[i] += 1
+          if ul[i][0] == inp[1][0]:
+            del ul[i]
+            i = loop_ends[i] + 1
+            continue
+      elif uop is UOps.VECTORIZE: ul[i] = np.stack(inp)
+      elif uop is UOps.BITCAST:
+        ul[i] = inp[0].astype(_np_fmt(dtp[0])).view(_np_fmt(dtype)).astype(_np_reg(dtype))
+      elif uop is UOps.CAST:
+        # int() truncates a float towards zero
+        x = np.trunc(inp[0]) if dtypes.is_int(dtype) and dtypes.is_float(dtp[0]) else inp[0]
+        with np.errstate(all="ignore"): ul[i] = _np_truncate(x.astype(_np_reg(dtype)), dtype)
+      elif uop is UOps.LOAD:
+        if isinstance(dtp[0], ImageDType):
+          assert dtype.count == 4
+          ox, oy = inp[1]
+          valid = (ox >= 0) & (ox < dtp[0].shape[1]) & (oy >= 0) & (oy < dtp[0].shape[0])
+          ul[i] = np.stack([inp[0].load(ox*4 + oy*dtp[0].shape[1]*4 + j, valid, 0) for j in range(dtype.count)]).astype(_np_reg(dtype))
+        elif dtype.count > 1:
+          ul[i] = np.stack([inp[0].load(inp[1]+j, *[inp[k][j] if dtp[k].count > 1 else inp[k] for k in (3, 2)[:len(inp)-2]])
+                            for j in range(dtype.count)]).astype(_np_reg(dtype))
+        else: ul[i] = inp[0].load(inp[1], *inp[3:1:-1]).astype(_np_reg(dtype))
+      elif uop is UOps.ASSIGN:
+        inp[0][...] = inp[1]
+        ul[i] = inp[0]
+      elif uop is UOps.GEP:
+        assert len(arg) == 1
+        ul[i] = inp[0][arg[0]].copy()
+      elif uop is UOps.WMMA:
+        # the warp lanes of the model are arrays over all the warps
+        out = wmma(arg, [lanes(x) for x in inp], warp_size)
+        ul[i] = np.stack([np.stack(x, axis=1).reshape(-1) for x in out])
+      elif uop is UOps.ALU:
+        assert all_same([x.shape for x in inp]), f"{[x.shape for x in inp]} doesn't match on {arg}"
+        assert all_same([dtype] + dtp) or arg in {BinaryOps.CMPNE, BinaryOps.CMPLT, TernaryOps.WHERE}, f"dtype mismatch on {arg}"
+        ul[i] = np_exec_alu(arg, dtype, inp)
+      assert i in ul, (uop, dtype, idp, arg)
+      i += 1
+
 class PythonRenderer(Renderer):
   device = "PYTHON"
   def __init__(self):
@@ -216,4 +377,4 @@ class PythonAllocator(Allocator):
 
 class PythonDevice(Compiled):
   def __init__(self, device:str):
-    super().__init__(device, PythonAllocator(), PythonRenderer(), PythonCompiler(), PythonProgram)
+    super().__init__(device, PythonAllocator(), PythonRenderer(), PythonCompiler(), PythonProgram if getenv("PYTHON_SCALAR") else PythonNumpyProgram)
@@ -1,17 +1,17 @@
 # inspired by https://github.com/karpathy/micrograd/blob/master/micrograd/engine.py
 from __future__ import annotations
-import time, math, itertools, functools, struct, sys, inspect, pathlib, string, dataclasses, hashlib
+import time, math, itertools, functools, sys, inspect, pathlib, string, dataclasses, hashlib, ctypes
 from contextlib import ContextDecorator
 from typing import List, Tuple, Callable, Optional, ClassVar, Type, Union, Sequence, Dict, DefaultDict, cast, get_args, Literal
 from collections import defaultdict
 import numpy as np
 
 from tinygrad.dtype import DType, DTypeLike, dtypes, ImageDType, ConstType, least_upper_float, least_upper_dtype, sum_acc_dtype, to_dtype
-from tinygrad.helpers import argfix, make_pair, flatten, prod, all_int, round_up, merge_dicts, argsort, getenv, get_shape, fully_flatten, dedup
-from tinygrad.helpers import IMAGE, DEBUG, WINO, _METADATA, Metadata, TRACEMETA
+from tinygrad.helpers import argfix, make_pair, flatten, prod, all_int, round_up, merge_dicts, argsort, getenv, fully_flatten, dedup
+from tinygrad.helpers import IMAGE, DEBUG, WINO, _METADATA, Metadata, TRACEMETA, Context, FLASH_ATTENTION, ONEPASS_VAR
 from tinygrad.lazy import LazyBuffer
 from tinygrad.multi import MultiLazyBuffer
-from tinygrad.ops import MetaOps, truncate
+from tinygrad.ops import MetaOps
 from tinygrad.device import Device, Buffer, BufferOptions
 from tinygrad.shape.symbolic import sint, Variable, MulNode, SumNode, NumNode, Node
 from tinygrad.engine.realize import run_schedule, memory_planner
@@ -47,25 +47,35 @@ def _metaop(op, shape:Tuple[sint,...], dtype:DType, device:Union[str, Tuple[str,
 def _from_np_dtype(npdtype:np.dtype) -> DType: return dtypes.fields()[np.dtype(npdtype).name]
 def _to_np_dtype(dtype:DType) -> Optional[type]: return np.dtype(dtype.fmt).type if dtype.fmt is not None else None
 
-def _fromnp(x: np.ndarray) -> LazyBuffer:
-  ret = LazyBuffer.metaop(MetaOps.EMPTY, x.shape, _from_np_dtype(x.dtype), "NPY")
-  # fake realize
-  ret.buffer.allocate(x)
-  del ret.srcs
-  return ret
-
-def _frompy(x:Union[List, Tuple, bytes], dtype:DType) -> LazyBuffer:
-  if isinstance(x, bytes): ret, data = LazyBuffer.metaop(MetaOps.EMPTY, (len(x)//dtype.itemsize,), dtype, "PYTHON"), x
+def _fromnp(x: np.ndarray, device:Optional[str]=None) -> LazyBuffer:
+  # with a CLANG or LLVM device a contiguous array is used in place, the tensor shares memory with it and keeps it alive
+  if device is not None and device.split(":")[0] in {"CLANG", "LLVM"} and x.flags.c_contiguous and x.flags.writeable and x.ctypes.data % 16 == 0 \
+     and x.size:
+    ret = LazyBuffer.metaop(MetaOps.EMPTY, x.shape, _from_np_dtype(x.dtype), device)
+    ret.buffer.options = BufferOptions(external_ptr=x.ctypes.data)
+    (opaque:=(ctypes.c_uint8 * x.nbytes).from_address(x.ctypes.data))._owner = x  # type: ignore[attr-defined]
+    ret.buffer.allocate(opaque)
   else:
-    ret = LazyBuffer.metaop(MetaOps.EMPTY, get_shape(x), dtype, "PYTHON")
-    assert dtype.fmt is not None, f"{dtype=} has None fmt"
-    truncate_function = truncate[dtype]
-    data = struct.pack(f"@{ret.size}{dtype.fmt}", *[truncate_function(xi) for xi in fully_flatten(x)])
-  # fake realize
-  ret.buffer.allocate(memoryview(data))
+    ret = LazyBuffer.metaop(MetaOps.EMPTY, x.shape, _from_np_dtype(x.dtype), "NPY")
+    # fake realize
+    ret.buffer.allocate(x)
   del ret.srcs
   return ret
 
+def _frompy(x:Union[List, Tuple, bytes], dtype:Optional[DType], device:Optional[str]=None) -> LazyBuffer:
+  if isinstance(x, bytes):
+    assert dtype is not None, "bytes need a dtype"
+    ret = LazyBuffer.metaop(MetaOps.EMPTY, (len(x)//dtype.itemsize,), dtype, "PYTHON")
+    # fake realize
+    ret.buffer.allocate(memoryview(x))
+    del ret.srcs
+    return ret
+  # numpy converts the nested list in one go, a list of bools is bool, of ints is int and anything else is float
+  data = np.array(x)
+  if dtype is None: dtype = dtypes.bool if data.dtype == np.bool_ else dtypes.default_int if data.dtype.kind in "iu" else dtypes.default_float
+  if dtype == dtypes.bfloat16: return cast(LazyBuffer, Tensor(_fromnp(data.astype(np.float32)), device=device).cast(dtypes.bfloat16).lazydata)
+  return _fromnp(data.astype(_to_np_dtype(dtype)), device)
+
 def _get_winograd_matcols(mat, dims:int, shp:Tuple[sint, ...], device:Union[str, Tuple[str, ...]]) -> List[List[Tensor]]:
   return [[Tensor.cat(*[Tensor.full(shp[:dim] + (1,) + shp[dim+1:], float(m[k]), device=device) for m in mat], dim=dim)
            for k in range(len(mat[0]))] for dim in range(dims)]
@@ -128,12 +138,7 @@ class Tensor:
     elif isinstance(data, get_args(ConstType)): data = _metaop(MetaOps.CONST, tuple(), dtype or dtypes.from_py(data), device, data)
     elif isinstance(data, Variable): data = _metaop(MetaOps.CONST, tuple(), dtype or dtypes.from_py(data.unbind()[1]), device, data)
     elif isinstance(data, bytes): data = _frompy(data, dtypes.uint8 if dtype is None else dtype)
-    elif isinstance(data, (list, tuple)):
-      if dtype is None:
-        if (d := fully_flatten(data)) and all(isinstance(s, bool) for s in d): dtype = dtypes.bool
-        else: dtype = dtypes.default_int if d and all_int(d) else dtypes.default_float
-      if dtype == dtypes.bfloat16: data = Tensor(_fromnp(np.array(data, np.float32)), device=device).cast(dtypes.bfloat16).lazydata
-      else: data = _fromnp(np.array(data).astype(_to_np_dtype(dtype)))
+    elif isinstance(data, (list, tuple)): data = _frompy(data, dtype, device if isinstance(device, str) else None)
     elif data is None: data = _metaop(MetaOps.EMPTY, (0,), dtype or dtypes.default_float, device)
     elif isinstance(data, np.ndarray):
       if data.shape == (): data = _metaop(MetaOps.CONST, tuple(), dtype or _from_np_dtype(data.dtype), device, data.item())
@@ -251,10 +256,14 @@ class Tensor:
   def _data(self) -> memoryview:
     if 0 in self.shape: return memoryview(bytearray(0))
     # NOTE: this realizes on the object from as_buffer being a Python object
-    cpu = self.cast(self.dtype.scalar()).contiguous().to("CLANG").realize()
-    buf = cast(Buffer, cast(LazyBuffer, cpu.lazydata).base.realized)
-    if self.device != "CLANG": buf.options = BufferOptions(nolru=True)
-    return buf.as_buffer(allow_zero_copy=True if self.device != "CLANG" else False)
+    cpu = self.cast(self.dtype.scalar()).contiguous()
+    # host memory doesn't need a copy to CLANG
+    if not isinstance(self.device, str) or self.device.split(":")[0] not in {"CLANG", "LLVM"}: cpu = cpu.to("CLANG")
+    buf = cast(Buffer, cast(LazyBuffer, cpu.realize().lazydata).base.realized)
+    # a buffer made here is returned without a copy, the memoryview keeps it alive
+    # the tensor's own buffer is copied, an assign or a JIT can write it again
+    own = self.lazydata.base.buffer if isinstance(self.lazydata, LazyBuffer) else None
+    return buf.as_buffer(allow_zero_copy=buf.base is not own)
 
   def data(self) -> memoryview:
     """
@@ -368,6 +377,22 @@ class Tensor:
     if isinstance(y, SumNode): return Tensor.from_node(y.nodes[0], **kwargs) + sum(y.nodes[1:])
     raise RuntimeError(f"unhandled Node {y}")
 
+  @staticmethod
+  def from_numpy(x:np.ndarray, device:Optional[str]=None, requires_grad:Optional[bool]=None) -> Tensor:
+    """
+    Creates a tensor that shares memory with the numpy array `x`, like `torch.from_numpy`.
+    On CLANG and LLVM a writable, C contiguous, 16 byte aligned array is used in place, so writes to either show up in the other.
+    Other arrays and devices get a copy, like `Tensor(x)` always does.
+
+    ```python exec="true" source="above" session="tensor" result="python"
+    import numpy as np
+    t = Tensor.from_numpy(np.arange(4, dtype=np.float32))
+    print(t.numpy())
+    ```
+    """
+    if x.shape == (): return Tensor(x, device, requires_grad=requires_grad)
+    return Tensor(_fromnp(x, Device.canonicalize(device)), device, requires_grad=requires_grad)
+
   # ***** creation entrypoint *****
 
   @staticmethod
@@ -1141,7 +1166,10 @@ class Tensor:
     assert all(s >= i for d,(s,i) in enumerate(zip(self.shape, index.shape)) if d != dim), "requires self.shape[d] >= index.shape[d] for all d != dim"
     index = index.to(self.device)
     x = self.shrink(tuple((0, i) if d != dim else None for d,i in enumerate(index.shape))).unsqueeze(-1).transpose(-1, dim)
-    return ((index.unsqueeze(-1) == Tensor.arange(self.shape[dim], requires_grad=False, device=self.device)) * x).sum(-1, acc_dtype=self.dtype)
+    mask = index.unsqueeze(-1) == Tensor.arange(self.shape[dim], requires_grad=False, device=self.device)
+    # the arange folds into this reduce and it becomes one load per element (see FUSE_ARANGE), a split reduce wouldn't fold
+    # the backward is the same mask summed over the index, a scatter-add into self
+    with Context(SPLIT_REDUCEOP=0): return (mask * x).sum(-1, acc_dtype=self.dtype)
 
   def cat(self:Tensor, *args:Tensor, dim:int=0) -> Tensor:
     """
@@ -1596,9 +1624,20 @@ class Tensor:
     print(t.var(axis=1).numpy())
     ```
     """
-    squares = (self - self.mean(axis=axis, keepdim=True)).square()
-    n = prod([si for si, so in zip(self.shape, squares.sum(axis=axis, keepdim=True).shape) if si != so])
-    return squares.sum(axis=axis, keepdim=keepdim).div(max(0, n-correction))
+    rshape = self.sum(axis=axis, keepdim=True).shape
+    n = prod([si for si, so in zip(self.shape, rshape) if si != so])
+    if not ONEPASS_VAR:
+      squares = (self - self.mean(axis=axis, keepdim=True)).square()
+      return squares.sum(axis=axis, keepdim=keepdim).div(max(0, n-correction))
+    # var(x) == var(x-k) for any k. with k an element of each reduced group the sums of x-k and (x-k)**2 don't depend on each other,
+    # they run in one kernel where subtracting the mean first takes a second pass over self. it cancels when k is far from the mean
+    # a sharded axis can't shrink, the mean works as k there
+    if isinstance(self.lazydata, MultiLazyBuffer) and self.lazydata.axis is not None and self.shape[self.lazydata.axis] != rshape[self.lazydata.axis]:
+      k = self.mean(axis=axis, keepdim=True)
+    else: k = self.shrink(tuple((0, min(1, si)) if si != so else None for si, so in zip(self.shape, rshape)))
+    d = (self - k.detach()).cast(least_upper_dtype(self.dtype, dtypes.float32))
+    squares = (d.square().sum(axis=axis, keepdim=keepdim) - d.sum(axis=axis, keepdim=keepdim).square().div(n)).relu()
+    return squares.div(max(0, n-correction)).cast(least_upper_float(self.dtype))
 
   def std(self, axis:Optional[Union[int, Sequence[int]]]=None, keepdim=False, correction=1):
     """
@@ -1769,6 +1808,90 @@ class Tensor:
     """
     return (-self).argmax(axis=axis, keepdim=keepdim)
 
+  @staticmethod
+  def _beats(x:Tensor, pos:Tensor, y:Tensor, ypos:Tensor, largest:bool) -> Tensor:
+    # total order on (value, position), equal values keep their original order
+    return (x == y).where(pos < ypos, x > y if largest else x < y)
+
+  def sort(self, dim:int=-1, descending:bool=False) -> Tuple[Tensor, Tensor]:
+    """
+    Sorts the tensor along `dim` with a bitonic sorting network and returns the sorted values and their indices.
+    The sort is stable, equal values keep their original order.
+
+    ```python exec="true" source="above" session="tensor" result="python"
+    t = Tensor([[3, 1, 2], [0, 5, 5]])
+    values, indices = t.sort(descending=True)
+    print(values.numpy())
+    print(indices.numpy())
+    ```
+    """
+    dim = self._resolve_dim(dim)
+    x, n = self.transpose(dim, -1), self.shape[dim]
+    # pad to a power of two with values that sort last, their indices are past the end so they come after equal values
+    n2 = 1 << max(n-1, 0).bit_length()
+    x = x.pad((None,)*(x.ndim-1) + ((0, n2-n),), value=dtypes.min(self.dtype) if descending else dtypes.max(self.dtype))
+    idx = Tensor.arange(n2, device=self.device, requires_grad=False).expand(x.shape)
+    k = 2
+    while k <= n2:
+      j, first = k // 2, True
+      while j >= 1:
+        # compare element i with i+j in each block of 2j, the first pass of k compares with the mirrored element instead
+        xs, ids = x.reshape(*x.shape[:-1], n2//(2*j), 2, j), idx.reshape(*x.shape[:-1], n2//(2*j), 2, j)
+        a, b, ia, ib = xs[..., 0, :], xs[..., 1, :], ids[..., 0, :], ids[..., 1, :]
+        if first: b, ib = b.flip(-1), ib.flip(-1)
+        swap = Tensor._beats(b, ib, a, ia, descending)
+        a, b, ia, ib = swap.where(b, a), swap.where(a, b), swap.where(ib, ia), swap.where(ia, ib)
+        if first: b, ib = b.flip(-1), ib.flip(-1)
+        x, idx = a.stack(b, dim=-2).reshape(x.shape).contiguous(), ia.stack(ib, dim=-2).reshape(x.shape).contiguous()
+        j, first = j // 2, False
+      k *= 2
+    return x[..., :n].transpose(dim, -1), idx[..., :n].cast(dtypes.int32).transpose(dim, -1)
+
+  def argsort(self, dim:int=-1, descending:bool=False) -> Tensor:
+    """
+    Returns the indices that sort the tensor along `dim`, see `sort`.
+
+    ```python exec="true" source="above" session="tensor" result="python"
+    t = Tensor([3, 1, 2])
+    print(t.argsort().numpy())
+    ```
+    """
+    return self.sort(dim, descending)[1]
+
+  def topk(self, k:int, dim:int=-1, largest:bool=True) -> Tuple[Tensor, Tensor]:
+    """
+    Returns the `k` largest (or smallest) values along `dim` and their indices, always in sorted order.
+
+    Blocks of the input are ranked against themselves in one reduce and their top `k` kept in another,
+    so a round takes two kernels and shrinks the input by the block size over `k`.
+
+    ```python exec="true" source="above" session="tensor" result="python"
+    t = Tensor([[1, 7, 3, 9, 5], [4, 2, 8, 6, 0]])
+    values, indices = t.topk(2)
+    print(values.numpy())
+    print(indices.numpy())
+    ```
+    """
+    dim = self._resolve_dim(dim)
+    assert 0 < k <= self.shape[dim], f"k={k} must be in [1, {self.shape[dim]}]"
+    x = self.transpose(dim, -1)
+    idx = Tensor.arange(x.shape[-1], device=self.device, requires_grad=False).expand(x.shape)
+    bs, fill = max(256, 4*k), dtypes.min(self.dtype) if largest else dtypes.max(self.dtype)
+    while True:
+      # rank every element within its block, ties go to the earlier position which is also the smaller index
+      n = x.shape[-1]
+      blocks = 1 if n <= bs else -(-n // bs)
+      m = -(-n // blocks)
+      x = x.pad((None,)*(x.ndim-1) + ((0, m*blocks-n),), value=fill).reshape(*x.shape[:-1], blocks, m)
+      idx = idx.pad((None,)*(idx.ndim-1) + ((0, m*blocks-n),)).reshape(x.shape)
+      pos = Tensor.arange(m, device=self.device, requires_grad=False)
+      rank = Tensor._beats(x.unsqueeze(-2), pos, x.unsqueeze(-1), pos.unsqueeze(-1), largest).sum(-1)
+      sel = rank.unsqueeze(-1) == Tensor.arange(kk:=min(k, m), device=self.device, requires_grad=False)
+      x, idx = sel.where(x.unsqueeze(-1), 0).sum(-2), sel.where(idx.unsqueeze(-1), 0).sum(-2)
+      x, idx = x.reshape(*x.shape[:-2], blocks*kk), idx.reshape(*idx.shape[:-2], blocks*kk)
+      if blocks == 1: break
+    return x.cast(self.dtype).transpose(dim, -1), idx.cast(dtypes.int32).transpose(dim, -1)
+
   def rearrange(self, formula: str, **sizes) -> Tensor:
     """
     Rearranges input according to formula
@@ -3026,6 +3149,7 @@ class Tensor:
     print(t.mean().item(), t.std().item())
     ```
     """
+    if ONEPASS_VAR: return (self - self.mean(axis, keepdim=True)).mul(self.var(axis, keepdim=True, correction=0).add(eps).rsqrt())
     y = (self - self.mean(axis, keepdim=True))
     return y.mul((y*y).mean(axis, keepdim=True).add(eps).rsqrt())
 
@@ -3105,9 +3229,32 @@ class Tensor:
     assert all_int(self.shape), f"does not support symbolic shape {self.shape}"
     if is_causal: attn_mask = Tensor.ones(self.shape[-2], key.shape[-2], requires_grad=False, device=self.device).tril(0).cast(dtypes.bool)
     if attn_mask is not None and attn_mask.dtype == dtypes.bool: attn_mask = (attn_mask == 0).where(-float("inf"), 0)
+    # the blocked softmax is only measured faster on the cpu backends, others need FLASH_ATTENTION set
+    if (block:=FLASH_ATTENTION.value) < 0: block = 512 if isinstance(self.device, str) and self.device.split(":")[0] in {"CLANG", "LLVM"} else 0
+    if 0 < block < key.shape[-2] and all_int(key.shape) and (dropout_p == 0 or not Tensor.training):
+      return self._flash_attention(key, value, attn_mask, block)
     qk = self.matmul(key.transpose(-2,-1), acc_dtype=least_upper_dtype(self.dtype, key.dtype, dtypes.float32)) / math.sqrt(self.shape[-1])
     return ((qk+attn_mask) if attn_mask is not None else qk).softmax(-1).cast(self.dtype).dropout(dropout_p) @ value
 
+  def _flash_attention(self, key:Tensor, value:Tensor, attn_mask:Optional[Tensor], block:int) -> Tensor:
+    # online softmax over blocks of keys, only a (..., q, block) slice of qk exists at a time instead of the whole (..., q, k)
+    acc_dtype = least_upper_dtype(self.dtype, key.dtype, dtypes.float32)
+    out_shape = _broadcast_shape(self.shape[:-2], key.shape[:-2], value.shape[:-2]) + (self.shape[-2], value.shape[-1])
+    qk_shape = out_shape[:-1] + (key.shape[-2],)
+    if attn_mask is not None: attn_mask = attn_mask._broadcast_to(_broadcast_shape(attn_mask.shape, qk_shape))
+    m = Tensor.full(out_shape[:-1] + (1,), -float("inf"), dtype=acc_dtype, device=self.device)
+    l, o = m.full_like(0), Tensor.zeros(out_shape, dtype=acc_dtype, device=self.device)
+    for i in range(0, cast(int, key.shape[-2]), block):
+      qk = self.matmul(key[..., i:i+block, :].transpose(-2,-1), acc_dtype=acc_dtype) / math.sqrt(cast(int, self.shape[-1]))
+      if attn_mask is not None: qk = qk + attn_mask[..., i:i+block]
+      # the running max cancels in o / l, like the max in _softmax it needs no grad
+      m_new = m.maximum(qk.max(-1, keepdim=True).detach())
+      # rows that are fully masked so far have no max yet
+      m_safe = (m_new == -float("inf")).where(0, m_new)
+      p, corr = (qk - m_safe).exp(), (m - m_safe).exp()
+      l, o, m = l * corr + p.sum(-1, keepdim=True), o * corr + p.cast(value.dtype).matmul(value[..., i:i+block, :], acc_dtype=acc_dtype), m_new
+    return (o / l).cast(self.dtype)
+
   def _do_reduction(self, reduction:ReductionStr="mean") -> Tensor:
     if reduction not in get_args(ReductionStr): raise ValueError(f"{reduction=} must be one of {get_args(ReductionStr)}")
     reductions: Dict[str, Callable[[Tensor], Tensor]] = {"mean": Tensor.mean, "sum": Tensor.sum, "none": lambda x: x}